@@ -74,14 +74,16 @@ def interact(command,*args):
 #  Script based commands from $AUTO_DIR/97/cmds
 ##############################################
 
-def clean():
+def clean(cache=False):
     """Clean the current directory.
 
     Type FUNC() to clean the current directory.  This command will
-    delete all files of the form fort.*, *.*~, *.o, and *.exe.
+    delete all files of the form fort.*, *.*~, *.o, *.exe and *.idx.
+    Type FUNC(cache=True) to also delete all results that were stored
+    by run(...,cache=True), and all cached compiled equations.
     """
     toclean = (glob.glob("fort.*") + glob.glob("*.o") + glob.glob("*.exe")+
-               glob.glob("*.*~"))
+               glob.glob("*.*~") + glob.glob("*.idx"))
     # remove duplicates
     files = []
     for f in toclean:
@@ -89,7 +91,12 @@ def clean():
             files.append(f)
     for f in files:
         os.remove(f)
-    info("Deleting fort.* *.o *.exe *.*~ ... done\n")
+    info("Deleting fort.* *.o *.exe *.*~ *.idx ... done\n")
+    if cache:
+        import runAUTO
+        runAUTO.cleancache()
+        runAUTO.cleanexecutables()
+        info("Deleting cached run results and executables ... done\n")
 commandClean = command(clean,alias=['cl'])
 
 
@@ -221,6 +228,7 @@ def applyTemplate(text,template,templates=None):
         templates["solution"]           = "s.%s"
         templates["diagnostics"]        = "d.%s"
         templates["homcont"]           = "h.%s"
+        templates["binary"]             = "%s.npz"
 
     if text is None:
         return None
@@ -243,6 +251,8 @@ def filenameTemplate(name=None,templates=None):
     name1["bifurcationDiagram"] = applyTemplate(name,"bifurcationDiagram",templates)
     name1["solution"] = applyTemplate(name,"solution",templates)
     name1["diagnostics"] = applyTemplate(name,"diagnostics",templates)
+    if templates is None or "binary" in templates:
+        name1["binary"] = applyTemplate(name,"binary",templates)
     return name1
 
 
@@ -350,7 +360,8 @@ def merge(name1=None,name2=None,templates=None):
 commandMergeBranches = command(merge,SIMPLE,"merge",alias=['mb'])
 
 
-def subtract(name1,name2,col,branch=1,point=1,templates=None):
+def subtract(name1,name2,col,branch=1,point=1,templates=None,
+             piecewise=False):
     """Subtract branches in data files.
 
     Type z=FUNC(x,y,ref) to return the python object x, where,
@@ -366,13 +377,23 @@ def subtract(name1,name2,col,branch=1,point=1,templates=None):
     Use optional arguments branch=m, and point=n, to denote the branch and
     first point on that branch within y or 'b.yyy', where m,n are in
     {1,2,3,...}.
+    With branch=[m1,m2,...] several branches are used as a reference,
+    where point=n refers to the first one; every point is interpolated
+    in the first branch that covers its value of 'ref'.
+    With piecewise=True all monotonically increasing or decreasing parts
+    of the reference branches are used, not only the first.
     """
+    if isinstance(branch, list):
+        branches = branch
+    else:
+        branches = [branch]
     ntype = type(name1)
     if type(name1) == type(""):
         name1 = filenameTemplate(name1,templates)
         name2 = filenameTemplate(name2,templates)
     if ntype != type(""):
-        sub = name1.subtract(name2[branch-1],col,point)
+        sub = name1.subtract([name2[b-1] for b in branches],col,point,
+                             piecewise)
         info("Subtracting done\n")
         return sub
     else:
@@ -383,7 +404,8 @@ def subtract(name1,name2,col,branch=1,point=1,templates=None):
             bd2 = bd1
         else:
             bd2 = bifDiag.bifDiag(n2b)
-        sub = bd1.subtract(bd2[branch-1],col,point)
+        sub = bd1.subtract([bd2[b-1] for b in branches],col,point,
+                           piecewise)
         shutil.copy(n1b,n1b+'~')
         sub.writeFilename(n1b,'')            
         info("Subtracting done\n")
@@ -525,7 +547,7 @@ def copy(name1,name2,name3=None,name4=None,templates=None):
 commandCopyDataFiles = command(copy,alias=['cp'])
 
 
-def save(name1,name2=None,templates=None):
+def save(name1,name2=None,templates=None,format=None):
     """Save data files.
 
     Type FUNC(x,'xxx') to save bifurcation diagram x
@@ -538,12 +560,34 @@ def save(name1,name2=None,templates=None):
     Type FUNC('xxx') to save the output-files fort.7, fort.8, fort.9,
     to b.xxx, s.xxx, d.xxx.  Existing files with these names will be
     overwritten.
+
+    Type FUNC(x,'xxx',format='npz') or FUNC('xxx',format='npz') to
+    save everything to the single binary file xxx.npz instead, which
+    loadbd('xxx') reads back much faster. This requires numpy.
     """
     parsed = None
     if not name2 is None:
         parsed = name1
         name1 = name2
+    if format not in [None, "ascii", "npz"]:
+        raise AUTOExceptions.AUTORuntimeError("Unknown format: %s"%format)
     name1 = filenameTemplate(name1,templates)
+    if format == "npz":
+        n1 = name1["binary"]
+        if parsed is None:
+            parsed = bifDiag.bifDiag("fort.7","fort.8","fort.9")
+        if isinstance(parsed, parseS.AUTOSolution):
+            parsed = [parsed]
+        if (type(parsed) == type([]) and
+            isinstance(parsed[0], parseB.AUTOBranch)):
+            parsed = bifDiag.bifDiag(parsed)
+        elif not isinstance(parsed, bifDiag.bifDiag):
+            parsed = bifDiag.bifDiag(None,parsed)
+        if os.path.exists(n1):
+            shutil.copy(n1,n1+'~')
+        parsed.writeBinaryFilename(n1)
+        info("Saving to %s ... done\n"%n1)
+        return
     for s in ["bifurcationDiagram","solution","diagnostics"]:
         n1 = name1[s]
         if os.path.exists(n1):
@@ -600,6 +644,8 @@ def delete(name,templates=None):
     if os.path.exists(n1s):
         os.remove(n1s)
         info("Deleting %s ... done\n"%n1s)
+    if os.path.exists(n1s+parseS.fileS.indexsuffix):
+        os.remove(n1s+parseS.fileS.indexsuffix)
     if os.path.exists(n1d):
         os.remove(n1d)
         info("Deleting %s ... done\n"%n1d)
@@ -829,6 +875,14 @@ def move(name1,name2,name3=None,name4=None,templates=None):
             os.rename(n1,n2)
             info("Renaming %s as %s ... done\n"%(n1,n2))
             done = True
+        if s == "solution":
+            # keep the solution index with its solution file
+            n1 += parseS.fileS.indexsuffix
+            n2 += parseS.fileS.indexsuffix
+            if os.path.exists(n2):
+                os.remove(n2)
+            if os.path.exists(n1):
+                os.rename(n1,n2)
     if not done:
         raise AUTOExceptions.AUTORuntimeError(
             "Renaming: no files found for %s and %s"%(
@@ -866,7 +920,7 @@ def hcn(name,templates=None):
 commandParseHomcontFile = command(hcn)
 
         
-def sl(name=None,templates=None):
+def sl(name=None,templates=None,mmap=False,index=False):
     """Parse solution file:
 
     Type FUNC('xxx') to get a parsed version of the solution file
@@ -874,11 +928,20 @@ def sl(name=None,templates=None):
 
     This is equivalent to the command
     loadbd('xxx')()
+
+    Type FUNC('xxx',mmap=True) to map the file into memory, so that the
+    solutions are parsed from there and only kept by the solutions that
+    use them.
+
+    Type FUNC('xxx',index=True) to write the index s.xxx.idx next to the
+    solution file, so that later calls do not need to scan the whole file
+    to find the solutions. The index is rewritten when the solution file
+    changes, and an index that exists is always used.
     """
     name = filenameTemplate(name,templates)
     n1s = name["solution"] or "fort.8"
     try:
-        data = parseS.parseS(n1s)
+        data = parseS.parseS(n1s,usemmap=mmap,index=index)
     except IOError:
         raise AUTOExceptions.AUTORuntimeError(sys.exc_info()[1])
     if isinstance(n1s, str):
@@ -940,9 +1003,8 @@ def queryDiagnostic(diagnostic,name=None,templates=None):
     except TypeError:
         for branch in n1d:
             if hasattr(branch,"diagnostics"):
-                for s in str(branch.diagnostics).splitlines():
-                    if diagnostic in s:
-                        info(s+"\n")
+                for s in branch.diagnostics.grep(diagnostic):
+                    info(s+"\n")
         info("\n")
         return
     for s in f:
@@ -1399,7 +1461,8 @@ def load(data=None,runner=None,templates=None,**kw):
 commandRunnerLoadName = command(load,SIMPLE,"loadname",alias=['ld'])
 
 
-def loadbd(name=None,templates=None,**kw):
+def loadbd(name=None,templates=None,format=None,columns=None,mmap=False,
+           index=False,**kw):
     """Load bifurcation diagram files.
 
     Type b=FUNC([options]) to load output files or output data.
@@ -1417,6 +1480,18 @@ def loadbd(name=None,templates=None,**kw):
     FUNC(b='name',s='name,d='name').
     plot(b) will then plot the 'b' and 's' components.
 
+    If only the binary file name.npz written by save(b,'name',format='npz')
+    exists, or if format='npz' is given, FUNC('name') loads that file.
+    Its solutions are only read from the file when they are accessed.
+
+    Type FUNC('name',columns=['PAR(1)','L2-NORM']) to only parse the given
+    columns of the bifurcation diagram; other columns are parsed when they
+    are first accessed.
+
+    Type FUNC('name',mmap=True) to map the solution file into memory, as
+    with sl('name',mmap=True), and FUNC('name',index=True) to write an
+    index of the solution file, as with sl('name',index=True).
+
     Returns a bifurcation diagram object representing the files in b.
     """
     def __applyBsdConfigResolveAbbreviation(**kw):
@@ -1439,6 +1514,26 @@ def loadbd(name=None,templates=None,**kw):
                     kw[abbrev[key]] = value
         return kw
 
+    if format not in [None, "ascii", "npz"]:
+        raise AUTOExceptions.AUTORuntimeError("Unknown format: %s"%format)
+    if type(name) == type("") and kw == {} and format != "ascii":
+        names = filenameTemplate(name,templates)
+        if format is None and "binary" in names:
+            # use the binary file if there are no text files
+            format = "npz"
+            for key in ["bifurcationDiagram", "solution", "diagnostics"]:
+                if os.path.exists(names[key]):
+                    format = None
+            if not os.path.exists(names["binary"]):
+                format = None
+        if format == "npz":
+            data = bifDiag.bifDiag()
+            data.readBinaryFilename(names["binary"])
+            if columns is not None:
+                data = data.project(columns)
+            info("Parsed output data\n")
+            return data
+
     if name is not None:
         if AUTOutil.isiterable(name):
             lst = ["bifurcationDiagram"]
@@ -1455,7 +1550,15 @@ def loadbd(name=None,templates=None,**kw):
         sname = dict.get("solution")
         dname = dict.get("diagnostics")
 
+    if (mmap or index) and isinstance(sname, str):
+        try:
+            sname = parseS.parseS(sname,usemmap=mmap,index=index)
+        except IOError:
+            # leave reporting a missing file to bifDiag
+            pass
     data = bifDiag.bifDiag(bname,sname,dname)
+    if columns is not None:
+        data = data.project(columns)
     info("Parsed output data\n")
     return data
 commandParseOutputFiles = command(loadbd,SIMPLE,"loadbd",alias=['bd'])
@@ -1536,7 +1639,8 @@ def hch(entry=None,value=None,runner=None,**kw):
 commandRunnerConfigFort12 = command(hch,SIMPLE,"changeConstantsHomCont")
     
 
-def run(data=None,sv=None,ap=None,runner=None,templates=None,**kw):
+def run(data=None,sv=None,ap=None,runner=None,templates=None,callback=None,
+        stop_when=None,cache=None,**kw):
     """Run AUTO.
 
     Type r=FUNC([data],[options]) to run AUTO from solution data with the given
@@ -1577,12 +1681,33 @@ def run(data=None,sv=None,ap=None,runner=None,templates=None,**kw):
     FUNC(bd('BP1'),ISW=-1,STOP='HB1',sv='hb',ap='all')
     saves to the files b.hb, s.hb and d.hb, and appends to b.all,
     s.all, and d.all.
+
+    The special keyword argument 'callback' is a function that is called
+    as callback(points,solutions) while AUTO runs, with the lists of
+    branch points and solutions that AUTO wrote since the previous call,
+    for instance to watch a long run in a plot handle p, from p=plot(r0):
+    def watch(points,solutions):
+        p.config(bifurcation_diagram_filename='fort.7')
+    r1 = FUNC(r0('UZ1'),callback=watch)
+    If the callback returns True, AUTO stops, keeping the output so far.
+
+    Similarly, the special keyword argument 'stop_when' is a function, or
+    list of functions, that is called with every new point on the branch.
+    AUTO stops as soon as one of them returns True, for example:
+    FUNC(s,stop_when=lambda pt: pt['L2-NORM'] > 10)
+
+    With the special keyword argument cache=True, the output is stored
+    in a cache, and running the same equations again with the same
+    constants and starting solution, for instance when re-running a
+    script, loads the output from there instead of running AUTO. The
+    least recently used results are removed when the cache grows beyond
+    1 GB; clean(cache=True) removes all of them.
     """
     runner = withrunner(runner)
     if sv is not None:
         kw['sv'] = sv
     load(data,runner,templates,info=lambda msg:None,**kw)
-    res = runner.run()
+    res = runner.run(callback=callback,stop_when=stop_when,cache=cache)
     sv = runner.options["constants"].get("sv")
     runner.options["constants"]['sv'] = None
     if sv is not None and sv != '':
@@ -1599,6 +1724,74 @@ def run(data=None,sv=None,ap=None,runner=None,templates=None,**kw):
 commandRun = command(run,SIMPLE,"run",alias=['r','rn'])
 
 
+def arun(data=None,sv=None,ap=None,runner=None,templates=None,**kw):
+    """Run AUTO from an asyncio event loop.
+
+    Type r=FUNC([data],[options]) to prepare a run of AUTO with the same
+    arguments as run(), and then, inside a coroutine, bd=await r to
+    run AUTO and obtain the bifurcation diagram bd. While AUTO runs,
+    the lines of its output can be obtained using
+    async for line in r: ...
+    before awaiting r.
+
+    The equations are compiled right away, but AUTO itself runs in its
+    own scratch directory, so one event loop can drive many runs at
+    once, for example:
+    bds = await asyncio.gather(*[FUNC(s,PAR={2:0.1*i}) for i in range(20)])
+
+    This needs Python 3.5 or newer.
+    """
+    import runAUTOasync
+    runner = withrunner(runner)
+    if sv is not None:
+        kw['sv'] = sv
+    solution = load(data,runner,templates,info=lambda msg:None,**kw)
+    sv = runner.options["constants"].get("sv")
+    runner.options["constants"]['sv'] = None
+    job = runner.prepare([solution])[0]
+    def finish(res):
+        if sv is not None and sv != '':
+            name = filenameTemplate(sv,templates)
+            bname = name["bifurcationDiagram"]
+            sname = name["solution"]
+            dname = name["diagnostics"]
+            info("Saving to %s, %s, and %s ... done\n"%(bname,sname,dname))
+            if ap is not None:
+                append(sv,ap)
+        elif ap is not None:
+            append(res,ap)
+    return runAUTOasync.AUTOrun(runner,solution,job,finish)
+commandArun = command(arun,SIMPLE,"arun")
+
+
+def runmany(runs,workers=None,runner=None,templates=None,**kw):
+    """Run AUTO several times at once.
+
+    Type r=FUNC([(data1,options1),(data2,options2),...],[workers=N],[options])
+    to run AUTO from each data with the given options dictionary, as in
+    run(data1,**options1), run(data2,**options2), ...
+    The options given to FUNC itself apply to all runs.
+
+    Every run gets its own scratch directory, and at most N runs, by
+    default as many as there are CPUs, happen at the same time.
+    The result r is a list of bifurcation diagrams, in the same order
+    as the runs.
+
+    Example: continue in PAR(1) from 20 different values of PAR(2):
+    r = FUNC([(s, {'PAR': {2: 0.1*i}}) for i in range(20)], ICP=[1])
+    """
+    runner = withrunner(runner)
+    solutions = []
+    for data, options in runs:
+        options = dict(kw, **options)
+        solutions.append(load(data,runner,templates,info=lambda msg:None,
+                              **options))
+    res = runner.runmany(solutions,workers)
+    info("Finished %d runs\n"%len(res))
+    return res
+commandRunMany = command(runmany,SIMPLE,"runmany")
+
+
 def rundemo(demo,equation="all",runner=None):
     runner = withrunner(runner)
     runner.config(equation=equation)
@@ -1719,6 +1912,113 @@ def plot3(name=None,r3b=False):
 commandPlotter3D = command(plot3,alias=['p3'])
 
 
+def _plotdata(name=None,templates=None):
+    # the bifurcation diagram and solutions to plot for name, as
+    # plotter options
+    data = {}
+    if type(name) == type("") or name is None:
+        name = filenameTemplate(name,templates)
+        parsed = None
+    else:
+        parsed = name
+    if parsed:
+        nb, ns = None, None
+        if isinstance(parsed,bifDiag.bifDiag):
+            nb = parsed
+            ns = parsed()
+        elif isinstance(parsed,parseBandS.parseBandS):
+            nb = parsed.diagram.branches
+            ns = parsed.solution
+        elif isinstance(parsed,parseB.parseB):
+            nb = parsed.branches
+        elif isinstance(parsed,parseS.parseS):
+            ns = parsed
+        elif isinstance(parsed,parseB.AUTOBranch):
+            nb = parseB.parseBR([parsed])
+        elif isinstance(parsed,parseS.AUTOSolution):
+            ns = parseS.parseS([parsed])
+        if nb:
+            data["bifurcation_diagram"] = nb
+        if ns:
+            data["solution"] = ns
+    else:
+        n1b = name["bifurcationDiagram"]
+        n1s = name["solution"]
+        if n1b is None:
+            n1b = "fort.7"
+            n1s = "fort.8"
+        try:
+            n1b = parseB.parseBR(n1b)
+            n1b = bifDiag.bifDiag(n1b,n1s,constants=n1b[0].c)
+        except IOError:
+            n1b = bifDiag.bifDiag(n1b,n1s)
+        data["bifurcation_diagram"] = n1b
+        data["solution"] = n1b()
+    return data
+
+
+def _savefig(figure):
+    # render one figure for savefigs(), without a window
+    name, options, filename = figure
+    from graphics import plotter
+    if 'graphics.grapher_mpl' not in sys.modules:
+        raise AUTOExceptions.AUTORuntimeError(
+            "Saving figures without a window needs matplotlib.")
+    options = dict(options)
+    options.update(_plotdata(name,options.pop('templates',None)))
+    options['hide'] = True
+    plotter.plotter(**options).savefig(filename)
+    return filename
+
+
+def savefigs(figures,workers=None,templates=None,**kw):
+    """Save many plots to files, without plotting windows.
+
+    Type FUNC([(x1,options1,filename1),(x2,options2,filename2),...],
+    [workers=N],[options])
+    to save the plot of each x with the given options dictionary, as in
+    p=plot(x1,hide=True,**options1); p.savefig(filename1), ...
+    The data x can be anything that plot() accepts, such as 'xxx' for
+    b.xxx and s.xxx, and the options given to FUNC itself apply to all
+    plots.
+
+    Rendering only needs matplotlib, not a display, and at most N plots,
+    by default as many as there are CPUs, are rendered at the same time
+    in separate processes.
+    The return value is the list of file names.
+
+    Example: save b.xxx and s.xxx as a PNG and as an EPS file:
+    FUNC([('xxx', {}, 'xxx.png'),
+          ('xxx', {'type': 'solution'}, 'xxx.eps')], stability=True)
+    """
+    jobs = []
+    for name, options, filename in figures:
+        options = dict(kw, **options)
+        if templates is not None:
+            options.setdefault('templates',templates)
+        jobs.append((name, options, filename))
+    if workers is None:
+        try:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        except (ImportError, NotImplementedError):
+            workers = 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        res = [_savefig(job) for job in jobs]
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        try:
+            res = pool.map(_savefig, jobs, 1)
+        finally:
+            pool.close()
+            pool.join()
+    info("Saved %d plots\n"%len(res))
+    return res
+commandSaveFigs = command(savefigs,SIMPLE,"savefigs")
+
+
 try:
     try:
         from Tkinter import Tk
@@ -1767,11 +2067,6 @@ try:
         """
 
         options = kw
-        if type(name) == type("") or name is None:
-            name = filenameTemplate(name,templates)
-            parsed = None
-        else:
-            parsed = name
         # delay importing plotting modules until we actually plot...
         global plotterimported, windowPlotter
         if not plotterimported:
@@ -1804,39 +2099,8 @@ try:
                 _root=root
             except:
                 pass
-        if parsed:
-            nb, ns = None, None
-            if isinstance(parsed,bifDiag.bifDiag):
-                nb = parsed
-                ns = parsed()
-            elif isinstance(parsed,parseBandS.parseBandS):
-                nb = parsed.diagram.branches
-                ns = parsed.solution
-            elif isinstance(parsed,parseB.parseB):
-                nb = parsed.branches
-            elif isinstance(parsed,parseS.parseS):
-                ns = parsed
-            elif isinstance(parsed,parseB.AUTOBranch):
-                nb = parseB.parseBR([parsed])
-            elif isinstance(parsed,parseS.AUTOSolution):
-                ns = parseS.parseS([parsed])
-            if nb:
-                options["grapher_bifurcation_diagram"] = nb
-            if ns:
-                options["grapher_solution"] = ns                    
-        else:
-            n1b = name["bifurcationDiagram"]
-            n1s = name["solution"]
-            if n1b is None:
-                n1b = "fort.7"
-                n1s = "fort.8"
-            try:
-                n1b = parseB.parseBR(n1b)
-                n1b = bifDiag.bifDiag(n1b,n1s,constants=n1b[0].c)
-            except IOError:
-                n1b = bifDiag.bifDiag(n1b,n1s)
-            options["grapher_bifurcation_diagram"] = n1b
-            options["grapher_solution"] = n1b()
+        for k, v in _plotdata(name,templates).items():
+            options['grapher_'+k] = v
         handle = windowPlotter.WindowPlotter2D(root,**options)
         if (not options.get('grapher_hide') or
             'graphics.grapher_mpl' not in sys.modules):
@@ -2079,7 +2343,35 @@ commandSpecialPointLabels = command(splabs)
 def test():
     import runAUTO
     import sys
-    
+    import shutil
+    import tempfile
+
+    print("Testing saving plots")
+    try:
+        import matplotlib
+    except ImportError:
+        matplotlib = None
+    if matplotlib is not None:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            data = bifDiag.bifDiag("test_data/fort.7", "test_data/fort.8")
+            for workers in [1, 2]:
+                names = [os.path.join(tmpdir, "t%d.png"%workers),
+                         os.path.join(tmpdir, "t%d.eps"%workers)]
+                figures = [(data, {}, names[0]),
+                           (data, {"type": "solution"}, names[1])]
+                if savefigs(figures, workers, stability=True) != names:
+                    raise AUTOExceptions.AUTORegressionError(
+                        "Wrong file names returned")
+                for name, magic in zip(names, ["\x89PNG", "%!PS-Adobe"]):
+                    magic = magic.encode("latin-1")
+                    if (not os.path.exists(name) or
+                        open(name, "rb").read(len(magic)) != magic):
+                        raise AUTOExceptions.AUTORegressionError(
+                            "Plot not saved")
+        finally:
+            shutil.rmtree(tmpdir)
+
     def printfunc(text):
         stdout.write(text+"\n")
 
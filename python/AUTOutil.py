@@ -4,6 +4,7 @@ try:
 except ImportError: # Python 3
     from configparser import ConfigParser
 import os
+import re
 import array
 import gzip
 import sys
@@ -154,6 +155,130 @@ def format19_10E3(x):
         s = s[1:-2] + '0' + s[-2:]
     return s
 
+# an exponent that had three digits before format19_10E3s added a zero
+_E4 = re.compile("E[-+]0[0-9]{3}")
+
+def format19_10E3s(values):
+    """Format all numbers in values as format19_10E3 would, in one go,
+    and return the concatenated 19 character fields. values is a list,
+    or a numpy array, which is formatted using array operations."""
+    N = sys.modules.get("numpy")
+    if N is not None and isinstance(values, N.ndarray):
+        return _format19_10E3_numpy(N, values.ravel())
+    # format into 18 characters and add a zero to each exponent, which
+    # makes every field 19 characters wide, and is the right result for
+    # all but the rare three-digit exponents
+    s = ("%18.10E"*len(values)) % tuple(values)
+    s = s.replace("E+", "E+0").replace("E-", "E-0")
+    if len(s) != 19*len(values):
+        # infinity or NaN
+        return "".join([format19_10E3(v) for v in values])
+    fixed = []
+    start = 0
+    for item in _E4.finditer(s):
+        i = item.start() // 19
+        fixed.extend([s[start:19*i], format19_10E3(values[i])])
+        start = 19*(i+1)
+    if start == 0:
+        return s
+    fixed.append(s[start:])
+    return "".join(fixed)
+
+def _format19_10E3_numpy(N, x):
+    # Compute the 11 significant digits and the exponent of every number
+    # using floating point arithmetic. Where that might round differently
+    # from the exact decimal conversion of "%E", that is, close to half
+    # way between two results, and for zero, denormal, infinite and NaN
+    # values, fall back to format19_10E3.
+    x = N.asarray(x, float)
+    a = abs(x)
+    slow = ~(a >= 1e-290) | ~(a < 1e300)
+    a = N.where(slow, 1.0, a)
+    e = N.floor(N.log10(a)).astype(int)
+    m = a * 10.0**(10-e)
+    # log10 may be off by one close to powers of 10
+    low = m < 1e10
+    e[low] -= 1
+    m[low] = a[low] * 10.0**(10-e[low])
+    high = m >= 1e11
+    e[high] += 1
+    m[high] = a[high] * 10.0**(10-e[high])
+    d = N.floor(m + 0.5)
+    slow |= abs(m - N.floor(m) - 0.5) < 1e-3
+    rounded = d >= 1e11
+    d[rounded] = 1e10
+    e[rounded] += 1
+    d = d.astype(N.int64)
+    zero, space = ord("0"), ord(" ")
+    out = N.empty((len(x), 19), N.uint8)
+    out[:, 0] = space
+    out[:, 1] = N.where(x < 0, ord("-"), space)
+    for i in range(11):
+        out[:, 13 - i - (i == 10)] = d // 10**i % 10 + zero
+    out[:, 3] = ord(".")
+    out[:, 14] = ord("E")
+    out[:, 15] = N.where(e < 0, ord("-"), ord("+"))
+    e = abs(e)
+    out[:, 16] = e // 100 + zero
+    out[:, 17] = e // 10 % 10 + zero
+    out[:, 18] = e % 10 + zero
+    s = out.tobytes().decode("ascii")
+    indices = N.nonzero(slow)[0]
+    if len(indices) == 0:
+        return s
+    fixed = []
+    start = 0
+    for i in indices.tolist():
+        fixed.extend([s[start:19*i], format19_10E3(x[i])])
+        start = 19*(i+1)
+    fixed.append(s[start:])
+    return "".join(fixed)
+
+def format19_10E3lines(rows, columns=7, prefix="    ", linesep=os.linesep):
+    """Format the numbers in rows, a two-dimensional array or a list of
+    lists of equal length, as format19_10E3 would. Every row is written
+    as lines of at most columns numbers, that start with prefix and end
+    with linesep."""
+    N = sys.modules.get("numpy")
+    if N is not None and isinstance(rows, N.ndarray):
+        if len(rows) == 0:
+            return ""
+        # put the fields and the fixed text of each row into place
+        n, m = rows.shape
+        fields = N.frombuffer(format19_10E3s(rows).encode("ascii"),
+                              N.uint8).reshape(n, 19*m)
+        prefix = N.frombuffer(prefix.encode("ascii"), N.uint8)
+        linesep = N.frombuffer(linesep.encode("ascii"), N.uint8)
+        nlines = max((m + columns - 1)//columns, 1)
+        out = N.empty((n, nlines*(len(prefix)+len(linesep)) + 19*m), N.uint8)
+        column = 0
+        for j in range(0, max(m, 1), columns):
+            k = min(columns, m - j)
+            for text in [prefix, fields[:, 19*j:19*(j+k)], linesep]:
+                out[:, column:column+text.shape[-1]] = text
+                column += text.shape[-1]
+        return out.tobytes().decode("ascii")
+    if hasattr(rows, "tolist"):
+        rows = rows.tolist()
+    if len(rows) == 0:
+        return ""
+    n = len(rows[0])
+    if n == 0:
+        return (prefix + linesep) * len(rows)
+    values = []
+    for row in rows:
+        values.extend(row)
+    s = format19_10E3s(values)
+    width = 19*n
+    step = 19*columns
+    lines = []
+    for start in range(0, len(s), width):
+        end = start + width
+        for i in range(start, end, step):
+            lines.append(prefix + s[i:min(i + step, end)])
+    lines.append("")
+    return linesep.join(lines)
+
 try:
     import __builtin__
 except ImportError:
@@ -499,6 +624,17 @@ def test():
     print("%s,%s"%(a,b))
     b[0,:]=[7,8]
     print("%s"%(b))
+    values = [0.0, -0.0, 1.0, -2.5e-100, 1e100, 9.99999999995e99, -1e-5,
+              float("inf"), 123456.789]
+    s = "".join([format19_10E3(v) for v in values])
+    print(s)
+    if format19_10E3s(values) != s:
+        raise AUTOExceptions.AUTORegressionError("Formatting incorrect")
+    s = "".join([format19_10E3(v) for v in values[:7]])
+    if format19_10E3lines([values[:7], values[:7]], 3) != 2*(
+        "    %s\n    %s\n    %s\n"%(s[:57], s[57:114], s[114:])).replace(
+        "\n", os.linesep):
+        raise AUTOExceptions.AUTORegressionError("Formatting incorrect")
 
 if __name__ == "__main__":
     test()
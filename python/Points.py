@@ -14,7 +14,9 @@ from __future__ import division
 
 import AUTOutil
 from copy import copy, deepcopy
+from bisect import bisect_left, bisect_right
 import sys
+import weakref
 
 numpyimported = False
 ndarray = AUTOutil.ArrayType
@@ -44,7 +46,7 @@ def importnumpy():
                 N.floating, N.integer, N.ndim)
             global _float_types
             global _int_types
-            _float_types = (type(1), N.floating)
+            _float_types = (type(1.0), N.floating)
             _int_types = (type(1), N.integer)
         except ImportError:
             usingnumpy = False
@@ -863,6 +865,8 @@ class Point(object):
 
     def __getstate__(self):
         d = copy(self.__dict__)
+        # the buffer for appending points is not needed
+        d.pop('_growbuffer', None)
         # remove reference to Cfunc type
         if not numpyimported:
             importnumpy()
@@ -1538,7 +1542,8 @@ class Pointset(Point):
             else:
                 labels = self.labels[ix]
                 try:
-                    labels.mapIndices(dict(zip(labels, [i-ix[0] for i in labels.getIndices()])))
+                    cl_ixs = labels.getIndices()
+                    labels.mapIndices(dict(zip(cl_ixs, [i-ix[0] for i in cl_ixs])))
                 except AttributeError:
                     # empty
                     pass
@@ -1720,13 +1725,15 @@ class Pointset(Point):
             else:
                 raise TypeError("Source Pointset must be parameterized")
         else:
+            # slicing already gives new Pointsets, and p is a copy, so
+            # there is no need to copy again when appending
             if ix > 0:
-                p_result = copy(self[:ix])
-                p_result.append(p)
+                p_result = self[:ix]
+                p_result.append(p, copyArg=False)
             else:
                 p_result = pointsToPointset(p, self.indepvarname)
             try:
-                p_result.append(self[ix:])
+                p_result.append(self[ix:], copyArg=False)
             except ValueError:
                 # ix > greatest index, so no points left to add
                 # (i.e., p was appended to end)
@@ -1734,20 +1741,79 @@ class Pointset(Point):
             self.coordarray = p_result.coordarray
             self.labels = p_result.labels
             self.indepvararray = p_result.indepvararray
+            buffers = getattr(p_result, "_growbuffer", None)
+            if buffers is not None and buffers[0]() is p_result:
+                # take over the buffer for later appends
+                self._growbuffer = (weakref.ref(self),) + buffers[1:]
         self.makeIxMaps()
 
 
-    def append(self, parg, t=None, skipMatchingIndepvar=False):
+    def _resize(self, new_len):
+        """Change the number of points to new_len, keeping the first
+        points; new points are uninitialized.
+
+        With numpy, the points live in a larger buffer once a Pointset
+        has grown, and the buffer grows by doubling, so that appending
+        many times takes linear time overall."""
+        old_len = self.coordarray.shape[1]
+        coordtype = _num_equivtype[type(self.coordarray[0][0])]
+        if self._parameterized:
+            indepvartype = _num_equivtype[type(self.indepvararray[0])]
+        if not hasattr(N, "empty"):
+            old_coords = self.coordarray
+            self.coordarray = zeros((self.dimension, new_len), coordtype)
+            for tix in range(min(old_len, new_len)):
+                self.coordarray[:, tix] = old_coords[:, tix]
+            if self._parameterized:
+                old_indepvars = self.indepvararray
+                self.indepvararray = zeros((new_len,), indepvartype)
+                self.indepvararray[:min(old_len, new_len)] = \
+                    old_indepvars[:min(old_len, new_len)]
+            return
+        buffers = getattr(self, "_growbuffer", None)
+        # only use the buffer if it was made for this object and still
+        # holds its points
+        if (buffers is None or buffers[0]() is not self or
+            self.coordarray.base is not buffers[1] or
+            (self._parameterized and
+             self.indepvararray.base is not buffers[2])):
+            capacity = new_len
+        elif new_len > buffers[1].shape[1]:
+            capacity = max(new_len, 2 * buffers[1].shape[1])
+        else:
+            capacity = None
+        if capacity is not None:
+            n = min(old_len, new_len)
+            coordbuffer = N.empty((self.dimension, capacity), coordtype)
+            coordbuffer[:, :n] = self.coordarray[:, :n]
+            indepbuffer = None
+            if self._parameterized:
+                indepbuffer = N.empty((capacity,), indepvartype)
+                indepbuffer[:n] = self.indepvararray[:n]
+            buffers = (weakref.ref(self), coordbuffer, indepbuffer)
+            self._growbuffer = buffers
+        self.coordarray = buffers[1][:, :new_len]
+        if self._parameterized:
+            self.indepvararray = buffers[2][:new_len]
+
+
+    def append(self, parg, t=None, skipMatchingIndepvar=False, copyArg=True):
         """Append individual Point, Pointset or coordinates in place.
 
         skipMatchingIndepvar option causes a matching independent
         variable value at the beginning of p to be skipped (only
         meaningful for appending parameterized Pointsets). This
-        option is mainly for internal use."""
+        option is mainly for internal use.
+
+        With copyArg=False the argument is not copied first; use it
+        only for a Point or Pointset that is not used anywhere else."""
 
         # test isinstance for Pointset first because it is a sub-class of Point
         # and so isinstance(p, Point) will also catch Pointsets!
-        p = copy(parg)
+        if copyArg:
+            p = copy(parg)
+        else:
+            p = parg
         if isinstance(p, Pointset):
             assert p._parameterized == self._parameterized, "Parameterization mismatch"
             # check p dimension and coordnames and type
@@ -1799,18 +1865,10 @@ class Pointset(Point):
                 raise ValueError("Coordinate name mismatch with Pointset")
             old_len = self.coordarray.shape[1]
             new_len = old_len + added_len
-            old_coords = self.coordarray
-            self.coordarray = zeros((self.dimension, new_len),
-                                    _num_equivtype[type(self.coordarray[0][0])])
+            self._resize(new_len)
             if self._parameterized:
-                old_indepvars = self.indepvararray
-                self.indepvararray = zeros((new_len,),
-                                         _num_equivtype[type(old_indepvars[0])])
-                self.indepvararray[:old_len] = old_indepvars
                 tvals = tval[:added_len]
                 self.indepvararray[old_len:] = tvals
-            for tix in range(old_len):
-                self.coordarray[:, tix] = old_coords[:, tix]
             pdict = p.todict()
             for ix in range(self.dimension):
                 self.coordarray[ix][old_len:] = pdict[
@@ -1849,18 +1907,11 @@ class Pointset(Point):
                 pcoords = p.coordnames
             if remain(pcoords, self.coordnames) != []:
                 raise ValueError("Coordinate name mismatch with Point")
-            new_len = self.coordarray.shape[1]+1
-            old_coords = self.coordarray
-            self.coordarray = zeros((self.dimension, new_len),
-                                    _num_equivtype[type(self.coordarray[0][0])])
+            old_len = self.coordarray.shape[1]
+            new_len = old_len+1
+            self._resize(new_len)
             if self._parameterized:
-                old_indepvars = self.indepvararray
-                self.indepvararray = zeros((new_len,),
-                                    _num_equivtype[type(self.indepvararray[0])])
-                self.indepvararray[:new_len-1] = old_indepvars
                 self.indepvararray[new_len-1] = tval
-            for tix in range(new_len-1):
-                self.coordarray[:, tix] = old_coords[:, tix]
             for ix in range(self.dimension):
                 self.coordarray[ix,new_len-1] = p(self._ix_name_map[ix])
             if len(p.labels) > 0:
@@ -1879,9 +1930,17 @@ class Pointset(Point):
                     c.append(array([0]*len(c[0])))
             self.coordnames.extend(p)
             self.dimension = self.dimension + l
+            self.makeIxMaps()
+            return
         else:
             raise TypeError("append requires Point, Pointset or (list of) string argument")
-        self.makeIxMaps()
+        if (self._parameterized and
+            len(self._indepvar_ix_map) == old_len):
+            # only the new independent variable values need to be mapped
+            self._indepvar_ix_map.update(zip(self.indepvararray[old_len:],
+                                             range(old_len, new_len)))
+        else:
+            self.makeIxMaps()
 
 
     extend = append   # for intuitive compatibility!
@@ -1984,6 +2043,8 @@ class Pointset(Point):
 
     def __getstate__(self):
         d = copy(self.__dict__)
+        # the buffer for appending points is not needed
+        d.pop('_growbuffer', None)
         # remove reference to Cfunc types by converting them to strings
         if not numpyimported:
             importnumpy()
@@ -2097,15 +2158,21 @@ class PointInfo(object):
 
     Do not use a PointInfo object as an iterator, as it is 'infinite' in size!
     (It uses DefaultDicts as its internal storage, which return {} for
-    undefined labels.)"""
+    undefined labels.)
+
+    The sorted indices, overall and per label, are kept in a cache that
+    is shared with PointInfo objects using the same storage, and that
+    is cleared whenever indices or labels are added or removed."""
 
     def __init__(self, ptlabels=None):
+        self.__cache = {}
         if ptlabels is None:
             self.by_label = DefaultDict({})
             self.by_index = DefaultDict({})
         elif isinstance(ptlabels, PointInfo):
             self.by_label = ptlabels.by_label
             self.by_index = ptlabels.by_index
+            self.__cache = ptlabels.__cache
         elif isinstance(ptlabels, dict):
             # always expect the dictionary to be based on index
             self.by_label = DefaultDict({})
@@ -2126,11 +2193,19 @@ class PointInfo(object):
 
 
     def mapIndices(self, ixMapDict):
-        by_index = {}
-        ixMap = symbolMapClass(ixMapDict)
+        """Renumber indices using a dictionary from old to new indices;
+        indices that are not in the dictionary keep their number."""
+        get = ixMapDict.get
+        by_index = DefaultDict({})
         for ix, rest in self.by_index.items():
-            by_index[ixMap(ix)] = rest
-        self.__init__(by_index)
+            by_index[get(ix, ix)] = dict(rest)
+        by_label = DefaultDict({})
+        for label, ixdict in self.by_label.items():
+            by_label[label] = dict([(get(ix, ix), info)
+                                    for ix, info in ixdict.items()])
+        self.by_index = by_index
+        self.by_label = by_label
+        self.__cache = {}
 
 
     def mapNames(self, themap):
@@ -2140,10 +2215,11 @@ class PointInfo(object):
         for ix, labdict in self.by_index.items():
             new_by_index[ix] = mapNames(themap, labdict)
         self.by_index = new_by_index
+        self.__cache = {}
 
 
     def sortByIndex(self):
-        ixkeys = sortedDictKeys(self.by_index)
+        ixkeys = self.__sorted()
         return zip(ixkeys,[self.by_index[ix] for ix in ixkeys])
 
 
@@ -2152,8 +2228,28 @@ class PointInfo(object):
         return zip(labelkeys,[self.by_label[label] for label in labelkeys])
 
 
-    def getIndices(self):
-        return sortedDictKeys(self.by_index)
+    def getIndices(self, label=None):
+        """Return the sorted indices, of all points or of the points
+        with the given label."""
+        return list(self.__sorted(label))
+
+
+    def __sorted(self, label=None):
+        # sorted indices from the cache: never change the returned list
+        cache = self.__cache
+        if label is None:
+            d = self.by_index
+        else:
+            d = self.by_label.get(label, {})
+        ixs = cache.get(label)
+        if ixs is None or len(ixs) != len(d):
+            ixs = sorted(d)
+            cache[label] = ixs
+        return ixs
+
+
+    def __changed(self):
+        self.__cache.clear()
 
 
     def getLabels(self):
@@ -2174,25 +2270,35 @@ class PointInfo(object):
         else:
             if isinstance(key, (slice, list, ndarray)):
                 if isinstance(key, slice):
-                    self_ixs = self.getIndices()
+                    self_ixs = self.__sorted()
                     if len(self_ixs) == 0:
                         max_ixs = 0
                     else:
-                        max_ixs = max(self_ixs)
+                        max_ixs = self_ixs[-1]
                     try:
                         s1, s2, s3 = key.indices(max_ixs+1)
-                        ixs = range(s1, s2, s3)
-                        key = intersect(ixs, self_ixs)
                     except TypeError:
                         key = self_ixs
+                    else:
+                        # find the range by bisection in the sorted indices
+                        if s3 > 0:
+                            key = self_ixs[bisect_left(self_ixs, s1):
+                                           bisect_left(self_ixs, s2)]
+                            if s3 != 1:
+                                key = [i for i in key if (i-s1) % s3 == 0]
+                        else:
+                            key = self_ixs[bisect_right(self_ixs, s2):
+                                           bisect_right(self_ixs, s1)]
+                            key = [i for i in reversed(key)
+                                   if (s1-i) % s3 == 0]
                 else:
                     if all([isinstance(k, str) for k in key]):
-                        keylabels = intersect(key, self.getLabels())
+                        keylabels = [k for k in key if k in self.by_label]
                         key = []
                         for l in keylabels:
                             key.extend(self.by_label[l].keys())
                     elif all([isinstance(k, _int_types) for k in key]):
-                        key = intersect(key, self.getIndices())
+                        key = [k for k in key if k in self.by_index]
                     else:
                         raise TypeError("Invalid key type for PointInfo")
                 return PointInfo(dict(zip(key,[self.by_index[i] for i in key])))
@@ -2248,6 +2354,7 @@ class PointInfo(object):
             raise IndexError("Index must be non-negative")
         self.by_label[label].update({ix: info})
         self.by_index[ix].update({label: info})
+        self.__changed()
 
 
     def __len__(self):
@@ -2256,6 +2363,7 @@ class PointInfo(object):
 
     def remove(self, key1, *key2):
         """remove one or more items, keyed either by index or label."""
+        self.__changed()
         byix = key1 in self.by_index
         if key2 == ():
             # remove all labels associated with index, or vice versa
@@ -2343,6 +2451,7 @@ class PointInfo(object):
 
 
     def __delitem__(self, key):
+        self.__changed()
         if key in self.by_index:
             labels = self.by_index[key].keys()
             del self.by_index[key]
@@ -2789,6 +2898,40 @@ w_reconstructed = pointsToPointset(pointlist, 't', wp['t'])"""
     for p in wnp.bylabel('a'):
         print(p)
 
+    print("\nGrowing a pointset one point at a time:")
+    grow = Pointset({'coordarray': array([[0.0], [0.0]], float64),
+                     'coordnames': ['x', 'y'],
+                     'indepvarname': 't',
+                     'indepvararray': array([0.0], float64)})
+    for i in range(1, 100):
+        grow.append(Point({'coorddict': {'x': float(i), 'y': -float(i),
+                                         't': float(i)}}))
+        if i % 10 == 0:
+            grow.labels[i] = ('a', {})
+        ref = grow.coordarray
+    grow.append(grow[90:], t=array([100.0+i for i in range(10)]))
+    grow.insert(Point({'coorddict': {'x': 0.5, 'y': -0.5, 't': 0.5}}))
+    assert len(grow) == 111
+    assert grow(50.0)('x') == 50.0 and grow(105.0)('y') == -95.0
+    assert grow[1]('x') == 0.5 and grow[2]('x') == 1.0
+    assert grow.labels.getIndices('a') == [11, 21, 31, 41, 51, 61, 71, 81,
+                                           91, 101]
+    assert ref.shape == (2, 100)
+    print("-- OK!")
+
+    print("\nLabel index test:")
+    info = PointInfo({1: 'a', 4: 'b', 6: {'a': {}, 'c': {}}, 9: 'a'})
+    assert info.getIndices() == [1, 4, 6, 9]
+    assert info.getIndices('a') == [1, 6, 9]
+    assert info[2:7].getIndices() == [4, 6]
+    assert info[9:0:-3].getIndices() == [6, 9]
+    info.mapIndices({9: 10})
+    assert info.getIndices('a') == [1, 6, 10]
+    info.remove(6, 'a')
+    assert info.getIndices('a') == [1, 10]
+    assert info.getIndices() == [1, 4, 6, 10]
+    print("-- OK!")
+
     # pass some of the objects back
     return wp, wnp, wpt, wp_part
 
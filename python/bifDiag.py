@@ -12,7 +12,9 @@ import AUTOExceptions
 import gzip
 import types
 import sys
+import os
 import struct
+import json
 
 class bifDiag(parseB.parseBR):
 
@@ -128,14 +130,47 @@ class bifDiag(parseB.parseBR):
             result += 256 ** struct.calcsize('P')
         return "<_=%s instance at %#010x>"%(self.__class__.__name__,result)
 
-    def getLabel(self,label):
-        sols = parseS.parseS()
+    def __getlabelindex(self):
+        # all solutions, by label and by type name and number; the index is
+        # rebuilt when branches are added, removed or replaced, and it is
+        # invalidated when labels change through this object
+        index = getattr(self, "_bifDiag__labelindex", None)
+        data = self.data
+        if (index is not None and len(index[0]) == len(data) and
+            all([d is e for d, e in zip(index[0], data)])):
+            return index[1:]
+        sols = []
         #adjust maximum label/branch
-        mbr = max([abs(d["BR"]) for d in self] or [None])
+        mbr = max([abs(d["BR"]) for d in data] or [None])
         mlab = max(self.getLabels() or [None])
-        for d in self:
+        for d in data:
             sols.extend(d.getLabel(None,mbr=mbr,mlab=mlab))
-        return sols(label)
+        labels = {}
+        types = {}
+        for s in sols:
+            if s["Label"] not in labels:
+                labels[s["Label"]] = s
+            name = s["Type name"]
+            types[name] = types.get(name, 0) + 1
+            types[name, types[name]] = s
+        self.__labelindex = (data[:], sols, labels, types)
+        return sols, labels, types
+
+    def getLabel(self,label):
+        sols, labels, types = self.__getlabelindex()
+        if isinstance(label, int):
+            if label in labels:
+                return labels[label]
+            raise KeyError("Label %s not found"%label)
+        if isinstance(label, str) and len(label) > 2 and label[-1].isdigit():
+            j = 2
+            if not label[2].isdigit():
+                j = 3
+            key = label[:j], int(label[j:])
+            if key in types:
+                return types[key]
+            raise KeyError("Label %s not found"%label)
+        return parseS.parseS(sols)(label)
 
     def __call__(self,label=None):
         return self.getLabel(label)
@@ -205,8 +240,130 @@ class bifDiag(parseB.parseBR):
                     d.diagnostics.writeFilename(fort9_filename,append)
                     append=True
 
+    def writeBinaryFilename(self,filename):
+        """Write the bifurcation diagram, its solutions, diagnostics and
+        constants to a numpy .npz container with one array per branch and
+        per solution."""
+        N = _importnumpy()
+        constants = []
+        cindex = {}
+        def addconstants(c):
+            if c is None:
+                return None
+            if id(c) not in cindex:
+                cindex[id(c)] = len(constants)
+                c = dict(c)
+                if c.get("homcont") is not None:
+                    c["homcont"] = dict(c["homcont"])
+                constants.append(c)
+                return len(constants) - 1
+            return cindex[id(c)]
+        arrays = {}
+        branches = []
+        solutions = []
+        for i, d in enumerate(self):
+            if d.coordnames != []:
+                # parse first: this adds the stability information to labels
+                arrays["branch%d"%i] = N.array(d.coordarray, float)
+            labels = []
+            for idx, val in d.labels.sortByIndex():
+                for key, v in val.items():
+                    v = v.copy()
+                    if "solution" in v:
+                        sol = v.pop("solution")
+                        header, data = sol._binary()
+                        v["solution"] = len(solutions)
+                        arrays["solution%d"%len(solutions)] = data
+                        solutions.append({"header": header,
+                                          "c": addconstants(sol.c)})
+                    labels.append([idx, key, v])
+            branch = {"BR": d.BR, "TY": getattr(d, "TY", None),
+                      "headerlist": d.headerlist,
+                      "headernames": d.headernames,
+                      "coordnames": d.coordnames, "c": addconstants(d.c),
+                      "labels": labels}
+            if hasattr(d,"diagnostics"):
+                branch["diagnostics"] = [x.getText() for x in d.diagnostics.data]
+            branches.append(branch)
+        meta = {"version": 1, "constants": constants, "branches": branches,
+                "solutions": solutions}
+        meta = json.dumps(meta, default=_jsondefault).encode("utf-8")
+        arrays["meta"] = N.frombuffer(meta, N.uint8)
+        # write to a temporary file first: the file may still be read from
+        tmpname = "%s.%d"%(filename, os.getpid())
+        output = open(tmpname, "wb")
+        try:
+            N.savez(output, **arrays)
+        finally:
+            output.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpname, filename)
+
+    def readBinaryFilename(self,filename):
+        """Read a bifurcation diagram written by writeBinaryFilename;
+        the solutions are only loaded from the file when accessed."""
+        N = _importnumpy()
+        npzfile = N.load(filename)
+        meta = json.loads(npzfile["meta"].tobytes().decode("utf-8"),
+                          object_hook=_jsonhook)
+        if meta.get("version") != 1:
+            npzfile.close()
+            raise AUTOExceptions.AUTORuntimeError(
+                "Unknown binary format version in %s"%filename)
+        constants = []
+        for c in meta["constants"]:
+            c = parseC.parseC(c)
+            if c.get("homcont") is not None:
+                c["homcont"] = parseH.parseH(c["homcont"])
+            constants.append(c)
+        solutions = meta["solutions"]
+        inputfile = parseS.binaryS(
+            npzfile, ["solution%d"%i for i in range(len(solutions))],
+            [sol["header"] for sol in solutions], filename)
+        data = []
+        for i, b in enumerate(meta["branches"]):
+            d = bifDiagBranch()
+            labels = {}
+            for idx, key, v in b["labels"]:
+                labels.setdefault(idx, {})[key] = v
+            labels = Points.PointInfo(labels)
+            if b["coordnames"] != []:
+                Points.Pointset.__init__(d, {
+                    "coordarray": npzfile["branch%d"%i],
+                    "coordnames": b["coordnames"],
+                    "labels": labels})
+            else:
+                d.coordarray = []
+                d.coordnames = []
+                d.labels = labels
+            d.BR = b["BR"]
+            if b["TY"] is not None:
+                d.TY = b["TY"]
+            d.headerlist = b["headerlist"]
+            d.headernames = b["headernames"]
+            d.c = None
+            if b["c"] is not None:
+                d.c = constants[b["c"]]
+            if "diagnostics" in b:
+                d.diagnostics = parseD.parseD([{"Text": text}
+                                               for text in b["diagnostics"]])
+            for ind in d.labels.getIndices():
+                x = d._gettypelabel(ind)[1]
+                if "solution" not in x:
+                    continue
+                j = x["solution"]
+                s = x["solution"] = parseS.AUTOSolution(inputfile, j, filename)
+                if solutions[j]["c"] is not None:
+                    s.update(constants=constants[solutions[j]["c"]])
+                if d.coordnames != []:
+                    s.b = d[ind]
+            data.append(d)
+        self.data = data
+
     # Removes solutions with the given labels or type names
     def deleteLabel(self,label=None,keepTY=0,keep=0,copy=0):
+        self.__labelindex = None
         # accept a user-defined boolean function
         if isinstance(label, types.FunctionType):
             deletesols = self(label)
@@ -219,6 +376,41 @@ class bifDiag(parseB.parseBR):
             return
         return parseB.parseBR.deleteLabel(self,label,keepTY,keep,copy)
 
+    def relabel(self,old_label=None,new_label=None):
+        self.__labelindex = None
+        return parseB.parseBR.relabel(self,old_label,new_label)
+
+    def uniquelyLabel(self):
+        self.__labelindex = None
+        parseB.parseBR.uniquelyLabel(self)
+
+def _importnumpy():
+    # the binary format needs numpy
+    if not Points.numpyimported:
+        Points.importnumpy()
+    if not hasattr(Points.N, "savez"):
+        raise AUTOExceptions.AUTORuntimeError(
+            "The binary format requires numpy.")
+    return Points.N
+
+def _jsondefault(o):
+    # numpy scalars, tuples and AUTOParameters in constants
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    if hasattr(o, "toarray"):
+        return list(o.toarray())
+    raise TypeError("%r is not JSON serializable"%(o,))
+
+def _jsonhook(dct):
+    # JSON gives unicode strings in Python 2
+    def tostr(x):
+        if isinstance(x, list):
+            return [tostr(y) for y in x]
+        if not isinstance(x, str) and hasattr(x, "encode"):
+            return x.encode("utf-8")
+        return x
+    return dict([(tostr(k), tostr(v)) for k, v in dct.items()])
+
 class bifDiagBranch(parseB.AUTOBranch):
     def __init__(self,input=None):
         parseB.AUTOBranch.__init__(self,input)
@@ -346,6 +538,35 @@ def test():
 
     if len(foo.getLabels()) != 5:
         raise AUTOExceptions.AUTORegressionError("Incorrect number of labels")
+    sols = foo()
+    for label in foo.getLabels():
+        s = foo(label)
+        if (s is not foo(label) or s is not sols(label) or
+            foo(s["Type name"] + "1") is not sols(s["Type name"] + "1")):
+            raise AUTOExceptions.AUTORegressionError("Incorrect label index")
+
+    if hasattr(Points.N, "savez"):
+        print("Testing the binary format")
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "test.npz")
+            foo.writeBinaryFilename(name)
+            bar = bifDiag()
+            bar.readBinaryFilename(name)
+            if len(bar[0]) != 150 or bar.getLabels() != foo.getLabels():
+                raise AUTOExceptions.AUTORegressionError(
+                    "Binary format round trip failed")
+            pointtest7(bar[0].getIndex(0),foo[0].getIndex(57))
+            pointtest8(bar().getIndex(0),foo().getIndex(3))
+            if list(bar(8)["U(1)"]) != list(foo(8)["U(1)"]):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Binary format round trip failed")
+            # load everything, which closes the file
+            bar().read()
+        finally:
+            shutil.rmtree(tmpdir)
 
     print("Deleting labels")
     foo.deleteLabel(range(6,9))
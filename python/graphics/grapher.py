@@ -9,6 +9,7 @@ except ImportError:
     from tkinter import filedialog as tkFileDialog
 from graphics import Pmw
 import AUTOutil
+import Points
 from graphics import optionHandler
 import math
 import sys
@@ -17,6 +18,67 @@ import string
 GrapherError="GrapherError"
 Axes3D=None
 
+def decimate(x,y,minx,maxx,width,keep=()):
+    """Return the sorted indices of the points of the curve through x and
+    y that are needed to draw it with width pixel columns between minx
+    and maxx, or None if all points are needed.
+
+    Of every run of consecutive points in the same column, the first,
+    last, lowest and highest points are kept, so the curve looks the same
+    at this width. The indices in keep are always kept."""
+    if not Points.numpyimported:
+        Points.importnumpy()
+    N = Points.N
+    if (not hasattr(N, "flatnonzero") or width is None or
+        len(x) <= 4 * width or not maxx > minx):
+        return None
+    x = N.asarray(x, float)
+    y = N.asarray(y, float)
+    # points outside the plot go to the columns just left or right of it
+    col = N.clip(N.floor((x - minx) * (width / (maxx - minx))), -1, width)
+    starts = N.concatenate(([0], N.flatnonzero(col[1:] != col[:-1]) + 1))
+    lengths = N.diff(N.concatenate((starts, [len(x)])))
+    run = N.repeat(N.arange(len(starts)), lengths)
+    kept = N.zeros(len(x), bool)
+    kept[starts] = True
+    kept[starts + lengths - 1] = True
+    kept[N.asarray(keep, int)] = True
+    for extreme in [N.minimum, N.maximum]:
+        found = N.flatnonzero(y == extreme.reduceat(y, starts)[run])
+        # only the first one of each run
+        runs = run[found]
+        kept[found[N.concatenate(([True], runs[1:] != runs[:-1]))]] = True
+    return N.flatnonzero(kept)
+
+def _minmax(seq):
+    # the minimum and maximum of seq; numpy arrays are reduced in one go
+    # instead of element by element
+    if not Points.numpyimported:
+        Points.importnumpy()
+    N = Points.N
+    if hasattr(N, "ndarray") and isinstance(seq, N.ndarray):
+        return seq.min(), seq.max()
+    return min(seq), max(seq)
+
+# the directions in which findsp searches for space for a label, in the
+# order of the search: radius, angle, cosine and sine of the angle
+_spiral = None
+
+def _spiraltable():
+    global _spiral
+    if _spiral is None:
+        N = Points.N
+        pi2 = math.pi * 2.0
+        start = pi2 / 12.0
+        npoint = 16
+        table = []
+        for radius in range(3,71):
+            npoint = npoint + 8
+            for st in [start + (float(i)/npoint)*pi2 for i in range(npoint)]:
+                table.append((radius, st, math.cos(st), math.sin(st)))
+        _spiral = [N.array(column) for column in zip(*table)]
+    return _spiral
+
 class BasicGrapher(optionHandler.OptionHandler,Tkinter.Canvas):
     """Documentation string for Basic Grapher
 
@@ -61,6 +123,7 @@ class BasicGrapher(optionHandler.OptionHandler,Tkinter.Canvas):
         optionDefaults["symbol_font"] = ("-misc-fixed-*-*-*-*-*-*-*-*-*-*-*-*",callback)
         optionDefaults["symbol_color"] = ("red",callback)
         optionDefaults["smart_label"] = (True,callback)
+        optionDefaults["decimate"] = (True,callback)
         optionDefaults["line_width"] = (2,callback)
         optionDefaults["realwidth"] = (1,callback)
         optionDefaults["realheight"] = (1,callback)
@@ -131,14 +194,11 @@ class BasicGrapher(optionHandler.OptionHandler,Tkinter.Canvas):
             new_array["newsect"]=newsect
             new_array["color"]=color
             if len(array[0]) > 0:
-                new_array["minx"]=min(array[0])
-                new_array["maxx"]=max(array[0])
+                new_array["minx"],new_array["maxx"]=_minmax(array[0])
             if len(array[1]) > 0:
-                new_array["miny"]=min(array[1])
-                new_array["maxy"]=max(array[1])
+                new_array["miny"],new_array["maxy"]=_minmax(array[1])
             if "z" in new_array and len(array[2]) > 0:
-                new_array["minz"]=min(array[2])
-                new_array["maxz"]=max(array[2])
+                new_array["minz"],new_array["maxz"]=_minmax(array[2])
             self.data.append(new_array)
         
     def addData(self,data):
@@ -185,6 +245,45 @@ class BasicGrapher(optionHandler.OptionHandler,Tkinter.Canvas):
         self.clear()
         self.draw()
 
+    def _restyle(self):
+        # bring what is drawn in line with the colors and symbols in
+        # self.data and self.labels; the Tk canvas is always redrawn
+        # from scratch, so there is nothing to do here
+        pass
+
+    def _plotwidth(self):
+        # the width of the plot area in pixels, or None if not known yet
+        width = int(self.cget("realwidth"))
+        if width <= 1:
+            return None
+        return width - (self.cget("left_margin") + self.cget("right_margin"))
+
+    def _keptindices(self,index):
+        # the indices of the points of data set index that decimation keeps
+        return []
+
+    def _decimated(self,index):
+        # the indices of the points of data set index that are drawn at
+        # the current zoom level and size, or None for all points
+        d = self.data[index]
+        if not self.cget("decimate"):
+            return None
+        keep = self._keptindices(index)
+        key = (self.cget("minx"), self.cget("maxx"), self._plotwidth(),
+               tuple(keep))
+        if d.get("decimated", (None,))[0] != key:
+            d["decimated"] = key, decimate(d["x"], d["y"], key[0], key[1],
+                                           key[2], keep)
+        return d["decimated"][1]
+
+    def _drawndata(self,index,coords="xy"):
+        # the coordinates of the points of data set index that are drawn
+        d = self.data[index]
+        indices = self._decimated(index)
+        if indices is None:
+            return [d[coord] for coord in coords]
+        return [Points.N.take(d[coord], indices) for coord in coords]
+
     def _round(self,val,increment):
         "This function returns the closest integer multiple to increment"
         quotient = val/increment
@@ -288,7 +387,7 @@ class BasicGrapher(optionHandler.OptionHandler,Tkinter.Canvas):
         xscale = (float(maxx) - minx) / adjwidth
         yscale = (float(maxy) - miny) / adjheight
         i=-1
-        for d in self.data:
+        for index, d in enumerate(self.data):
             if d["newsect"] is None or d["newsect"]:
                 i = i+1
             if d["color"] is None:
@@ -306,13 +405,22 @@ class BasicGrapher(optionHandler.OptionHandler,Tkinter.Canvas):
                                  tags=("data_point:%d"%(0,),"curve:%d"%(i,),"data"),
                                  fill=fill)
             else:
-                line = [x, y]
                 xs = d["x"]
                 ys = d["y"]
                 stable = d["stable"]
-                for j in range(1, n):
-                    line.append((xs[j]-minx) / xscale + left_margin)
-                    line.append((adjheight - (ys[j]-miny) / yscale + top_margin))
+                indices = self._decimated(index)
+                if indices is None:
+                    line = [x, y]
+                    for j in range(1, n):
+                        line.append((xs[j]-minx) / xscale + left_margin)
+                        line.append((adjheight - (ys[j]-miny) / yscale + top_margin))
+                else:
+                    N = Points.N
+                    line = N.empty((len(indices), 2))
+                    line[:,0] = (N.take(xs, indices)-minx) / xscale + left_margin
+                    line[:,1] = (adjheight - (N.take(ys, indices)-miny) / yscale
+                                 + top_margin)
+                    line = line.ravel().tolist()
                 if stable is None or stable:
                     self.create_line(line,width=line_width,tags=(curve,"data"),fill=fill)
                 else:
@@ -442,6 +550,17 @@ class BasicGrapher(optionHandler.OptionHandler,Tkinter.Canvas):
         valuetocanvasfast = self.__valueToCanvasFast
         sp2 = 5 #fontsize
         sp4 = 5
+        if hasattr(Points.N, "asarray"):
+            xs = Points.N.asarray(seqs[0], float)
+            ys = Points.N.asarray(seqs[1], float)
+            adjwidth = width - (left_margin + right_margin)
+            adjheight = height - (top_margin + bottom_margin)
+            l = Points.N.empty((len(xs), 2))
+            l[:,0] = ((((xs-minx)/(maxx-minx))*adjwidth + left_margin)
+                      - left_margin) / sp2
+            l[:,1] = ((height - (adjheight - ((ys-miny)/(maxy-miny))*adjheight
+                                 + top_margin)) - bottom_margin) / sp4
+            return l
         l = []
         for i in range(len(seqs[0])):
             val = [seqs[0][i],seqs[1][i]]
@@ -498,6 +617,10 @@ class LabeledGrapher(BasicGrapher):
         self.labels=[]
         BasicGrapher._delAllData(self)
 
+    def _keptindices(self,index):
+        # labelled points are always drawn
+        return [label["j"] for label in self.labels[index]]
+
     def _addData(self,data,newsect=None,color=None,stable=None):
         self.labels.append([])
         BasicGrapher._addData(self,data,newsect,color,stable)
@@ -512,8 +635,8 @@ class LabeledGrapher(BasicGrapher):
         trans = self.transform_seq
         if self.cget("smart_label"):
             mp = self.inarrs()
-            for d in self.data:
-                self.map_curve(mp,trans([d["x"],d["y"]]))
+            for index in range(len(self.data)):
+                self.map_curve(mp,trans(self._drawndata(index)))
         for i, labels in enumerate(self.labels):
             for label in labels:
                 if len(label["text"]) == 0:
@@ -590,6 +713,8 @@ class LabeledGrapher(BasicGrapher):
     #   will be written out anyway.
     #-------------------------------------------------------------------
     def findsp(self,x1,y1,mp):
+        if not isinstance(mp, list):
+            return self.__findspnumpy(x1,y1,mp)
         sp1 = self.cget("left_margin")
         minsx = sp1
         maxsx = self.cget("realwidth") - self.cget("right_margin")
@@ -654,6 +779,60 @@ class LabeledGrapher(BasicGrapher):
         yofft = (radius + 2) * sinst
         return [xoffd1,yoffd1,xoffd2,yoffd2,xofft,yofft,pos]
 
+    def __findspnumpy(self,x1,y1,mp):
+        # findsp for a numpy map: all directions are tried at once
+        N = Points.N
+        sp1 = self.cget("left_margin")
+        minsx = sp1
+        maxsx = self.cget("realwidth") - self.cget("right_margin")
+        sp2 = 5 #fontsize
+        sp3 = self.cget("bottom_margin")
+        minsy = sp3
+        maxsy = self.cget("realheight") - self.cget("top_margin")
+        sp4 = 5
+        xi = (x1 - sp1) / sp2
+        yi = (y1 - sp3) / sp4
+        pi2 = math.pi * 2.0
+        radius, st, cosst, sinst = _spiraltable()
+        hx = len(mp) - 5
+        hy = len(mp[0]) - 5
+        xd = N.trunc(xi + radius * cosst)
+        yd = N.trunc(yi + radius * sinst)
+        candidates = N.flatnonzero((xd <= hx) & (xd >= 3) &
+                                   (yd <= hy) & (yd >= 3))
+        xd = xd[candidates].astype(int)
+        yd = yd[candidates].astype(int)
+        # the number of used entries in the 5x5 square around each entry
+        used = N.zeros((mp.shape[0]+1, mp.shape[1]+1), int)
+        used[1:,1:] = N.cumsum(N.cumsum(mp, 0), 1)
+        used = (used[5:,5:] - used[:-5,5:] - used[5:,:-5] + used[:-5,:-5])
+        r1 = (radius[candidates] + 3) * sp2
+        ix = x1 + r1 * cosst[candidates]
+        iy = y1 + r1 * sinst[candidates]
+        found = N.flatnonzero((used[xd-2,yd-2] == 0) &
+                              (ix>=minsx) & (ix<=maxsx) &
+                              (iy>=minsy) & (iy<=maxsy))
+        if len(found) == 0:
+            return [1,1,10,10,11,11,4] #if no empty space
+        k = candidates[found[0]]
+        xd = xd[found[0]]
+        yd = yd[found[0]]
+        mp[xd-2:xd+3,yd-1:yd+2] = 1
+
+        st = float(st[k])
+        pos = int(st/pi2*8.0 - 0.5)
+        radius = int(radius[k]) * sp2
+        cosst = float(cosst[k])
+        sinst = float(sinst[k])
+        d1dist = self.cget("line_width") + 1
+        xoffd1 = d1dist * cosst
+        yoffd1 = d1dist * sinst
+        xoffd2 = radius * cosst
+        yoffd2 = radius * sinst
+        xofft = (radius + 2) * cosst
+        yofft = (radius + 2) * sinst
+        return [xoffd1,yoffd1,xoffd2,yoffd2,xofft,yofft,pos]
+
     def getpos(self,pos):
         anchor = [ "sw", "s", "se", "e", "ne", "n", "nw", "w", "sw" ]
         return anchor[pos]
@@ -669,6 +848,10 @@ class LabeledGrapher(BasicGrapher):
         sp4 = 5
         nx = int(self.cget("realwidth")-sp1-self.cget("right_margin"))//sp2
         ny = int(self.cget("realheight")-sp3-self.cget("top_margin"))//sp4
+        if not Points.numpyimported:
+            Points.importnumpy()
+        if hasattr(Points.N, "zeros") and nx > 0 and ny > 0:
+            return Points.N.zeros((nx, ny), "B")
         r = ny*[0]
         return [r[:] for i in range(nx)]
 
@@ -676,6 +859,9 @@ class LabeledGrapher(BasicGrapher):
     #        Maps the curves in mp array
     #-----------------------------------------------------------------------
     def map_curve(self,mp,xys):
+        if not isinstance(mp, list):
+            self.__mapcurvenumpy(mp,xys)
+            return
         ixmax = len(mp)
         iymax = len(mp[0])
         [x2,y2] = xys[0]
@@ -720,6 +906,55 @@ class LabeledGrapher(BasicGrapher):
                 except IndexError:
                     pass
 
+    def __mapcurvenumpy(self,mp,xys):
+        # map_curve for a numpy map: all line segments are mapped at once,
+        # at the same positions as in map_curve
+        N = Points.N
+        xys = N.asarray(xys, float)
+        if len(xys) < 2:
+            return
+        ixmax, iymax = mp.shape
+        ixys = N.trunc(xys).astype(int)
+        x1, y1 = xys[:-1,0], xys[:-1,1]
+        x2, y2 = xys[1:,0], xys[1:,1]
+        ix1, iy1 = ixys[:-1,0], ixys[:-1,1]
+        ix2, iy2 = ixys[1:,0], ixys[1:,1]
+        #optimize common case of short line segments
+        same = (ix1 == ix2) & (iy1 == iy2)
+        inside = same & (ix1 >= 0) & (ix1 < ixmax) & (iy1 >= 0) & (iy1 < iymax)
+        mp[ix1[inside], iy1[inside]] = 1
+        # skip the lines that are outside the graph limits
+        lines = N.flatnonzero(~same & ~(
+            ((ix1 < 0) & (ix2 < 0)) | ((iy1 < 0) & (iy2 < 0)) |
+            ((ix1 >= ixmax) & (ix2 >= ixmax)) |
+            ((iy1 >= iymax) & (iy2 >= iymax))))
+        x1, y1 = x1[lines], y1[lines]
+        dx = x2[lines] - x1
+        dy = y2[lines] - y1
+        index = N.trunc(N.maximum(abs(dx),abs(dy))) + 1
+        ilow = N.zeros(len(lines))
+        ihigh = index
+        for d, c, cmax in [(dx, x1, ixmax), (dy, y1, iymax)]:
+            nonzero = d != 0
+            d = N.where(nonzero, d, 1)
+            lim1 = -c*index/d
+            lim2 = (cmax-c)*index/d+1
+            ilow = N.where(nonzero, N.maximum(ilow,N.minimum(lim1,lim2)), ilow)
+            ihigh = N.where(nonzero, N.minimum(ihigh,N.maximum(lim1,lim2)),
+                            ihigh)
+        ilow = N.trunc(ilow).astype(int)
+        counts = N.maximum(N.trunc(ihigh).astype(int) - ilow, 0)
+        # all steps i of all lines
+        line = N.repeat(N.arange(len(lines)), counts)
+        i = (N.arange(len(line)) - N.repeat(N.cumsum(counts) - counts, counts)
+             + ilow[line])
+        f = i / index[line]
+        ix = N.trunc(x1[line] + f * dx[line]).astype(int)
+        iy = N.trunc(y1[line] + f * dy[line]).astype(int)
+        # like list indices, negative indices count from the end
+        valid = (ix >= -ixmax) & (ix < ixmax) & (iy >= -iymax) & (iy < iymax)
+        mp[ix[valid], iy[valid]] = 1
+
     def draw(self):
         self.plotlabels()
         BasicGrapher.draw(self)
@@ -950,6 +1185,39 @@ class GUIGrapher(InteractiveGrapher):
 
 
 def test(grapher=None):
+    import random
+    import AUTOExceptions
+    print("Testing decimating curves")
+    rnd = random.Random(1)
+    minx, maxx, width = 0.0, 1.0, 100
+    # a curve that leaves the plot on both sides, with noise in y
+    x = [2 * math.sin(i * 0.002) + 0.5 + rnd.uniform(0, 0.001)
+         for i in range(5000)]
+    y = [rnd.uniform(0, 1) for i in range(5000)]
+    keep = [10, 2500, 4999]
+    if decimate(x[:4*width], y[:4*width], minx, maxx, width) is not None:
+        raise AUTOExceptions.AUTORegressionError("Short curve decimated")
+    kept = decimate(x, y, minx, maxx, width, keep)
+    if kept is not None:
+        # of every run of points in the same column, or off the plot on
+        # one side, the first, last, lowest and highest points remain
+        cols = [min(max(math.floor((v - minx) * (width / (maxx - minx))),
+                        -1), width) for v in x]
+        expected = set(keep)
+        start = 0
+        for i in range(1, len(x) + 1):
+            if i == len(x) or cols[i] != cols[start]:
+                run = range(start, i)
+                expected.update([start, i - 1,
+                                 min(run, key=lambda j: y[j]),
+                                 max(run, key=lambda j: y[j])])
+                start = i
+        if (list(kept) != sorted(expected) or
+            len(kept) >= len(x) / 4 or
+            min(cols) != -1 or max(cols) != width):
+            raise AUTOExceptions.AUTORegressionError(
+                "Wrong points kept when decimating")
+
     if grapher is None:
         grapher = GUIGrapher()
     data = [float(i)*0.1 for i in range(62)]
@@ -2,7 +2,12 @@
 import matplotlib
 matplotlib.use('TkAgg')
 
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+try:
+    from matplotlib.backends.backend_tkagg import NavigationToolbar2TkAgg
+except ImportError: # mpl >= 3.0
+    from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk as \
+        NavigationToolbar2TkAgg
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
 from matplotlib.lines import Line2D
@@ -47,6 +52,12 @@ from graphics import grapher
 
 GrapherError="GrapherError"
 
+def _remove(artists,artist):
+    try:
+        artists.remove(artist)
+    except AttributeError: # mpl >= 3.5: ax.lines and ax.texts are read-only
+        artist.remove()
+
 class FigureCanvasTkAggRedraw(FigureCanvasTkAgg):
     def __init__(self,grapher,parent):
         if parent is None:
@@ -60,7 +71,8 @@ class FigureCanvasTkAggRedraw(FigureCanvasTkAgg):
         self.grapher = grapher
 
     def redraw(self):
-        # recalculate label positions
+        # recalculate the decimation and the label positions
+        self.grapher._updatelines()
         self.grapher.plotlabels()
         FigureCanvasTkAgg.draw(self)
         
@@ -121,8 +133,9 @@ class BasicGrapher(grapher.BasicGrapher):
             self.winfo_rootx = tk_widget.winfo_rootx
             self.winfo_rooty = tk_widget.winfo_rooty
         self.ax.set_autoscale_on(0)
-        self.postscript = self.canvas.print_figure
-        self.savefig = self.ax.get_figure().savefig
+        self.__fullresolution = False
+        self.postscript = self.__savefull(self.canvas.print_figure)
+        self.savefig = self.__savefull(self.ax.get_figure().savefig)
 
         self.redrawlabels = 0
 
@@ -150,6 +163,61 @@ class BasicGrapher(grapher.BasicGrapher):
     def pack(self,**kw):
         self.canvas.get_tk_widget().pack(kw)
 
+    def __savefull(self,save):
+        # saved figures contain all points, whatever is drawn on the screen
+        def savefull(*args,**kw):
+            self.__fullresolution = True
+            self._updatelines()
+            try:
+                return save(*args,**kw)
+            finally:
+                self.__fullresolution = False
+                self._updatelines()
+        return savefull
+
+    def _plotwidth(self):
+        # only decimate 2D plots on the screen
+        if (self.__fullresolution or self.ax is not self.ax2d or
+            not isinstance(self.canvas,FigureCanvasTkAggRedraw)):
+            return None
+        try:
+            return float(self.ax.bbox.width)
+        except TypeError: # old matplotlib
+            return None
+
+    def _restyle(self):
+        # change the colors and line styles of the drawn lines in place
+        color_list = self.cget("color_list").split()
+        line_width = self.cget("line_width")
+        dashes = self.cget("dashes")
+        i = -1
+        for d in self.data:
+            if d["newsect"] is None or d["newsect"]:
+                i = i+1
+            if "mpline" not in d:
+                continue
+            if d["color"] is None:
+                color = i
+            else:
+                color = d["color"]
+            line = d["mpline"]
+            line.set_color(color_list[color%len(color_list)])
+            if len(d["x"]) > 1:
+                line.set_linewidth(line_width)
+                if d["stable"] is not None and not d["stable"]:
+                    line.set_dashes(dashes)
+
+    def _updatelines(self):
+        # redo the decimation after zooming or resizing
+        for index, d in enumerate(self.data):
+            if "mpline" not in d or len(d["x"]) < 2:
+                continue
+            indices = self._decimated(index)
+            if indices is not d.get("mpindices"):
+                d["mpindices"] = indices
+                if self.ax is self.ax2d:
+                    d["mpline"].set_data(*self._drawndata(index))
+
     def update(self):
         if isinstance(self.canvas,FigureCanvasTkAggRedraw):
             self.canvas.get_tk_widget().update()
@@ -245,23 +313,14 @@ class BasicGrapher(grapher.BasicGrapher):
             self.redrawlabels = 1
             if self.cget("grid") in ["yes", True]:
                 self.ax.grid(color=value)
-        elif key == "color_list":
-            color_list = value.split()
-            i = 0
-            for d in self.data:
-                if d["newsect"] is None or d["newsect"]:
-                    i = i+1
-                if d["color"] is None:
-                    color = i
-                else:
-                    color = d["color"]
-                d["mpline"].set_color(color_list[color%len(color_list)])
+        elif key in ["color_list", "line_width", "dashes"]:
+            self._restyle()
         elif key == "decorations":
             if value:
                 self.ax.set_axis_on()
             else:
                 self.ax.set_axis_off()
-        elif key == "use_symbols":
+        elif key in ["use_symbols", "symbol_color"]:
             self.plotsymbols()
         elif key == "use_labels":
             self.plotlabels()
@@ -308,7 +367,7 @@ class BasicGrapher(grapher.BasicGrapher):
     def _delAllData(self):
         for d in self.data:
             if "mpline" in d:
-                self.ax.lines.remove(d["mpline"])
+                _remove(self.ax.lines,d["mpline"])
         self.data=[]
 
         # set type for next data
@@ -360,8 +419,8 @@ class BasicGrapher(grapher.BasicGrapher):
                 self.__optionCallback(key,self.cget(key),[])
 
     def _delData(self,index):
-        if "mpline" in data[index]:
-            self.ax.lines.remove(data[index]["mpline"])
+        if "mpline" in self.data[index]:
+            _remove(self.ax.lines,self.data[index]["mpline"])
         del self.data[index]
 
     def clear(self):
@@ -369,6 +428,7 @@ class BasicGrapher(grapher.BasicGrapher):
             self.ax.get_figure().delaxes(self.ax.get_figure().axes[0])
 
     def draw(self):
+        self._updatelines()
         if self.redrawlabels:
             self.plotlabels()
         if len(self.ax.get_figure().axes) == 0:
@@ -385,12 +445,13 @@ class BasicGrapher(grapher.BasicGrapher):
         line_width=self.cget("line_width")
         dashes=self.cget("dashes")
         i=-1
-        for d in self.data:
+        for index, d in enumerate(self.data):
             if d["newsect"] is None or d["newsect"]:
                 i = i+1
             curve="curve:%d"%(i,)
+            d["mpindices"] = self._decimated(index)
             if self.ax is self.ax2d:
-                v = [d["x"],d["y"]]
+                v = self._drawndata(index)
             else:
                 v = [d["x"],d["y"],d["z"]]
             if d["color"] is None:
@@ -413,10 +474,10 @@ class BasicGrapher(grapher.BasicGrapher):
                 if stable is not None and not stable:
                     kw.update({'ls':'--','dashes':dashes})
             if self.ax is self.ax2d:
-                self.ax.plot(*v,**kw)
+                d["mpline"] = self.ax.plot(*v,**kw)[0]
             else:
                 self.ax.plot3D(*v,**kw)
-            d["mpline"] = self.ax.lines[-1]
+                d["mpline"] = self.ax.lines[-1]
         if len(self.ax.get_figure().axes) == 0:
             self.ax.get_figure().add_axes(self.ax)
             
@@ -439,13 +500,13 @@ class LabeledGrapher(BasicGrapher,grapher.LabeledGrapher):
         for l in self.labels:
             for label in l:
                 if "mpline" in label:
-                    self.ax.lines.remove(label["mpline"])
+                    _remove(self.ax.lines,label["mpline"])
                 if "mptext" in label:
-                    self.ax.texts.remove(label["mptext"])
+                    _remove(self.ax.texts,label["mptext"])
                 if "mpsymline" in label:
-                    self.ax.lines.remove(label["mpsymline"])
+                    _remove(self.ax.lines,label["mpsymline"])
                 if "mpsymtext" in label:
-                    self.ax.texts.remove(label["mpsymtext"])
+                    _remove(self.ax.texts,label["mpsymtext"])
         self.labels=[]
         BasicGrapher._delAllData(self)
 
@@ -461,10 +522,10 @@ class LabeledGrapher(BasicGrapher,grapher.LabeledGrapher):
         for labels in self.labels:
             for label in labels:
                 if "mpline" in label:
-                    self.ax.lines.remove(label["mpline"])
+                    _remove(self.ax.lines,label["mpline"])
                     del label["mpline"]
                 if "mptext" in label:
-                    self.ax.texts.remove(label["mptext"])
+                    _remove(self.ax.texts,label["mptext"])
                     del label["mptext"]
 
         if not self.cget("use_labels"):
@@ -499,9 +560,9 @@ class LabeledGrapher(BasicGrapher,grapher.LabeledGrapher):
             sp2 = 5 #fontsize
             sp3 = self.cget("bottom_margin")
             sp4 = 5
-            for d in self.data:
+            for index, d in enumerate(self.data):
                 if self.ax is self.ax2d:
-                    seq = transseq(d["x"],d["y"])
+                    seq = transseq(*self._drawndata(index))
                 else:
                     seq = transseq(d["x"],d["y"],d["z"])
                 seq[:,0] = (seq[:,0] - sp1) / sp2
@@ -544,10 +605,10 @@ class LabeledGrapher(BasicGrapher,grapher.LabeledGrapher):
                     line = Line2D([xd1,xd2],[yd1,yd2],linewidth=0.5,
                                   color=self.cget("foreground"))
                     self.ax.add_line(line)
-                    self.ax.annotate(label["text"],(xt,yt),ha=ha,va=va,
-                                     color=self.cget("foreground"),clip_on=True)
-                    label["mpline"] = self.ax.lines[-1]
-                    label["mptext"] = self.ax.texts[-1]
+                    label["mpline"] = line
+                    label["mptext"] = self.ax.annotate(
+                        label["text"],(xt,yt),ha=ha,va=va,
+                        color=self.cget("foreground"),clip_on=True)
 
     def getpos(self,pos):
         has = [  "left", "center", "right", "right", "right", "center",
@@ -563,6 +624,10 @@ class LabeledGrapher(BasicGrapher,grapher.LabeledGrapher):
         BasicGrapher.plot(self)
         self.plotsymbols()
 
+    def _restyle(self):
+        BasicGrapher._restyle(self)
+        self.plotsymbols()
+
     def plotsymbols(self):
         for labels in self.labels:
             for label in labels:
@@ -570,29 +635,27 @@ class LabeledGrapher(BasicGrapher,grapher.LabeledGrapher):
                 if Axes3D is None:
                     v = v[:2]
                 l = label["symbol"]
-                if l is None:
-                    continue
                 if "mpsymline" in label:
-                    self.ax.lines.remove(label["mpsymline"])
+                    _remove(self.ax.lines,label["mpsymline"])
                     del label["mpsymline"]
                 if "mpsymtext" in label:
-                    self.ax.texts.remove(label["mpsymtext"])
+                    _remove(self.ax.texts,label["mpsymtext"])
                     del label["mpsymtext"]
-                if not self.cget("use_symbols"):
+                if l is None or not self.cget("use_symbols"):
                     continue
                 c=self.cget("symbol_color")
                 if len(l) <= 3:
                     #font=self.cget("symbol_font"),
                     kw = {'ha':"center",'va':"center",'color':c,'clip_on':True}
                     if self.ax is self.ax2d:
-                        self.ax.text(*(v+[l]),**kw)
+                        t = self.ax.text(*(v+[l]),**kw)
                     else:
                         t = self.ax.text3D(*(v+[l]))
                         t.set_horizontalalignment(kw['ha'])
                         t.set_verticalalignment(kw['va'])
                         t.set_color(kw['color'])
                         t.set_clip_on(True)
-                    label["mpsymtext"] = self.ax.texts[-1]
+                    label["mpsymtext"] = t
                     continue
                 v = [[coord] for coord in v]
                 markerdict = {"fillcircle" : "o", "circle": "o",
@@ -617,10 +680,10 @@ class LabeledGrapher(BasicGrapher,grapher.LabeledGrapher):
                 if ms is not None:
                     kw['ms'] = ms
                 if self.ax is self.ax2d:
-                    self.ax.plot(*v,**kw)
+                    label["mpsymline"] = self.ax.plot(*v,**kw)[0]
                 else:
                     self.ax.plot3D(*v,**kw)
-                label["mpsymline"] = self.ax.lines[-1]
+                    label["mpsymline"] = self.ax.lines[-1]
 
 # FIXME:  No regression tester
 class InteractiveGrapher(LabeledGrapher,grapher.InteractiveGrapher):
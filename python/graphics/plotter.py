@@ -13,6 +13,46 @@ import os
 import gc
 Axes3D = grapher.Axes3D
 
+# options that are only used for one type of plot
+_typeoptions = {
+    "bifurcation": ["bifurcation_x", "bifurcation_y", "bifurcation_z",
+                    "bifurcation_coordnames", "bifurcation_diagram",
+                    "bifurcation_diagram_filename", "stability"],
+    "solution": ["solution_x", "solution_y", "solution_z",
+                 "solution_indepvarname", "solution_coordnames",
+                 "solution", "solution_filename", "index", "label", "mark_t"]}
+# options that give new data to plot
+_dataoptions = ["runner", "bifurcation_diagram", "solution",
+                "bifurcation_diagram_filename", "solution_filename"]
+# options that only change the colors, symbols or axis titles, besides
+# all options ending in "_symbol"
+_restyleoptions = ["coloring_method", "labelnames", "letter_symbols"]
+# options that are not used for drawing the plot
+_otheroptions = ["label_defaults", "bifurcation_column_defaults",
+                 "solution_column_defaults", "ps_colormode"]
+
+# the symbol options for the TY numbers of labelled points
+_symbollist = [
+    [[1,6], "bifurcation_symbol"],
+    [[2,5], "limit_point_symbol"],
+    [[3],   "hopf_symbol"],
+    [[-1],  "bogdanov_takens_symbol"],
+    [[-2],  "cusp_symbol"],
+    [[-32], "generalized_hopf_symbol"],
+    [[-3],  "zero_hopf_symbol"],
+    [[7],   "period_doubling_symbol"],
+    [[8],   "torus_symbol"],
+    [[-5],  "1_1_resonance_symbol"],
+    [[-6],  "1_2_resonance_symbol"],
+    [[-7],  "1_3_resonance_symbol"],
+    [[-8],  "1_4_resonance_symbol"],
+    [[23,83], "fold_torus_symbol"],
+    [[77,87], "flip_torus_symbol"],
+    [[28,78], "fold_flip_symbol"],
+    [[88],  "torus_torus_symbol"],
+    [[-4],  "user_point_symbol"]]
+_specialsymbols = [-32,23,83,77,87,28,78,88]
+
 class plotter(grapher.GUIGrapher):
     def __init__(self,parent=None,**kw):
 
@@ -88,6 +128,10 @@ class plotter(grapher.GUIGrapher):
                 optionDefaultsRC[key] = kw[key]
 
         self.__needsPlot = None
+        # the labels, stability and columns of the branches, by id(),
+        # for the current plot
+        self.__cache = {}
+        self.__titled = False
         grapher.GUIGrapher.__init__(self,parent,**optionDefaultsRC)
 
         self.addOptions(**optionDefaults)
@@ -232,7 +276,7 @@ class plotter(grapher.GUIGrapher):
         rval = self._configNoDraw(cnf,**kw)
         if isinstance(cnf, str) or (cnf is None and not kw):
             return rval
-        if self.__needsPlot:
+        if self.__needsPlot == "yes":
             self._plotNoDraw()
             self.__needsPlot = None
             self.clear()
@@ -241,6 +285,9 @@ class plotter(grapher.GUIGrapher):
             self.computeZRange()
             grapher.GUIGrapher.plot(self)
         else:
+            if self.__needsPlot == "restyle":
+                self.__needsPlot = None
+                self.__restyle()
             self.clear()
         self.draw()
         self.update()
@@ -252,7 +299,8 @@ class plotter(grapher.GUIGrapher):
     _configureNoDraw = _configNoDraw
 
     def __optionCallback(self,key,value,options):
-        gc.collect()
+        if key in _dataoptions:
+            gc.collect()
         if key == "runner":
             self.cget("bifurcation_diagram").read(value.getBifurcation_diagram())
             self.cget("solution").read(value.getSolution())
@@ -315,14 +363,38 @@ class plotter(grapher.GUIGrapher):
             options.update(dict(zip(keys, values)))
 
         # We only recreate the data if one of the above options gets set
+        # and it changes what is plotted.
         # We can't just recreate the data for any option since:
         #   1)  It is inefficient
         #   2)  The range gets recomputed when we create new data, so
         #       minx, miny, maxx, and maxy all never get used.
-        self.__needsPlot = "yes"
-
-    def _plotNoDraw(self):
-        self.delAllData()
+        if key in _restyleoptions or key.endswith("_symbol"):
+            if self.__needsPlot is None:
+                self.__needsPlot = "restyle"
+        elif key in _otheroptions:
+            pass
+        elif key in _typeoptions.get(self.cget("type"), []) or not (
+            key in _typeoptions["bifurcation"] or
+            key in _typeoptions["solution"]):
+            self.__needsPlot = "yes"
+
+    def __restyle(self):
+        # change the colors, symbols, and axis titles of what is plotted,
+        # keeping the data
+        method = self.cget("coloring_method")
+        for d in self.data:
+            if "colors" in d:
+                d["color"] = d["colors"].get(method)
+        for labels in self.labels:
+            for label in labels:
+                if "symbol_option" in label:
+                    label["symbol"] = self.cget(label["symbol_option"])
+        if self.__titled:
+            self.__settitles(self.__columns()[0])
+        self._restyle()
+
+    def __columns(self):
+        # the axis titles and the columns to plot
         ty = self.cget("type")
         columns = [self.cget(ty+"_x"),self.cget(ty+"_y"),self.cget(ty+"_z")]
         for coord in range(3):
@@ -334,6 +406,29 @@ class plotter(grapher.GUIGrapher):
         for coord, column in enumerate(columns):
             if column is not None and len(column) == 1:
                 columns[coord] = column * m
+        return names, columns
+
+    def __settitles(self,names):
+        label = {}
+        for coord in "x","y","z":
+            label[coord] = self[coord+"label"]
+            if self.config(coord+"label")[3] is None:
+                namescoord = names[{"x": 0, "y": 1, "z": 2}[coord]]
+                if namescoord is None:
+                    label["z"] = None
+                else:
+                    label[coord] = ", ".join(namescoord)
+        grapher.GUIGrapher._configNoDraw(self,xlabel=label["x"],
+                                         ylabel=label["y"],
+                                         zlabel=label["z"])
+
+    def _plotNoDraw(self):
+        # the data may have changed in place since the last plot, for
+        # instance by relabel(), so cached labels and columns are stale
+        self.__cache = {}
+        self.delAllData()
+        ty = self.cget("type")
+        names, columns = self.__columns()
         plot = True
         if ty == "bifurcation":
             sol = self.cget(ty+"_diagram")
@@ -345,19 +440,9 @@ class plotter(grapher.GUIGrapher):
             self.__plot8(*columns)
         else:
             plot = False
+        self.__titled = plot
         if plot:
-            label = {}
-            for coord in "x","y","z":
-                label[coord] = self[coord+"label"]
-                if self.config(coord+"label")[3] is None:
-                    namescoord = names[{"x": 0, "y": 1, "z": 2}[coord]]
-                    if namescoord is None:
-                        label["z"] = None
-                    else:
-                        label[coord] = ", ".join(namescoord)
-            grapher.GUIGrapher._configNoDraw(self,xlabel=label["x"],
-                                             ylabel=label["y"],
-                                             zlabel=label["z"])
+            self.__settitles(names)
 
     def plot(self):
         self._plotNoDraw()
@@ -478,81 +563,115 @@ class plotter(grapher.GUIGrapher):
                 cols.append(ncol)
         return names,cols
 
+    def __cached(self,obj):
+        # the cached plot data of a branch or solution
+        entry = self.__cache.get(id(obj))
+        if entry is None or entry[0] is not obj:
+            entry = obj, {}
+            self.__cache[id(obj)] = entry
+        return entry[1]
+
+    def __adddata(self,v,newsect,colors,stable=None):
+        color = colors.get(self.cget("coloring_method"))
+        self.addArrayNoDraw(v,newsect,color,stable)
+        # remember the colors for the other coloring methods
+        self.data[-1]["colors"] = colors
+
+    def __addlabel(self,j,text,option):
+        # remember the option for the symbol, so that changing it only
+        # changes the symbol
+        symbol = None
+        if option is not None:
+            symbol = self.cget(option)
+        self.addLabel(len(self)-1,j,text,symbol)
+        if option is not None:
+            self.labels[-1][-1]["symbol_option"] = option
+
+    def __branchlabels(self,branch):
+        # the index, text and symbol option of every labelled point
+        labels = []
+        for i,l in branch.labels.sortByIndex():
+            label = None
+            for k in l:
+                v = l[k]
+                if "LAB" in v:
+                    label = v
+                    break
+            if label is None:
+                continue
+            lab = label["LAB"]
+            TYnumber = label["TY number"]
+            if TYnumber not in _specialsymbols:
+                if TYnumber>=0:
+                    TYnumber=TYnumber%10
+                else:
+                    TYnumber=-((-TYnumber)%10)
+            text = ""
+            if lab != 0:
+                text = str(lab)
+            symbol = None
+            for item in _symbollist:
+                if TYnumber in item[0]:
+                    symbol = item[1]
+            if symbol is None and TYnumber not in [0,4,9]:
+                symbol = "error_symbol"
+            labels.append((i, text, symbol))
+        return labels
+
+    def __branchsegments(self,branch):
+        # the start, end and stability of the parts with equal stability
+        segments = []
+        old = 0
+        stability = branch.stability()
+        for pt in stability:
+            abspt = abs(pt)
+            if abspt > 1 or pt == stability[-1]:
+                segments.append((old, abspt, pt<0))
+                old = abspt - 1
+        return segments
+
+    def __branchcolumn(self,branch,col):
+        # the values of column col, or None if there is no such column
+        coordnames = branch.coordnames
+        if type(col) != type(1):
+            try:
+                col = coordnames.index(col)
+            except ValueError:
+                # check if we have an item that starts with
+                # MAX, MIN, INTEGRAL, or L2-NORM
+                # in that case also plot U(1) if given MAX U(1)
+                namelist = col.split(None,1)
+                if len(namelist) < 2 or (namelist[0] not in 
+                          ["MAX", "MIN", "INTEGRAL", "L2-NORM"]):
+                    return None
+                try:
+                    col = coordnames.index(namelist[1])
+                except ValueError:
+                    return None
+        try:
+            return branch.coordarray[col]
+        except IndexError:
+            return None
+
     def __plot7branch(self,branch,xcolumns,ycolumns,zcolumns):
-        symbollist = [
-            [[1,6], "bifurcation_symbol"],
-            [[2,5], "limit_point_symbol"],
-            [[3],   "hopf_symbol"],
-            [[-1],  "bogdanov_takens_symbol"],
-            [[-2],  "cusp_symbol"],
-            [[-32], "generalized_hopf_symbol"],
-            [[-3],  "zero_hopf_symbol"],
-            [[7],   "period_doubling_symbol"],
-            [[8],   "torus_symbol"],
-            [[-5],  "1_1_resonance_symbol"],
-            [[-6],  "1_2_resonance_symbol"],
-            [[-7],  "1_3_resonance_symbol"],
-            [[-8],  "1_4_resonance_symbol"],
-            [[23,83], "fold_torus_symbol"],
-            [[77,87], "flip_torus_symbol"],
-            [[28,78], "fold_flip_symbol"],
-            [[88],  "torus_torus_symbol"],
-            [[-4],  "user_point_symbol"]]
-        specialsymbols = [-32,23,83,77,87,28,78,88]
+        # the labels, stability parts, and columns do not depend on the
+        # options, so they are only computed once per branch and plot
+        cache = self.__cached(branch)
+        if "labels" not in cache:
+            cache["labels"] = self.__branchlabels(branch)
+            cache["colors"] = {"branch": abs(branch.BR)-1, "type": branch.TY}
+        labels = cache["labels"]
+        colors = cache["colors"]
         dp = self.cget("stability")
-        coordnames = branch.coordnames
         for j in range(len(xcolumns)):
-            labels = []
-            for i,l in branch.labels.sortByIndex():
-                label = None
-                for k in l:
-                    v = l[k]
-                    if "LAB" in v:
-                        label = v
-                        break
-                if label is None:
-                    continue
-                lab = label["LAB"]
-                TYnumber = label["TY number"]
-                if TYnumber not in specialsymbols:
-                    if TYnumber>=0:
-                        TYnumber=TYnumber%10
-                    else:
-                        TYnumber=-((-TYnumber)%10)
-                text = ""
-                if lab != 0:
-                    text = str(lab)
-                symbol = None
-                for item in symbollist:
-                    if TYnumber in item[0]:
-                        symbol = item[1]
-                if symbol is not None:
-                    symbol = self.cget(symbol)
-                elif TYnumber not in [0,4,9]:
-                    symbol = self.cget("error_symbol")
-                labels.append([i, text, symbol])
             xycols = []
             for col in [xcolumns[j],ycolumns[j],zcolumns[j]]:
                 if col is None:
                     break
-                if type(col) != type(1):
-                    try:
-                        col = coordnames.index(col)
-                    except ValueError:
-                        # check if we have an item that starts with
-                        # MAX, MIN, INTEGRAL, or L2-NORM
-                        # in that case also plot U(1) if given MAX U(1)
-                        namelist = col.split(None,1)
-                        if len(namelist) < 2 or (namelist[0] not in 
-                                  ["MAX", "MIN", "INTEGRAL", "L2-NORM"]):
-                            break
-                        try:
-                            col = coordnames.index(namelist[1])
-                        except ValueError:
-                            break
-                try:
-                    xy = branch.coordarray[col]
-                except IndexError:
+                if ("column", col) not in cache:
+                    cache["column", col] = self.__branchcolumn(branch,col)
+                xy = cache["column", col]
+                if xy is None:
                     break
                 xycols.append(xy)
             if len(xycols) < 2 or (zcolumns[j] is not None and len(xycols) < 3):
@@ -562,41 +681,33 @@ class plotter(grapher.GUIGrapher):
                 z = xycols[2]
             else:
                 z = None
-            if self.cget("coloring_method") == "branch":
-                color = abs(branch.BR)-1
-            elif self.cget("coloring_method") == "type":
-                color = branch.TY
-            else:
-                color = None
             if dp:
                 #look at stability:
+                if "segments" not in cache:
+                    cache["segments"] = self.__branchsegments(branch)
                 newsect = 1
-                old = 0
-                stability = branch.stability()
-                addedlabels = []
-                for pt in stability:
-                    abspt = abs(pt)
-                    if abspt > 1 or pt == stability[-1]:
-                        if z is None:
-                            v = x[old:abspt],y[old:abspt]
-                        else:
-                            v = x[old:abspt],y[old:abspt],z[old:abspt]
-                        self.addArrayNoDraw(v,newsect,color,stable=pt<0)
-                        for label in labels:
-                            if (old <= label[0] and label[0] < abspt and
-                                label not in addedlabels):
-                                self.addLabel(len(self)-1, label[0] - old,
-                                              label[1], label[2])
-                                addedlabels.append(label)
-                        old = abspt - 1
-                        newsect = 0
+                k = 0
+                for old, abspt, stable in cache["segments"]:
+                    if z is None:
+                        v = x[old:abspt],y[old:abspt]
+                    else:
+                        v = x[old:abspt],y[old:abspt],z[old:abspt]
+                    self.__adddata(v,newsect,colors,stable)
+                    # the labels are sorted: each one goes to the first
+                    # part that contains it
+                    while k < len(labels) and labels[k][0] < abspt:
+                        i, text, symbol = labels[k]
+                        if old <= i:
+                            self.__addlabel(i - old, text, symbol)
+                        k += 1
+                    newsect = 0
             else:
                 if z is None:
-                    self.addArrayNoDraw((x,y),1,color)
+                    self.__adddata((x,y),1,colors)
                 else:
-                    self.addArrayNoDraw((x,y,z),1,color)
+                    self.__adddata((x,y,z),1,colors)
                 for label in labels:
-                    self.addLabel(len(self)-1, *label)
+                    self.__addlabel(*label)
 
     def __plot7(self,xcolumns,ycolumns,zcolumns):
         self.delAllData()
@@ -613,12 +724,7 @@ class plotter(grapher.GUIGrapher):
         if self.cget("solution_indepvarname"):
             indepvarname = self.cget("solution_indepvarname")
         coordnames = sol.coordnames
-        if self.cget("coloring_method") == "branch":
-            color = sol["BR"]-1
-        elif self.cget("coloring_method") == "type":
-            color = sol["TY number"]
-        else:
-            color = None
+        colors = {"branch": sol["BR"]-1, "type": sol["TY number"]}
         for j in range(len(xcolumns)):
             labels = []
             xycols = []
@@ -659,9 +765,9 @@ class plotter(grapher.GUIGrapher):
             # Call the base class config
             if len(x) > 0:
                 if z is None:
-                    self.addArrayNoDraw((x,y),color=color)
+                    self.__adddata((x,y),None,colors)
                 else:
-                    self.addArrayNoDraw((x,y,z),color=color)
+                    self.__adddata((x,y,z),None,colors)
             for lab in labels:
                 self.addLabel(len(self)-1, lab["index"], lab["text"],
                               lab["symbol"])
@@ -683,10 +789,65 @@ class plotter(grapher.GUIGrapher):
 
 
 
+def _plotstate(foo):
+    # the data, labels and ranges that a plotter shows
+    data = [(list(d["x"]), list(d["y"]), d["stable"], d["newsect"],
+             d["color"]) for d in foo.data]
+    labels = [[(label["j"], label["text"], label["symbol"])
+               for label in labels] for labels in foo.labels]
+    ranges = [foo.cget(key) for key in ["minx", "maxx", "miny", "maxy"]]
+    return data, labels, ranges
+
 def test():
-    import parseB
-    import parseS
-    import sys
+    import AUTOExceptions
+    print("Testing changing options of a hidden plotter")
+    foo = plotter(hide=True,
+                  bifurcation_diagram_filename="../test_data/fort.7",
+                  solution_filename="../test_data/fort.8")
+    foo.config(stability=True)
+    foo.config(bifurcation_y=["MAX(1)"], color_list="red green")
+    bd = foo.cget("bifurcation_diagram")
+    bd.relabel(6,60)
+    foo.config(bifurcation_y=["L2-NORM"])
+    foo.config(coloring_method="branch")
+    ref = plotter(hide=True, bifurcation_diagram=bd,
+                  solution_filename="../test_data/fort.8",
+                  stability=True, bifurcation_y=["L2-NORM"],
+                  color_list="red green", coloring_method="branch")
+    if _plotstate(foo) != _plotstate(ref):
+        raise AUTOExceptions.AUTORegressionError(
+            "Plot differs from a new plotter with the same options")
+    if "60" not in [label[1] for label in _plotstate(foo)[1][0]]:
+        raise AUTOExceptions.AUTORegressionError("Relabelling not plotted")
+
+    print("Testing the list and numpy maps for placing labels")
+    import random
+    rnd = random.Random(1)
+    mp = foo.inarrs()
+    if not isinstance(mp, list):
+        lmp = mp.tolist()
+        nx, ny = mp.shape
+        for k in range(20):
+            # short steps with jumps, partly outside the map
+            xys = [(rnd.uniform(-10, nx+10), rnd.uniform(-10, ny+10))]
+            for i in range(rnd.randint(0, 100)):
+                x, y = xys[-1]
+                step = rnd.choice([1, 1, 1, 30])
+                xys.append((x + rnd.uniform(-step, step),
+                            y + rnd.uniform(-step, step)))
+            foo.map_curve(mp, xys)
+            foo.map_curve(lmp, xys)
+        if mp.tolist() != lmp:
+            raise AUTOExceptions.AUTORegressionError(
+                "List and numpy curve maps differ")
+        for k in range(30):
+            x = rnd.uniform(0, foo.cget("realwidth"))
+            y = rnd.uniform(0, foo.cget("realheight"))
+            if (foo.findsp(x, y, mp) != foo.findsp(x, y, lmp) or
+                mp.tolist() != lmp):
+                raise AUTOExceptions.AUTORegressionError(
+                    "List and numpy label positions differ")
+
     foo = plotter(bifurcation_diagram_filename="../test_data/fort.7",
                   solution_filename="../test_data/fort.8")
 
@@ -211,6 +211,9 @@ class WindowPlotter(Pmw.MegaToplevel):
         rval = self.grapher.config(cnf,**kw)
         if isinstance(cnf, str) or (cnf is None and not kw):
             return rval
+        if not hasattr(self, "labelEntry"):
+            # hidden plot without widgets
+            return
         self.checktype()
         dct = (cnf or {}).copy()
         dct.update(kw)
@@ -17,11 +17,15 @@
 #    Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
 #    MA 02111-1307, USA
 
+import array
+import bisect
 import os
+import re
 import sys
+import warnings
 import AUTOExceptions
 import AUTOutil
-from AUTOutil import format19_10E3
+from AUTOutil import format19_10E3s
 try:
     from UserList import UserList
 except ImportError: # Python 3
@@ -236,7 +240,7 @@ class BDPoint(Points.Point):
             if coords == "BR":
                 return self.branch["BR"]
             elif coords == "PT":
-                if self.__fullyParsed:
+                if self.pt is None:
                     pt = self.idx+1
                     for p in self.branch.stability():
                         if abs(p) >= pt:
@@ -282,15 +286,140 @@ class BDPoint(Points.Point):
     __repr__ = __str__
 
 # a branch within the parseB class
+# line offsets in BDLines: 64 bit where the array module has them
+try:
+    array.array('q')
+    _offsettype = 'q'
+except ValueError: # Python < 3.3
+    _offsettype = 'l'
+
+# the lines of an AUTOBranch that is not parsed yet
+class BDLines(object):
+    """The lines of an unparsed branch, kept as one string with an array
+    of the offsets where the lines start, instead of a list of strings.
+
+    While reading, lines are collected in a short list that is joined
+    every chunk lines; the last two lines always stay in that list so
+    that they can still be changed or removed cheaply. Changed lines
+    from the joined text are kept separately."""
+    chunk = 4096
+
+    def __init__(self, lines=None):
+        # the joined pieces of text and the numbers of their first lines
+        self.__chunks = []
+        self.__starts = []
+        self.__offsets = array.array(_offsettype, [0])
+        self.__pending = []
+        self.__patched = {}
+        if lines is not None:
+            for line in lines:
+                self.append(line)
+
+    def __len__(self):
+        return len(self.__offsets) - 1 + len(self.__pending)
+
+    def __text(self):
+        if len(self.__chunks) != 1:
+            self.__chunks = ["".join(self.__chunks)]
+            self.__starts = [0]
+        return self.__chunks[0]
+
+    def __index(self, i):
+        if i < 0:
+            i = i + len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("line index out of range")
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if i == slice(None):
+                return self.copy()
+            return BDLines([self[j] for j in range(*i.indices(len(self)))])
+        i = self.__index(i)
+        n = len(self.__offsets) - 1
+        if i >= n:
+            return self.__pending[i - n]
+        if i in self.__patched:
+            return self.__patched[i]
+        k = bisect.bisect(self.__starts, i) - 1
+        offsets = self.__offsets
+        base = offsets[self.__starts[k]]
+        return self.__chunks[k][offsets[i]-base:offsets[i+1]-base]
+
+    def __setitem__(self, i, line):
+        i = self.__index(i)
+        n = len(self.__offsets) - 1
+        if i >= n:
+            self.__pending[i - n] = line
+        else:
+            self.__patched[i] = line
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, line):
+        pending = self.__pending
+        pending.append(line)
+        if len(pending) > self.chunk:
+            offsets = self.__offsets
+            self.__starts.append(len(offsets) - 1)
+            offset = offsets[-1]
+            for line in pending[:-2]:
+                offset = offset + len(line)
+                offsets.append(offset)
+            self.__chunks.append("".join(pending[:-2]))
+            del pending[:-2]
+
+    def pop(self):
+        if len(self.__pending) == 0:
+            # only happens if the last lines were joined already
+            line = self[-1]
+            self.__offsets.pop()
+            self.__chunks = [self.__text()[:self.__offsets[-1]]]
+            self.__patched.pop(len(self.__offsets) - 1, None)
+            return line
+        return self.__pending.pop()
+
+    def copy(self):
+        new = BDLines()
+        new.__chunks = self.__chunks[:]
+        new.__starts = self.__starts[:]
+        new.__offsets = array.array(_offsettype, self.__offsets)
+        new.__pending = self.__pending[:]
+        new.__patched = self.__patched.copy()
+        return new
+
+    def text(self):
+        """Return all lines as one string."""
+        text = self.__text()
+        if self.__patched:
+            offsets = self.__offsets
+            pieces = []
+            prev = 0
+            for i in sorted(self.__patched):
+                pieces.extend([text[prev:offsets[i]], self.__patched[i]])
+                prev = offsets[i+1]
+            pieces.append(text[prev:])
+            text = "".join(pieces)
+        if self.__pending:
+            text = text + "".join(self.__pending)
+        return text
+
 class AUTOBranch(parseBMixin, Points.Pointset):
-    def __init__(self,input=None,prevline=None,coordnames=[]):
+    def __init__(self,input=None,prevline=None,coordnames=[],columns=None):
         self.__fullyParsed = True
+        # the columns to parse, and where to find the ones that were left out
+        self.__columns = None
+        self.__rest = None
         if isinstance(input,AUTOBranch):
             for k,v in input.__dict__.items():
                 self.__dict__[k] = v
         elif input is not None:
             self.read(input,prevline)
             self.__fullyParsed = False
+            self.__columns = columns
 
     def __getattr__(self,attr):
         if self.__fullyParsed or attr == "__del__":
@@ -298,6 +427,11 @@ class AUTOBranch(parseBMixin, Points.Pointset):
         self.__parse()
         return super(AUTOBranch, self).__getattribute__(attr)
 
+    def __getstate__(self):
+        # For pickle: parse everything
+        self.__parse()
+        return Points.Pointset.__getstate__(self)
+
     def _gettypelabel(self,idx):
         for k,v in self.labels[idx].items():
             if "LAB" in v:
@@ -311,7 +445,6 @@ class AUTOBranch(parseBMixin, Points.Pointset):
         if not Points.numpyimported:
             Points.importnumpy()
         self.__fullyParsed = True
-        fromstring = Points.fromstring
         N = Points.N
         datalist = self.__datalist
         del self.__datalist
@@ -319,27 +452,31 @@ class AUTOBranch(parseBMixin, Points.Pointset):
         self.BR = int(line0[0])
         ncolumns = len(line0)
         nrows = len(datalist)
-        datalist = "".join(datalist)
-        if fromstring: #numpy
-            data = []
-            if "D" not in datalist:
-                data = fromstring(datalist, dtype=float, sep=' ')
-            if len(data) != nrows * ncolumns:
-                data = N.array(map(AUTOatof,datalist.split()), 'd')
-            else:
-                #make sure the last element is correct
-                #(fromstring may not do this correctly for a
-                #string like -2.05071-106)
-                data[-1] = AUTOatof(datalist[datalist.rfind(' ')+1:].strip())
-        else: #array
-            datalist = datalist.split()
-            try:
-                data = N.array(map(float, datalist), 'd')
-            except ValueError:
-                data = N.array(map(AUTOatof, datalist), 'd')
-        data.shape = (-1,ncolumns)
-        coordarray = N.transpose(data[:,4:]).copy()
-        points = data[:,1]
+        # sometimes the columns names are the same: add spaces to those
+        for i in range(len(self.coordnames)):
+            name = self.coordnames[i]
+            if self.coordnames.count(name) > 1:
+                for j in range(i+1,len(self.coordnames)):
+                    if self.coordnames[j] == name:
+                        self.coordnames[j] = name + ' '
+        coordnames = self.coordnames
+        indices = []
+        if self.__columns is not None:
+            indices = [i for i, name in enumerate(coordnames)
+                       if name in self.__columns]
+        if 0 < len(indices) < len(coordnames):
+            # only parse the point numbers and the requested columns
+            data = _parsecolumns(datalist, [1] + [i+4 for i in indices],
+                                 ncolumns)
+            points = data[0]
+            coordarray = data[1:]
+            self.__rest = [datalist, coordnames, None]
+            coordnames = [coordnames[i] for i in indices]
+        else:
+            data = AUTOatofs(datalist.text(), nrows * ncolumns)
+            data.shape = (-1,ncolumns)
+            coordarray = N.transpose(data[:,4:]).copy()
+            points = data[:,1]
         if hasattr(N,"concatenate"):
             stability = self.__parsenumpy(points)
         else:
@@ -352,18 +489,77 @@ class AUTOBranch(parseBMixin, Points.Pointset):
             else:
                 stab = "U"
             self.labels.update(abs(i)-1, branchtype, {"stab": stab})
-        # sometimes the columns names are the same: add spaces to those
-        for i in range(len(self.coordnames)):
-            name = self.coordnames[i]
-            if self.coordnames.count(name) > 1:
-                for j in range(i+1,len(self.coordnames)):
-                    if self.coordnames[j] == name:
-                        self.coordnames[j] = name + ' '
         Points.Pointset.__init__(self,{
             "coordarray": coordarray,
-            "coordnames": self.coordnames,
+            "coordnames": coordnames,
             "labels": self.labels,
             })
+        if self.__rest is not None:
+            self.__rest[2] = self.coordarray
+
+    def __loadcolumns(self,names=None):
+        # parse the columns in names (default: all) that were left out
+        rest = self.__rest
+        if rest is None:
+            return
+        source, allnames, coordarray = rest
+        if self.coordarray is not coordarray:
+            # points were added or removed: the other columns do not fit
+            self.__rest = None
+            return
+        if names is None:
+            names = allnames
+        new = [name for name in allnames
+               if name in names and name not in self.coordnames]
+        if new == []:
+            return
+        N = Points.N
+        if isinstance(source, BDLines):
+            data = _parsecolumns(source, [allnames.index(name) + 4
+                                          for name in new],
+                                 len(allnames) + 4)
+        else:
+            data = [source[allnames.index(name)] for name in new]
+        rows = dict(zip(self.coordnames, self.coordarray))
+        rows.update(zip(new, data))
+        coordnames = [name for name in allnames if name in rows]
+        Points.Pointset.__init__(self,{
+            "coordarray": N.array([rows[name] for name in coordnames]),
+            "coordnames": coordnames,
+            "labels": self.labels,
+            })
+        if len(coordnames) == len(allnames):
+            self.__rest = None
+        else:
+            self.__rest = [source, allnames, self.coordarray]
+
+    def project(self,columns):
+        """Return a copy of the branch with only the given columns.
+        If the branch was not parsed yet, only those columns are parsed.
+        The other columns are parsed or copied when they are first
+        accessed by name."""
+        new = self.__class__(self)
+        if not self.__fullyParsed:
+            new.__columns = list(columns)
+            return new
+        self.__loadcolumns(columns)
+        coordnames = [name for name in self.coordnames if name in columns]
+        if coordnames == []:
+            return new
+        if not Points.numpyimported:
+            Points.importnumpy()
+        N = Points.N
+        if self.__rest is None:
+            new.__rest = [self.coordarray, self.coordnames[:], None]
+        else:
+            new.__rest = self.__rest[:]
+        Points.Pointset.__init__(new,{
+            "coordarray": N.array([self[name] for name in coordnames]),
+            "coordnames": coordnames,
+            "labels": self.labels,
+            })
+        new.__rest[2] = new.coordarray
+        return new
 
     def __parsenumpy(self,points):
         global N
@@ -514,12 +710,9 @@ class AUTOBranch(parseBMixin, Points.Pointset):
             if not label[2].isdigit():
                 j = 3
             number = int(label[j:])
-            i = 0
-            for k,v in self.labels.sortByIndex():
-                if label[:j] in v:
-                    i  = i + 1
-                    if i == number:
-                        return self.getIndex(k)
+            indices = self.labels.getIndices(label[:j])
+            if 0 < number <= len(indices):
+                return self.getIndex(indices[number-1])
             raise KeyError("Label %s not found"%label)
         if not AUTOutil.isiterable(label):
             label = [label]
@@ -549,6 +742,18 @@ class AUTOBranch(parseBMixin, Points.Pointset):
     def getIndex(self,index):
         """Return a parseB style line item; if given a string, return the
         relevant column"""
+        names = index
+        if isinstance(index,tuple) and len(index)==2:
+            names = index[1]
+        if isinstance(names,str):
+            names = [names]
+        if (not self.__fullyParsed and self.__columns is not None and
+            isinstance(names, list) and
+            [name for name in names if name not in self.__columns]):
+            # a column that project() left out
+            self.__parse()
+        if self.__rest is not None and isinstance(names, list):
+            self.__loadcolumns(names)
         if isinstance(index,tuple) and len(index)==2 and not self.__fullyParsed:
             # retrieve data without parsing everything else
             i, j = index
@@ -620,7 +825,7 @@ class AUTOBranch(parseBMixin, Points.Pointset):
                 labels["No Label"] = label
         return BDPoint({'coordarray': coordarray,
                         'coordnames': coordnames,
-                        'labels': labels},self,index)
+                        'labels': labels},self,index,pt)
 
     def getLabels(self):
         """Get all the labels from the solution"""
@@ -639,9 +844,11 @@ class AUTOBranch(parseBMixin, Points.Pointset):
         stab = []
         prevpt = 0
         branchtype = type_translation(self.TY)["short name"]
-        for idx,val in self.labels.sortByIndex():
-            if branchtype in val and "stab" in val[branchtype]:
-                if val[branchtype]["stab"] == "U":
+        labels = self.labels[branchtype]
+        for idx in self.labels.getIndices(branchtype):
+            val = labels[idx]
+            if "stab" in val:
+                if val["stab"] == "U":
                     pt = idx+1
                 else:
                     pt = -idx-1
@@ -652,11 +859,17 @@ class AUTOBranch(parseBMixin, Points.Pointset):
                 prevpt = pt
         return stab
 
-    def subtract(self,other,ref,pt=None):
+    def subtract(self,other,ref,pt=None,piecewise=False):
         """Subtracts branch branches using interpolation with respect to other
         with monotonically increasing or decreasing reference coordinate ref,
-        and starting point pt"""
-        global N
+        and starting point pt.
+
+        other can also be a list of reference branches; pt is then the
+        starting point in the first one. Only the first monotonic part of
+        each reference branch is used, or all parts from the starting
+        point on if piecewise is True. Every point is interpolated in the
+        first part that contains its reference coordinate, or else
+        extrapolated from the nearest part."""
         if not Points.numpyimported:
             Points.importnumpy()
         N = Points.N
@@ -666,57 +879,104 @@ class AUTOBranch(parseBMixin, Points.Pointset):
             index = abs(pt) - 1
         else:
             index = pt["index"]
-        coordarray = N.array(self.coordarray)
-        if not isinstance(other,Points.Pointset):
-            other = other[0]
-        b0 = other[ref]
-        if b0[index] > b0[index+1]:
-            # decreasing array: take first part until it increases
-            k = index+1
-            while k < len(b0) and b0[k] <= b0[k-1]:
-                k = k + 1
-            b0 = b0[:k]
+        if isinstance(other,list):
+            references = other
+        elif isinstance(other,Points.Pointset):
+            references = [other]
         else:
-            k = index+1
-            while k < len(b0) and b0[k] >= b0[k-1]:
-                k = k + 1
-            b0 = b0[:k]
+            references = [other[0]]
         r = 0
-        for i in range(len(other.coordnames)):
-            if other.coordnames[i] == ref:
+        for i in range(len(references[0].coordnames)):
+            if references[0].coordnames[i] == ref:
                 r = i
+        # (reference branch, its reference coordinate, start, end, decreasing)
+        parts = []
+        for branch in references:
+            b0 = branch[ref]
+            for start, end, decreasing in _monotoneparts(b0, index, piecewise):
+                parts.append((branch, b0, start, end, decreasing))
+            index = 0
+        if parts == []:
+            raise AUTOExceptions.AUTORuntimeError(
+                "The reference branch needs at least two points")
+        coordarray = N.array(self.coordarray)
         a0 = self.coordarray[r]
-        k = index+1
-        for j in range(len(a0)):
-            if b0[index+1] > b0[index]:
-                #find k so that b0[k-1] < a0[j] <= b0[k]
-                if a0[j] > b0[k]:
-                    while k < len(b0)-1 and a0[j] > b0[k]:
-                        k = k + 1
-                elif b0[k-1] >= a0[j]:
-                    while k > index+1 and b0[k-1] >= a0[j]:
-                        k = k - 1
-            else:
-                #find k so that b0[k-1] > a0[j] >= b0[k]
-                if a0[j] < b0[k]:
-                    while k < len(b0)-1 and a0[j] < b0[k]:
-                        k = k + 1
-                elif b0[k-1] <= a0[j]:
-                    while k > index+1 and b0[k-1] <= a0[j]:
-                        k = k - 1
-            #do extrapolation if past the boundaries...
-            for i in range(len(self.coordnames)):
-                if i == r or i >= len(other.coordarray):
-                    continue
-                a = coordarray[i]
-                b = other.coordarray[i]
-                a[j]=a[j]-b[k-1]-(a0[j]-b0[k-1])*(b[k]-b[k-1])/(b0[k]-b0[k-1])
+        if hasattr(N, "searchsorted"):
+            self.__subtractnumpy(coordarray, a0, r, parts)
+        else:
+            self.__subtractarray(coordarray, a0, r, parts)
         new = self.__class__(self)
         Points.Pointset.__init__(new, coordarray = coordarray,
                                  coordnames = self.coordnames,
                                  labels = self.labels)
         return new
 
+    def __subtractnumpy(self,coordarray,a0,r,parts):
+        N = Points.N
+        # the part for each point: the first part that contains it or else
+        # the nearest one
+        choice = N.zeros(len(a0), int)
+        if len(parts) > 1:
+            distances = []
+            for branch, b0, start, end, decreasing in parts:
+                lo = min(b0[start], b0[end-1])
+                hi = max(b0[start], b0[end-1])
+                distances.append(N.maximum(N.maximum(lo - a0, a0 - hi), 0))
+            choice = N.argmin(distances, axis=0)
+        for p, (branch, b0, start, end, decreasing) in enumerate(parts):
+            js = N.flatnonzero(choice == p)
+            if len(js) == 0:
+                continue
+            b0 = b0[start:end]
+            a = a0[js]
+            # find k so that b0[k-1] < a <= b0[k] (increasing), or
+            # b0[k-1] > a >= b0[k] (decreasing), for all points at once
+            if decreasing:
+                k = N.searchsorted(-b0, -a)
+            else:
+                k = N.searchsorted(b0, a)
+            #do extrapolation if past the boundaries...
+            k = N.clip(k, 1, len(b0)-1)
+            rows = [i for i in range(min(len(self.coordnames),
+                                         len(branch.coordarray))) if i != r]
+            b = branch.coordarray[rows, start:end]
+            ix = N.ix_(rows, js)
+            coordarray[ix] = (coordarray[ix] - b[:,k-1] -
+                              (a-b0[k-1])*(b[:,k]-b[:,k-1])/(b0[k]-b0[k-1]))
+
+    def __subtractarray(self,coordarray,a0,r,parts):
+        # for those without numpy...
+        bounds = []
+        for branch, b0, start, end, decreasing in parts:
+            b0 = list(b0[start:end])
+            if decreasing:
+                bounds.append([-v for v in b0])
+            else:
+                bounds.append(b0)
+        for j in range(len(a0)):
+            # the first part that contains a0[j] or else the nearest one
+            best = None
+            for p, (branch, b0, start, end, decreasing) in enumerate(parts):
+                lo = min(b0[start], b0[end-1])
+                hi = max(b0[start], b0[end-1])
+                distance = max(lo - a0[j], a0[j] - hi, 0)
+                if best is None or distance < best[0]:
+                    best = distance, p
+            branch, b0, start, end, decreasing = parts[best[1]]
+            bound = bounds[best[1]]
+            if decreasing:
+                k = bisect.bisect_left(bound, -a0[j])
+            else:
+                k = bisect.bisect_left(bound, a0[j])
+            k = min(max(k, 1), len(bound)-1)
+            for i in range(len(self.coordnames)):
+                if i == r or i >= len(branch.coordarray):
+                    continue
+                a = coordarray[i]
+                b = branch.coordarray[i]
+                a[j]=(a[j]-b[start+k-1]-(a0[j]-b0[start+k-1])*
+                      (b[start+k]-b[start+k-1])/(b0[start+k]-b0[start+k-1]))
+
     def toArray(self):
         return list(map(list,zip(*self.coordarray)))
 
@@ -727,8 +987,10 @@ class AUTOBranch(parseBMixin, Points.Pointset):
     def write(self, output, columnlen=19):
         if columnlen == 19 and not self.__fullyParsed:
             output.writelines(self.headerlist)
-            output.writelines(self.__datalist)
+            output.write(self.__datalist.text())
             return
+        self.__parse()
+        self.__loadcolumns()
         format = "%"+str(-columnlen)+"s"
         if self.headerlist != []:
             for l in self.headerlist:
@@ -745,6 +1007,18 @@ class AUTOBranch(parseBMixin, Points.Pointset):
         istab = 0
         format = "%"+str(columnlen)+"."+str(columnlen-9)+"E"
         stability = self.stability()
+        if columnlen == 19:
+            # format all numbers at once; the row of point i is then
+            # fields[i*width:(i+1)*width]
+            if Points.fromstring is not None:
+                fields = format19_10E3s(Points.N.transpose(data))
+            else:
+                values = []
+                for row in zip(*data.tolist()):
+                    values.extend(row)
+                fields = format19_10E3s(values)
+            width = 19*len(data)
+            lines = []
         for i in range(len(data[0])):
             pt = i+1
             if stability[istab] < 0:
@@ -765,12 +1039,13 @@ class AUTOBranch(parseBMixin, Points.Pointset):
                 pt = ((pt-1) % 9999) + 1
             output_line = "%4d%6d%4d%5d"%(br,pt,tynumber,lab)
             if columnlen == 19:
-                for j in range(len(data)):
-                    output_line = output_line + format19_10E3(data[j,i])
-            else:
-                for j in range(len(data)):
-                    output_line = output_line + format%data[j,i]
+                lines.extend([output_line, fields[i*width:(i+1)*width], "\n"])
+                continue
+            for j in range(len(data)):
+                output_line = output_line + format%data[j,i]
             output.write(output_line+"\n")
+        if columnlen == 19:
+            output.write("".join(lines))
 
     def writeShort(self):
         self.write(sys.stdout, columnlen=14)
@@ -778,6 +1053,7 @@ class AUTOBranch(parseBMixin, Points.Pointset):
     def summary(self):
         slist = []
         if self.__fullyParsed:
+            self.__loadcolumns()
             data = self.coordarray
         first = True
         for index,l in self.labels.sortByIndex():
@@ -878,11 +1154,11 @@ class AUTOBranch(parseBMixin, Points.Pointset):
                     self._lastline = line
                     break
                 headerlist.append(line)
-        datalist = []
+        datalist = BDLines()
         labels = {}
         if columns[0] != '0':
             self._lastline = None
-            datalist = [line]
+            datalist.append(line)
             if columns[2][0] != '0': #type
                 columns = split(line,None,4)
                 pt = int(columns[1])
@@ -1106,62 +1382,45 @@ class parseBR(parseBMixin, UserList):
 
     # Merges branches
     def merge(self):
-        fw = None
+        """Merge pairs of branches that have the same branch number and
+        starting point, and that go in opposite directions, into single
+        branches. The pairs do not need to be adjacent: the branches are
+        looked up by their starting point, and each one is merged with
+        the nearest earlier branch that fits."""
         data = []
+        # indices in data of the unmerged branches, by starting point
+        pending = {}
         for bw in self.data:
-            data.append(bw)
-            if fw is None or fw.BR != bw.BR or (fw.c is not bw.c and
-                                      fw.c["DS"] * bw.c["DS"] > 0):
-                fw = bw
-                continue
-            f0 = fw[0]
-            b0 = bw[0]
-            if len(f0) != len(b0):
-                fw = bw
+            if len(bw) == 0:
+                # nothing to merge, for instance the empty branch of a
+                # diagram with only solutions
+                data.append(bw)
                 continue
-            cont = False
-            for i in range(len(f0)):
-                if f0[i] != b0[i]:
-                    fw = bw
-                    cont = True
+            key = _startkey(bw)
+            candidates = pending.setdefault(key, [])
+            for j in range(len(candidates)-1, -1, -1):
+                fw = data[candidates[j]]
+                if fw.c is bw.c or fw.c["DS"] * bw.c["DS"] <= 0:
                     break
-            if cont:
+            else:
+                candidates.append(len(data))
+                data.append(bw)
                 continue
-            #now we know that the branches have the same starting point:
-            #merge them
-            new = bw[::-1]
-            new.extend(fw[1:])
-            new.c = fw.c
-            new.headerlist = fw.headerlist
-            data[-1] = new
-
-            # adjust label numbers
-            lab = min(fw.getLabels()+bw.getLabels())
-            for idx,val in new.labels.sortByIndex():
-                for k,v in val.items():
-                    if v.get("LAB",0) > 0:
-                        val[k] = v.copy()
-                        val[k]["LAB"] = lab
-                        lab = lab+1
-
-            if hasattr(fw,"diagnostics"):
-                if hasattr(bw,"diagnostics"):
-                    new.diagnostics = fw.diagnostics + bw.diagnostics
-                else:
-                    new.diagnostics = fw.diagnostics
-
-            del data[-2]
-            #reset for further search
-            fw = None
+            data[candidates.pop(j)] = _mergebranches(fw, bw)
         return self.__class__(data)
 
-    def subtract(self,other,ref,pt=None):
+    def project(self,columns):
+        """Return a copy with only the given columns in all branches; see
+        AUTOBranch.project"""
+        return self.__class__([d.project(columns) for d in self.data])
+
+    def subtract(self,other,ref,pt=None,piecewise=False):
         """Subtracts branch branches using interpolation with respect to other
         with monotonically increasing or decreasing reference coordinate ref,
-        and starting point pt"""
+        and starting point pt; see AUTOBranch.subtract"""
         new = []
         for d in self.data:
-            new.append(d.subtract(other,ref,pt))
+            new.append(d.subtract(other,ref,pt,piecewise))
         return self.__class__(new)
 
     def toArray(self):
@@ -1253,6 +1512,335 @@ class parseB(parseBMixin):
     def __repr__(self):
         return self.branches.__repr__()
 
+class followB(object):
+    """Follow a fort.7 file that is still being written.
+
+    Every call of read() parses only the complete lines that were added
+    since the previous call, starting from the last byte offset, and
+    returns the new points as a list of BDPoints.
+    """
+    def __init__(self,filename):
+        self.name = filename
+        self.offset = 0
+        # the most recent branch header, for sections that continue
+        # in a later read()
+        self.header = []
+        self.inheader = False
+
+    def read(self):
+        try:
+            inputfile = open(self.name,"rb")
+        except IOError:
+            # not created yet
+            return []
+        try:
+            if os.fstat(inputfile.fileno()).st_size < self.offset:
+                # the file was truncated: start again
+                self.__init__(self.name)
+            inputfile.seek(self.offset)
+            data = inputfile.read()
+        finally:
+            inputfile.close()
+        # only use complete lines
+        end = data.rfind("\n".encode("ascii")) + 1
+        if end == 0:
+            return []
+        self.offset += end
+        data = data[:end]
+        if not isinstance(data, str):
+            data = data.decode("ascii")
+        # skip blank lines
+        lines = [line for line in data.splitlines(True) if line.strip()]
+        if lines == []:
+            return []
+        if lines[0].split(None,1)[0] != '0':
+            lines = self.header + lines
+        # keep track of the last header, and strip trailing header lines
+        # since their data is still to come
+        last = 0
+        for i, line in enumerate(lines):
+            if line.split(None,1)[0] == '0':
+                if not self.inheader:
+                    self.header = []
+                    self.inheader = True
+                self.header.append(line)
+            else:
+                self.inheader = False
+                last = i + 1
+        points = []
+        if last == 0:
+            return points
+        branches = parseBR()
+        branches.read(iter(lines[:last]))
+        for branch in branches:
+            for i in range(len(branch)):
+                points.append(branch.getIndex(i))
+        return points
+
+def _monotoneparts(b0, index, piecewise=False):
+    # (start, end, decreasing) for the first monotonically increasing or
+    # decreasing part of the values in b0 from index on, or for all parts
+    N = Points.N
+    parts = []
+    if hasattr(N, "searchsorted"):
+        # where the values go up and where they go down
+        diff = b0[1:] - b0[:-1]
+        ups = N.flatnonzero(diff > 0) + 1
+        downs = N.flatnonzero(diff < 0) + 1
+    while index + 1 < len(b0):
+        decreasing = b0[index] > b0[index+1]
+        if hasattr(N, "searchsorted"):
+            if decreasing:
+                stops = ups
+            else:
+                stops = downs
+            i = N.searchsorted(stops, index+1)
+            if i < len(stops):
+                k = int(stops[i])
+            else:
+                k = len(b0)
+        else:
+            k = index+1
+            if decreasing:
+                while k < len(b0) and b0[k] <= b0[k-1]:
+                    k = k + 1
+            else:
+                while k < len(b0) and b0[k] >= b0[k-1]:
+                    k = k + 1
+        parts.append((index, k, decreasing))
+        if not piecewise:
+            break
+        # the next part starts where this one turns around
+        index = k-1
+    return parts
+
+def _startkey(branch):
+    # the branch number and the starting point of a branch, rounded to 10
+    # significant digits (adding 0.0 turns -0.0 into 0.0)
+    return (branch["BR"],
+            tuple(["%.9E"%(v+0.0) for v in branch[0].coordarray]))
+
+def _stabmarks(branch):
+    # the stability of all points of the branch, as a string of S and U
+    marks = []
+    prev = 0
+    for p in branch.stability():
+        if p < 0:
+            marks.append((abs(p)-prev)*"S")
+        else:
+            marks.append((abs(p)-prev)*"U")
+        prev = abs(p)
+    return "".join(marks)
+
+def _mergebranches(fw, bw):
+    # the branch that goes backwards along bw and then forwards along fw
+    if not Points.numpyimported:
+        Points.importnumpy()
+    N = Points.N
+    if hasattr(N, "concatenate") and fw.coordnames == bw.coordnames:
+        # copy all points at once, and map the labels of both branches
+        nb = len(bw)
+        stability = _stabmarks(bw)[::-1] + _stabmarks(fw)[1:]
+        labels = {}
+        for idx, val in bw.labels.sortByIndex():
+            labels[nb-1-idx] = val
+        for idx, val in fw.labels.sortByIndex():
+            if idx > 0:
+                labels[nb-1+idx] = val
+        branchtype = type_translation(fw.TY)["short name"]
+        for idx, val in labels.items():
+            val = dict(val)
+            if "stab" in val.get(branchtype, {}):
+                val[branchtype] = val[branchtype].copy()
+                del val[branchtype]["stab"]
+                if val[branchtype] == {}:
+                    del val[branchtype]
+            labels[idx] = val
+        for m in re.finditer("S+|U+", stability):
+            val = labels.setdefault(m.end()-1, {})
+            val[branchtype] = dict(val.get(branchtype, {}))
+            val[branchtype]["stab"] = m.group()[0]
+        for idx in [idx for idx, val in labels.items() if val == {}]:
+            del labels[idx]
+        new = fw.__class__(fw)
+        Points.Pointset.__init__(new, {
+            "coordarray": N.concatenate((bw.coordarray[:,::-1],
+                                         fw.coordarray[:,1:]), 1),
+            "coordnames": fw.coordnames,
+            "labels": Points.PointInfo(labels),
+            })
+    else:
+        new = bw[::-1]
+        new.extend(fw[1:], copyArg=False)
+        new.c = fw.c
+        new.headerlist = fw.headerlist
+
+    # adjust label numbers
+    labels = fw.getLabels()+bw.getLabels()
+    if labels != []:
+        lab = min(labels)
+        for idx,val in new.labels.sortByIndex():
+            for k,v in val.items():
+                if v.get("LAB",0) > 0:
+                    val[k] = v.copy()
+                    val[k]["LAB"] = lab
+                    lab = lab+1
+
+    if hasattr(fw,"diagnostics"):
+        if hasattr(bw,"diagnostics"):
+            new.diagnostics = fw.diagnostics + bw.diagnostics
+        else:
+            new.diagnostics = fw.diagnostics
+    elif hasattr(bw,"diagnostics"):
+        new.diagnostics = bw.diagnostics
+    return new
+
+def _parsecolumns(datalist, fields, ncolumns):
+    """Parse only the given fields of all lines of an unparsed branch,
+    with ncolumns fields per line, and return them as an array with a
+    row for every field."""
+    if not Points.numpyimported:
+        Points.importnumpy()
+    nrows = len(datalist)
+    text = datalist.text()
+    if Points.fromstring:
+        data = _parsefixedwidth(text, fields, ncolumns, nrows)
+        if data is not None:
+            return data
+    columns = [[] for field in fields]
+    for line in text.splitlines():
+        sp = line.split()
+        for column, field in zip(columns, fields):
+            column.append(sp[field])
+    values = []
+    for column in columns:
+        values.extend(column)
+    data = AUTOatofs(" ".join(values), len(values))
+    data.shape = (len(fields), nrows)
+    return data
+
+def _parsefixedwidth(text, fields, ncolumns, nrows):
+    # AUTO writes b-files with I4,I6,I4,I5 followed by columns of the same
+    # width: cut the fields out of the text as a 2D array of characters
+    N = Points.N
+    if not isinstance(text, bytes):
+        text = text.encode("ascii")
+    newline = "\n".encode("ascii")
+    if not text.endswith(newline):
+        text = text + newline
+    linelen = len(text) // nrows
+    if (ncolumns <= 4 or len(text) != linelen * nrows or
+        text.count(newline) != nrows or (linelen - 20) % (ncolumns - 4) != 0):
+        return None
+    width = (linelen - 20) // (ncolumns - 4)
+    lines = N.frombuffer(text, N.uint8).reshape(nrows, linelen)
+    if not (lines[:,-1] == ord("\n")).all():
+        return None
+    starts = [0, 4, 10, 14, 19]
+    starts.extend(range(19 + width, linelen, width))
+    size = max(width, 6) + 1
+    buf = N.empty((len(fields), nrows, size), N.uint8)
+    buf.fill(ord(" "))
+    for row, field in zip(buf, fields):
+        start, end = starts[field], starts[field+1]
+        row[:,:end-start] = lines[:,start:end]
+    count = len(fields) * nrows
+    data = AUTOatofs(buf.tobytes(), count)
+    if len(data) != count:
+        return None
+    data.shape = (len(fields), nrows)
+    return data
+
+# Fortran-style numbers fixed up by AUTOatofs: a truncated exponent as in
+# x.xxxxxxxE, D exponents, and a missing E as in x.xxxxxxxxx-yyy
+try:
+    _fortran_DE = bytes.maketrans("Dd".encode("ascii"), "Ee".encode("ascii"))
+except AttributeError: # Python < 3
+    import string
+    _fortran_DE = string.maketrans("Dd", "Ee")
+_fortran_truncated_E = re.compile(r"(?<=[0-9.])E(?=\s|$)")
+_fortran_missing_E = re.compile(r"(?<=[0-9.])(?=[-+][0-9])")
+
+def _fortran_fixup(data):
+    # without numpy: fix up the string using regular expressions
+    data = _fortran_truncated_E.sub("", data)
+    data = data.replace("D", "E").replace("d", "e")
+    return _fortran_missing_E.sub("E", data)
+
+def _fortran_fixup_numpy(data):
+    # with numpy: fix up the bytes in data all at once using masks
+    N = Points.N
+    if not isinstance(data, bytes):
+        data = data.encode("ascii")
+    fixed = data.translate(_fortran_DE)
+    a = N.frombuffer(data, N.uint8)
+    b = N.frombuffer(fixed, N.uint8)
+    if len(b) < 2:
+        return fixed
+    E, dot, zero, nine = [ord(c) for c in "E.09"]
+    isnum = (b >= zero) & (b <= nine)
+    # digits or dot before a truncated E or a sign
+    before = N.empty(len(b), bool)
+    before[0] = False
+    before[1:] = isnum[:-1] | (b[:-1] == dot)
+    # whitespace or end of data after a truncated E
+    after = N.empty(len(b), bool)
+    after[-1] = True
+    after[:-1] = b[1:] <= ord(" ")
+    truncated = (a == E) & before & after
+    after[-1] = False
+    after[:-1] = isnum[1:]
+    missing = ((b == ord("-")) | (b == ord("+"))) & before & after
+    if not truncated.any() and not missing.any():
+        return fixed
+    # drop truncated E's and write each sign without E twice, the first
+    # copy of which then becomes the E
+    counts = N.ones(len(b), N.intp)
+    counts[truncated] = 0
+    counts[missing] = 2
+    out = N.repeat(b, counts)
+    out[(N.cumsum(counts) - 2)[missing]] = E
+    return out.tobytes()
+
+def AUTOatofs(data, count=None):
+    """Convert a buffer of whitespace separated numbers, as written by
+    AUTO, to an array of floats. Each number is interpreted as AUTOatof
+    would, but malformed exponents are fixed up for the whole buffer at
+    once and the conversion is done in a single call where possible."""
+    if not Points.numpyimported:
+        Points.importnumpy()
+    N = Points.N
+    fdata = None
+    if Points.fromstring:
+        fixed = _fortran_fixup_numpy(data)
+        with warnings.catch_warnings():
+            # numpy warns when it cannot read up to the end
+            warnings.simplefilter("ignore")
+            try:
+                fdata = Points.fromstring(fixed, dtype=float, sep=' ')
+            except ValueError:
+                fdata = None
+        if count is None:
+            count = len(fixed.split())
+        if fdata is not None and len(fdata) != count:
+            fdata = None
+    else:
+        try:
+            fdata = N.array(list(map(float, data.split())), 'd')
+        except ValueError:
+            if not isinstance(data, str):
+                data = data.decode("ascii")
+            try:
+                fdata = N.array(list(map(float,
+                                         _fortran_fixup(data).split())), 'd')
+            except ValueError:
+                pass
+    if fdata is None:
+        # something that is not a Fortran-style number: go through
+        # AUTOatof token by token
+        fdata = N.array(list(map(AUTOatof, data.split())), 'd')
+    return fdata
+
 def AUTOatof(input_string):
     #Sometimes AUTO messes up the output.  I.e. it gives an
     #invalid floating point number of the form x.xxxxxxxE
@@ -1315,6 +1903,23 @@ def pointtest(a,b):
         raise AUTOExceptions.AUTORegressionError("Data sections have different lengths")
 
 def test():
+    # this comes first, so that nothing was parsed from a b-file yet
+    print("Testing subtracting branches built from arrays")
+    x = [0.1*i for i in range(10)]
+    ref = AUTOBranch()
+    Points.Pointset.__init__(ref, coordarray=[x, [2*v for v in x]],
+                             coordnames=["PAR(1)", "L2-NORM"])
+    branch = AUTOBranch()
+    Points.Pointset.__init__(branch, coordarray=[[v+0.05 for v in x],
+                                                 [2*v+1.1 for v in x]],
+                             coordnames=["PAR(1)", "L2-NORM"])
+    for d in branch.subtract(ref, "PAR(1)").toArray():
+        if abs(d[1] - 1) > 1e-10:
+            raise AUTOExceptions.AUTORegressionError(
+                "Error in subtracting branches")
+    if ref.project(["L2-NORM"])["L2-NORM"][3] != ref["L2-NORM"][3]:
+        raise AUTOExceptions.AUTORegressionError("Error in projecting branches")
+
     print("Testing reading from a filename")
     foo = parseB()
     foo.readFilename("test_data/fort.7")    
@@ -1330,6 +1935,53 @@ def test():
         raise AUTOExceptions.AUTORegressionError("File length incorrect")
     pointtest(foo.getIndex(0),foo.getIndex(57))
 
+    print("Testing column projection")
+    full = parseBR("test_data/fort.7")[0]
+    names = full.coordnames[:]
+    branch = parseBR("test_data/fort.7").project([names[2]])[0]
+    if (list(branch[names[2]]) != list(full[names[2]]) or
+        branch.coordnames != [names[2]] or
+        list(branch[names[0]]) != list(full[names[0]]) or
+        branch.coordnames != [names[0], names[2]] or
+        branch.summary() != full.summary()):
+        raise AUTOExceptions.AUTORegressionError("Error in column projection")
+
+    print("Testing pickling")
+    import pickle
+    branch = pickle.loads(pickle.dumps(parseBR("test_data/fort.7")[0]))
+    if (list(branch[names[2]]) != list(full[names[2]]) or
+        branch.stability() != full.stability()):
+        raise AUTOExceptions.AUTORegressionError("Error in pickling")
+
+    print("Testing unparsed branch lines")
+    lines = ["line %d\n"%i for i in range(20)]
+    BDLines.chunk, chunk = 5, BDLines.chunk
+    try:
+        store = BDLines(lines)
+    finally:
+        BDLines.chunk = chunk
+    store[3] = "changed\n"
+    store[-1] = "last\n"
+    lines[3] = "changed\n"
+    copy = store[:]
+    lines[-1] = store.pop()
+    if (list(store) != lines[:-1] or store.text() != "".join(lines[:-1]) or
+        copy.text() != "".join(lines) or store[12] != "line 12\n"):
+        raise AUTOExceptions.AUTORegressionError("Error in branch lines")
+
+    print("Testing Fortran-style number conversion")
+    numbers = ("0.1234567E+01 -0.1234567E-01 1.23456789-105 -2.05071-106 "
+               "0.0000000E 1.E 5.0D+00 -5.0d-01 1.5D3 1.0E+00 -1.0 7 1.0+5+3 "
+               "0.5-1\n 12345-1234 1.0D -3.5e").split()
+    for text in [" ".join(numbers), " ".join(numbers).encode("ascii")]:
+        data = AUTOatofs(text)
+        if list(data) != [AUTOatof(d) for d in numbers]:
+            raise AUTOExceptions.AUTORegressionError(
+                "Error in Fortran-style number conversion")
+    data = AUTOatofs(" ".join(numbers[:12]))
+    if list(data) != [AUTOatof(d) for d in numbers[:12]]:
+        raise AUTOExceptions.AUTORegressionError(
+            "Error in Fortran-style number conversion")
 
     print("Testing label manipulation")
     labels = foo.getLabels()
@@ -1347,6 +1999,88 @@ def test():
     new_labels = bar.getLabels()
     if old_labels[0] != 57 or new_labels[0] != 1:
         raise AUTOExceptions.AUTORegressionError("Error in relabelling")
+    print("Testing following a growing file")
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    try:
+        name = os.path.join(tmpdir, "fort.7")
+        data = open("test_data/fort.7","rb").read()
+        follow = followB(name)
+        points = follow.read()
+        output = open(name,"wb")
+        for i in range(0, len(data), 1000):
+            output.write(data[i:i+1000])
+            output.flush()
+            points.extend(follow.read())
+        output.close()
+        foo = parseB()
+        foo.readFilename("test_data/fort.7")
+        if len(points) != len(foo):
+            raise AUTOExceptions.AUTORegressionError("Number of points incorrect")
+        for i in [0, 57, len(foo)-1]:
+            pointtest(points[i],foo.getIndex(i))
+            if (points[i]["PT"] != foo.getIndex(i)["PT"] or
+                points[i]["LAB"] != foo.getIndex(i)["LAB"]):
+                raise AUTOExceptions.AUTORegressionError("Point incorrect")
+        # blank lines, also on their own, are skipped
+        lines = data.splitlines(True)
+        blank = "   \n".encode("ascii")
+        follow = followB(name)
+        output = open(name,"wb")
+        output.write(blank)
+        output.flush()
+        points = follow.read()
+        output.write("".encode("ascii").join(lines[:20] + [blank] +
+                                             lines[20:]))
+        output.close()
+        points.extend(follow.read())
+        if len(points) != len(foo):
+            raise AUTOExceptions.AUTORegressionError("Number of points incorrect")
+        pointtest(points[-1],foo.getIndex(len(foo)-1))
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Testing merging branches")
+    fw = parseBR("test_data/fort.7")[0]
+    bw = fw[:20]
+    other = fw[10:]
+    other.BR = 5
+    merged = parseBR([fw, other, bw]).merge()
+    if (len(merged) != 2 or len(merged[0]) != 169 or
+        merged[0][0] != bw[19] or merged[0][-1] != fw[-1] or
+        merged[0].getLabels() != [6, 7, 8, 9, 10] or
+        merged[0].stability() != [-19, 20, -131, 169]):
+        raise AUTOExceptions.AUTORegressionError("Error in merging branches")
+    # an empty branch, as in a diagram with only solutions, stays as it is
+    empty = AUTOBranch()
+    empty.BR = 1
+    empty.coordarray = []
+    empty.coordnames = []
+    empty.c = fw.c
+    kept = parseBR([empty, fw, bw]).merge()
+    if (len(kept) != 2 or kept[0] is not empty or
+        len(kept[1]) != 169):
+        raise AUTOExceptions.AUTORegressionError("Error in merging branches")
+    print("Testing subtracting branches")
+    def largest(branch):
+        return max([abs(v) for p in branch.toArray() for v in p[1:]])
+    # merged[0] turns around after 20 points
+    if (largest(fw[40:100].subtract(merged[0],"PAR(1)")) < 1e-3 or
+        largest(fw[40:100].subtract(merged[0],"PAR(1)",piecewise=True)) > 1e-10 or
+        largest(fw[:30].subtract([fw[60:],fw[:40]],"PAR(1)")) > 1e-10):
+        raise AUTOExceptions.AUTORegressionError("Error in subtracting branches")
+    # the first points lie beyond both parts, and are extrapolated from the
+    # first two points of the nearest one
+    diff = fw[:5].subtract([fw[40:60],fw[20:30]],"PAR(1)").toArray()
+    a = fw[:5].toArray()
+    b = fw[20:22].toArray()
+    for j in range(len(a)):
+        for i in range(1, len(a[j])):
+            v = a[j][i] - (b[0][i] + (a[j][0]-b[0][0])*
+                           (b[1][i]-b[0][i])/(b[1][0]-b[0][0]))
+            if abs(diff[j][i] - v) > 1e-10:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Error in extrapolating branches")
     print("parseB passed all tests")
 
 if __name__ == '__main__' :
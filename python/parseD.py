@@ -4,119 +4,418 @@
 # NOTE:  This is nowhere near done, and it currently only finds the
 # reduced jacobians and puts them into a list.
 
+import gzip
+import os
 import re
 import sys
 try:
     from UserList import UserList
+    from UserDict import UserDict
 except ImportError: # Python 3
-    from collections import UserList
+    from collections import UserList, UserDict
 import getopt
+import AUTOExceptions
 import AUTOutil
+import Points
 import parseB
 
+# the divider lines between the diagnostics of two continuation steps; the
+# second one is only used if the first one does not occur anywhere
+dividers = ["="*47 + "\n", "-"*92 + "\n"]
+
+# a line starting with BR and the line after it; the same for the header
+# line with the label
+_brline = re.compile("^[ \t]*BR(?:[ \t][^\n]*)?\n([^\n]*)".encode("ascii"),
+                     re.M)
+_labline = re.compile("^[ \t]*BR[ \t]+PT[ \t]+TY[ \t]+LAB(?:[ \t][^\n]*)?\n"
+                      "([^\n]*)".encode("ascii"), re.M)
+# branch, point, index, real and imaginary part
+_eigenvalue = re.compile("^ *(-?[0-9]+) +(-?[0-9]+) +Eigenvalue *([0-9]+): *"
+                         "(\\S+) +(\\S+)".encode("ascii"), re.M)
+_multiplier = re.compile("^ *(-?[0-9]+) +(-?[0-9]+) +Multiplier *([0-9]+) +"
+                         "(\\S+) +(\\S+)".encode("ascii"), re.M)
+
+def _encode(s):
+    if isinstance(s, bytes):
+        return s
+    return s.encode("latin-1")
+
+def _decode(s):
+    if isinstance(s, str):
+        return s
+    return s.decode("latin-1")
+
+def _label(sp):
+    # the label is the third column if there is no type, otherwise the
+    # fourth one
+    if sp[2] != '0':
+        try:
+            return int(sp[2])
+        except ValueError:
+            return int(sp[3])
+    return 0
+
+class fileD(object):
+    """The diagnostics text of a d-file, split into blocks at the divider
+    lines. Only the offsets of the blocks, and the branch, point and
+    label numbers in them, are kept; the text itself is read from disk
+    when it is needed."""
+    # the size of the pieces that are read at once to find the blocks
+    chunksize = 1 << 22
+
+    def __init__(self, filename):
+        if isinstance(filename, str):
+            inputfile = AUTOutil.openFilename(filename,"rb")
+        else:
+            inputfile = filename
+        self.inputfile = inputfile
+        self.name = getattr(inputfile, "name", None)
+        self.buffer = None
+
+        # for fort.9 we need to read everything into memory, since the next
+        # run overwrites it; otherwise read the blocks on demand from disk
+        # on Windows always load everything because deleting open files is
+        # impossible there
+        if (not isinstance(filename, str) or
+            isinstance(inputfile, gzip.GzipFile) or
+            os.path.basename(filename) == 'fort.9' or
+            sys.platform in ['cygwin', 'win32']):
+            self.buffer = _encode(inputfile.read())
+            if isinstance(filename, str):
+                inputfile.close()
+            self.inputfile = None
+            self.__scan([self.buffer])
+        else:
+            self.__scan(self.__chunks())
+
+    def __chunks(self):
+        # pieces of the file that end just after a divider line, so that
+        # no block header is cut in two
+        inputfile = self.inputfile
+        divs = [_encode(div) for div in dividers]
+        rest = _encode("")
+        while True:
+            data = inputfile.read(self.chunksize)
+            if not data:
+                if rest:
+                    yield rest
+                return
+            data = rest + data
+            cut = max([data.rfind(div) + len(div) for div in divs
+                       if data.rfind(div) != -1] or [0])
+            rest = data[cut:]
+            if cut > 0:
+                yield data[:cut]
+
+    def __scan(self, chunks):
+        # go through the file once and remember where the dividers and the
+        # header lines are
+        divs = [_encode(div) for div in dividers]
+        ends = [[], []]
+        brlines = []
+        lablines = []
+        pos = 0
+        for chunk in chunks:
+            for i, div in enumerate(divs):
+                n = chunk.find(div)
+                while n != -1:
+                    ends[i].append(pos + n + len(div))
+                    n = chunk.find(div, n + len(div))
+            for m in _brline.finditer(chunk):
+                sp = m.group(1).split()
+                try:
+                    brlines.append((pos + m.start(),
+                                    int(sp[0]), int(sp[1])))
+                except (ValueError, IndexError):
+                    pass
+            for m in _labline.finditer(chunk):
+                sp = _decode(m.group(1)).split()
+                if len(sp) > 3:
+                    try:
+                        lablines.append((pos + m.start(), _label(sp)))
+                    except ValueError:
+                        pass
+            pos += len(chunk)
+        if len(ends[0]) > 0:
+            ends = ends[0]
+        else:
+            ends = ends[1]
+        starts = [0] + ends
+        ends = ends + [pos]
+        self.blocks = [[start, end, 0, 0, 0]
+                       for start, end in zip(starts, ends)]
+        # the first header lines in every block give its numbers
+        for lines, columns in [(brlines, slice(2, 4)),
+                               (lablines, slice(4, 5))]:
+            i = len(self.blocks)
+            for line in reversed(lines):
+                while i > 0 and starts[i-1] > line[0]:
+                    i = i - 1
+                if i > 0:
+                    self.blocks[i-1][columns] = line[1:]
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def readstr(self, i):
+        start, end = self.blocks[i][:2]
+        if self.buffer is not None:
+            return _decode(self.buffer[start:end])
+        self.inputfile.seek(start)
+        return _decode(self.inputfile.read(end - start))
+
+    def readall(self):
+        # read the whole file into memory, so that it can be overwritten
+        if self.buffer is None:
+            self.inputfile.seek(0)
+            self.buffer = _encode(self.inputfile.read())
+            self.inputfile.close()
+            self.inputfile = None
+
+    def __getstate__(self):
+        # For pickle: read everything, after which the file is not needed
+        self.readall()
+        return self.__dict__
+
+    def close(self):
+        if self.inputfile is not None:
+            self.inputfile.close()
+
+class diagnostics(UserDict):
+    """The diagnostics of one continuation step. The text is only parsed
+    into the "Branch number", "Point number", "Label", "Eigenvalues" and
+    "Multipliers" keys when one of them is accessed."""
+    def __init__(self, text=None, source=None, index=0):
+        # the data dictionary is filled in by __getattr__
+        if isinstance(text, dict):
+            text = text["Text"]
+        self.__text = text
+        self.__source = source
+        self.__index = index
+        if source is not None:
+            self.branch, self.point, self.label = source.blocks[index][2:]
+
+    def __getattr__(self, attr):
+        if attr == "data":
+            self.data = self.__parse(self.getText())
+            return self.data
+        if attr in ["branch", "point", "label"]:
+            self.branch = self["Branch number"]
+            self.point = self["Point number"]
+            self.label = self["Label"]
+            return getattr(self, attr)
+        raise AttributeError(attr)
+
+    def read(self):
+        """Read the text of the file that the diagnostics come from into
+        memory."""
+        if self.__source is not None:
+            self.__source.readall()
+
+    def getText(self):
+        """Return the diagnostics text, without keeping it in memory if it
+        is stored on disk."""
+        if self.__text is None:
+            return self.__source.readstr(self.__index)
+        return self.__text
+
+    def __parse(self, solution):
+        item = {"Text": solution,
+                "Branch number": 0,
+                "Point number": 0,
+                "Label": 0,
+                "Eigenvalues": [],
+                "Multipliers": []}
+        lines = solution.splitlines()
+        if len(lines) < 3:
+            return item
+        i = 0
+        for line in lines:
+            sp = line.split()
+            if len(sp) > 0 and sp[0] == 'BR':
+                break
+            i = i + 1
+        if i + 1 >= len(lines):
+            return item
+        sp = lines[i+1].split()
+        if len(sp) < 2:
+            return item
+        item["Branch number"] = int(sp[0])
+        item["Point number"] = int(sp[1])
+        labline = 0
+        for line in lines:
+            sp = line.split()
+            if labline and len(sp) > 3:
+                item["Label"] = _label(sp)
+                break
+            if sp[0:4] == ['BR', 'PT', 'TY', 'LAB']:
+                labline = 1
+        result = re.findall("Eigenvalue\\s.*",solution)
+        for eigenvalue_string in result:
+            eigenvalue_string = eigenvalue_string.split()
+            real_part = parseB.AUTOatof(eigenvalue_string[2])
+            imag_part = parseB.AUTOatof(eigenvalue_string[3])
+            item["Eigenvalues"].append([real_part,imag_part])
+        result = re.findall("Multiplier\\s.*",solution)
+        for multiplier_string in result:
+            multiplier_string = multiplier_string.split()
+            # "inaccurate" or "accurate"
+            if multiplier_string[1][-1] == "e":
+                continue
+            real_part = parseB.AUTOatof(multiplier_string[2])
+            imag_part = parseB.AUTOatof(multiplier_string[3])
+            item["Multipliers"].append([real_part,imag_part])
+        return item
+
 class parseD(UserList):
     def __init__(self,filename=None):
+        self.__index = None
         if isinstance(filename, str):
             UserList.__init__(self)
             self.readFilename(filename)
         else:
-            UserList.__init__(self,filename)
+            UserList.__init__(self)
+            if filename is not None:
+                self.data = [d if isinstance(d, diagnostics)
+                             else diagnostics(d) for d in filename]
 
     def __getitem__(self,index):
         return self.getIndex(index)
 
+    def __setitem__(self,index,value):
+        self.__index = None
+        UserList.__setitem__(self,index,value)
+
+    def __delitem__(self,index):
+        self.__index = None
+        UserList.__delitem__(self,index)
+
     def __call__(self,label):
         return self.getLabel(label)
 
     def __str__(self):
         s = []
         for d in self.data:
-            s.append(d["Text"])
+            s.append(d.getText())
         return "".join(s)
 
     def getIndex(self,index):
-        self.__readAll()
+        if isinstance(index, slice):
+            return self.__class__(self.data[index])
         return self.data[index]
 
+    def __getindex(self):
+        # (branch, point, label) -> position, and label -> position, for the
+        # first block with those numbers; rebuilt if the list has changed
+        index = self.__index
+        if (index is not None and index[0] is self.data and
+            index[1] == len(self.data)):
+            return index[2], index[3]
+        keys = {}
+        labels = {}
+        for i, d in enumerate(self.data):
+            key = (d.branch, d.point, d.label)
+            if key not in keys:
+                keys[key] = i
+            if d.label not in labels:
+                labels[d.label] = i
+        self.__index = (self.data, len(self.data), keys, labels)
+        return keys, labels
+
     def getLabel(self,label):
-        self.__readAll()
-        for x in self.data:
-            if x["Label"] == label:
-                return x
-
-    def __readAll(self):
-        for item in self.data:
-            solution = item["Text"]
-            item.update({
-                    "Branch number": 0,
-                    "Point number": 0,
-                    "Label": 0,
-                    "Eigenvalues": [],
-                    "Multipliers": []})
-            lines = solution.splitlines()
-            if len(lines) < 3:
-                continue
-            i = 0
-            for line in lines:
-                sp = line.split()
-                if len(sp) > 0 and sp[0] == 'BR':
-                    break
-                i = i + 1
-            if i + 1 >= len(lines):
-                continue
-            sp = lines[i+1].split()
-            if len(sp) < 2:
-                continue
-            item["Branch number"] = int(sp[0])
-            item["Point number"] = int(sp[1])
-            labline = 0
-            for line in lines:
-                sp = line.split()
-                if labline and len(sp) > 3:
-                    if sp[2] != '0':
-                        try:
-                            item["Label"] = int(sp[2])
-                        except:
-                            item["Label"] = int(sp[3])
-                    break
-                if sp[0:4] == ['BR', 'PT', 'TY', 'LAB']:
-                    labline = 1
-            result = re.findall("Eigenvalue\s.*",solution)
-            for eigenvalue_string in result:
-                eigenvalue_string = eigenvalue_string.split()
-                real_part = parseB.AUTOatof(eigenvalue_string[2])
-                imag_part = parseB.AUTOatof(eigenvalue_string[3])
-                item["Eigenvalues"].append([real_part,imag_part])
-            result = re.findall("Multiplier\s.*",solution)
-            for multiplier_string in result:
-                multiplier_string = multiplier_string.split()
-                # "inaccurate" or "accurate"
-                if multiplier_string[1][-1] == "e":
-                    continue
-                real_part = parseB.AUTOatof(multiplier_string[2])
-                imag_part = parseB.AUTOatof(multiplier_string[3])
-                item["Multipliers"].append([real_part,imag_part])
-        
-    def read(self,input):
-        data = input.read()
-        divstr = "===============================================\n"
-        data=data.split(divstr)
-        if len(data) == 1:
-            divstr = "--------------------------------------------------------------------------------------------\n"
-            data=data[0].split(divstr)
-        self.data=[]
-        for solution in data:
-            self.data.append({"Text": solution + divstr})
-        self.data[-1]["Text"] = self.data[-1]["Text"][:-len(divstr)]
+        labels = self.__getindex()[1]
+        if label in labels:
+            return self.data[labels[label]]
+
+    def getKey(self,branch,point,label=0):
+        """Return the diagnostics for the given branch, point and label
+        numbers, or None if there are none."""
+        keys = self.__getindex()[0]
+        if (branch, point, label) in keys:
+            return self.data[keys[branch, point, label]]
+
+    def grep(self,s):
+        """Return the lines of the diagnostics that contain s."""
+        lines = []
+        for d in self.data:
+            text = d.getText()
+            if s in text:
+                lines.extend([line for line in text.splitlines()
+                              if s in line])
+        return lines
+
+    def eigenvalues(self,branch=None):
+        """Return the point numbers and the eigenvalues for all points
+        (or only for branch number branch) as a tuple of two numpy arrays:
+        a 1D integer array and a 2D complex array with a row for every
+        point. Rows with fewer eigenvalues are padded with NaN."""
+        return self.__values(_eigenvalue,branch)
+
+    def multipliers(self,branch=None):
+        """Return the point numbers and the Floquet multipliers for all
+        points (or only for branch number branch) as a tuple of two numpy
+        arrays: a 1D integer array and a 2D complex array with a row for
+        every point. Rows with fewer multipliers are padded with NaN."""
+        return self.__values(_multiplier,branch)
+
+    def __values(self,regex,branch):
+        if not Points.numpyimported:
+            Points.importnumpy()
+        if not Points.fromstring:
+            raise AUTOExceptions.AUTORuntimeError(
+                "Complex eigenvalue arrays require numpy.")
+        N = Points.N
+        # read every block separately so that the whole file is never in
+        # memory, and convert all numbers at once
+        fields = []
+        for d in self.data:
+            fields.extend(regex.findall(_encode(d.getText())))
+        if branch is not None:
+            branch = _encode(str(abs(branch)))
+            fields = [m for m in fields
+                      if m[0].lstrip(_encode("-")) == branch]
+        if not fields:
+            return N.zeros(0, int), N.zeros((0, 0), complex)
+        fields = [x for m in fields for x in m]
+        values = parseB.AUTOatofs(_encode(" ").join(fields),len(fields))
+        values = values.reshape(-1, 5)
+        br = abs(values[:,0]).astype(int)
+        pt = values[:,1].astype(int)
+        idx = N.maximum(values[:,2].astype(int), 1)
+        # a new row starts at a new branch or point, or when the numbering
+        # starts again
+        new = N.ones(len(values), bool)
+        new[1:] = ((br[1:] != br[:-1]) | (pt[1:] != pt[:-1]) |
+                   (idx[1:] <= idx[:-1]))
+        row = N.cumsum(new) - 1
+        result = N.empty((row[-1] + 1, idx.max()), complex)
+        result.fill(complex(N.nan, N.nan))
+        result[row, idx - 1] = values[:,3] + 1j*values[:,4]
+        return pt[new], result
+
+    def read(self,input=None):
+        if input is None:
+            # read everything into memory
+            for d in self.data:
+                d.read()
+            return
+        self.readSource(fileD(input))
+
+    def readSource(self,source):
+        self.__index = None
+        self.data = [diagnostics(source=source, index=i)
+                     for i in range(len(source))]
 
     def readFilename(self,filename):
-        inputfile = AUTOutil.openFilename(filename, "r")
-        self.read(inputfile)
-        
+        self.readSource(fileD(filename))
+
     def write(self,output):
-        output.write(self.__str__())
+        for d in self.data:
+            output.write(d.getText())
 
     def writeFilename(self,filename,append=False):
+        # read all diagnostics because we may overwrite
+        self.read()
         if append:
             output = open(filename,"a")
         else:
@@ -126,7 +425,78 @@ class parseD(UserList):
 
 
 def test():
-    pass
+    import tempfile
+    def block(br, pt, ty, lab, eigs):
+        s = ["   %d %5d   0   Jacobian matrix:\n"%(br, pt),
+             "  BR    PT  TY  LAB    PAR(1)        L2-NORM\n",
+             "%4d%6d  %2s%5d   1.00000E+00   2.00000E+00\n"%(br, pt, ty, lab)]
+        for i, (re_, im) in enumerate(eigs):
+            if ty == "HB":
+                s.append("%4d%6d%9sMultiplier%3d %14.5E%14.5E"
+                         "  Abs. Val.%14.5E\n"%(br, pt, "", i+1, re_, im,
+                                               abs(complex(re_, im))))
+            else:
+                s.append("%4d%6d%9sEigenvalue%3d:%14.5E%14.5E\n"%(
+                    br, pt, "", i+1, re_, im))
+        if ty == "HB":
+            s.append("%4d%6d NOTE:Multiplier inaccurate\n"%(br, pt))
+        return "".join(s)
+    blocks = [block(1, 1, "EP", 1, [(-1, 0), (-2, 0)]),
+              block(1, 2, "", 0, [(-1, 0.5)]),
+              block(1, 3, "LP", 2, [(0, 0), (-3, 0)]),
+              block(2, 1, "HB", 3, [(1, 0), (0.5, 0.5), (0.5, -0.5)])]
+    text = ("="*47 + "\n").join(blocks) + "="*47 + "\n"
+    fd, filename = tempfile.mkstemp(suffix=".d")
+    os.close(fd)
+    try:
+        f = open(filename, "w")
+        f.write(text)
+        f.close()
+        # read in small pieces to find blocks across piece boundaries
+        fileD.chunksize, chunksize = 100, fileD.chunksize
+        try:
+            d = parseD(filename)
+        finally:
+            fileD.chunksize = chunksize
+        success = (len(d) == 5 and str(d) == text and
+                   d(2)["Point number"] == 3 and d(2)["Branch number"] == 1 and
+                   d(2)["Eigenvalues"] == [[0.0, 0.0], [-3.0, 0.0]] and
+                   d(3)["Multipliers"] == [[1.0, 0.0], [0.5, 0.5],
+                                           [0.5, -0.5]] and
+                   d.getKey(1, 2) is d[1] and d.getKey(2, 1, 3) is d(3) and
+                   d(4) is None and
+                   d.grep("LP") == [blocks[2].splitlines()[2]])
+        d2 = parseD([{"Text": x} for x in blocks])
+        success = (success and d2(3)["Label"] == 3 and
+                   str(d2 + d) == "".join(blocks) + text)
+        if not Points.numpyimported:
+            Points.importnumpy()
+        if Points.fromstring:
+            N = Points.N
+            pt, eigs = d.eigenvalues(1)
+            success = (success and list(pt) == [1, 2, 3] and
+                       eigs.shape == (3, 2) and eigs[1,0] == -1+0.5j and
+                       N.isnan(eigs[1,1]))
+            pt, mults = d.multipliers()
+            success = (success and list(pt) == [1] and
+                       list(mults[0]) == [1, 0.5+0.5j, 0.5-0.5j])
+            success = (success and len(d.eigenvalues()[0]) == 3 and
+                       len(d.eigenvalues(2)[0]) == 0)
+        success = (success and
+                   d.data[0].getText() == blocks[0] + "="*47 + "\n")
+
+        # save onto the file that was read
+        d = parseD(filename)
+        d.writeFilename(filename)
+        success = success and str(parseD(filename)) == text
+        import pickle
+        d = pickle.loads(pickle.dumps(parseD(filename)))
+        success = success and str(d) == text and d(2)["Point number"] == 3
+    finally:
+        os.remove(filename)
+    if not success:
+        raise AUTOExceptions.AUTORegressionError("parseD read incorrectly")
+    print("parseD passed all tests")
 
 if __name__ == "__main__":
     #Parse command line arguements
@@ -138,6 +508,4 @@ if __name__ == "__main__":
     foo = parseD(args[0])
     foo.printMatrix(int(opts["-i"]),sys.stdout)
 
-    
-
 
@@ -17,6 +17,7 @@
 #    Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
 #    MA 02111-1307, USA
 
+import io
 import os
 import sys
 import struct
@@ -37,7 +38,7 @@ import Points
 import runAUTO
 import gzip
 import AUTOutil
-from AUTOutil import format19_10E3
+from AUTOutil import format19_10E3, format19_10E3lines
 import types
 
 # End of data exception definition
@@ -53,7 +54,27 @@ class IncorrectHeaderLength(Exception):
 NPAR = 20
 
 class fileS(object):
-    def __init__(self, filename):
+    # binary sidecar index: magic, then source size, source mtime in
+    # nanoseconds and number of solutions, then for every solution the
+    # header length, the header integers and the start/end offsets of its
+    # data
+    indexmagic = "AUTOIDX2".encode("ascii")
+    indexsuffix = ".idx"
+    # write the sidecar index if there is none, or it is stale; set to
+    # True (or pass writeindex=True, or index=True to parseS, sl and
+    # loadbd) to enable by default. An index that exists is always used.
+    writeindex = False
+    # map on-disk solution files into memory instead of reading them; set
+    # to True (or pass usemmap=True) to enable by default
+    usemmap = False
+
+    def __init__(self, filename, usemmap=None, writeindex=None):
+        if usemmap is None:
+            usemmap = self.usemmap
+        if writeindex is None:
+            writeindex = self.writeindex
+        self.mapped = None
+        self.closed = False
         if isinstance(filename, str):
             inputfile = AUTOutil.openFilename(filename,"rb")
         else:
@@ -62,14 +83,108 @@ class fileS(object):
         self.name = inputfile.name
         self.solutions = []
 
-        # We now go through the file and read the solutions.
-        prev = None
         # for fort.8 we need to read everything into memory; otherwise load the
         # data on demand from disk when we really need it
         # on Windows always load everything because deleting open files is
         # impossible there
         inmemory = (os.path.basename(inputfile.name) == 'fort.8' or
                     sys.platform in ['cygwin', 'win32'])
+        if (inmemory or not isinstance(filename, str) or
+            isinstance(inputfile, gzip.GzipFile)):
+            self.__scan(inmemory)
+            return
+        # use (or create) the sidecar index next to the solution file, so
+        # that opening does not need to walk through all solutions
+        indexname = filename + self.indexsuffix
+        stat = os.fstat(inputfile.fileno())
+        solutions = self.__readindex(indexname, stat)
+        if solutions is None:
+            self.__scan(inmemory)
+            if writeindex and _owned(os.path.dirname(indexname) or "."):
+                self.__writeindex(indexname, stat)
+        else:
+            self.solutions = solutions
+        if usemmap:
+            self.__map()
+
+    def __map(self):
+        # with a mapping, readfloats parses solutions straight from the
+        # mapped file and leaves them on disk afterwards, so that only the
+        # AUTOSolution objects using them hold the parsed data
+        try:
+            import mmap
+            self.mapped = mmap.mmap(self.inputfile.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        except (ImportError, EnvironmentError, ValueError):
+            # no mmap module, or an empty file
+            self.mapped = None
+
+    def __readindex(self, indexname, stat):
+        # returns None if the index does not exist or is stale
+        try:
+            f = open(indexname, "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return None
+        magic = self.indexmagic
+        if data[:len(magic)] != magic:
+            return None
+        pos = len(magic)
+        try:
+            size, mtime, n = struct.unpack_from("<qqi", data, pos)
+            if size != stat.st_size or mtime != _mtime(stat):
+                return None
+            pos += struct.calcsize("<qqi")
+            solutions = []
+            for i in range(n):
+                nheader, = struct.unpack_from("<i", data, pos)
+                pos += 4
+                header = list(struct.unpack_from("<%di"%nheader, data, pos))
+                pos += 4 * nheader
+                start, end = struct.unpack_from("<qq", data, pos)
+                pos += 16
+                solutions.append({'header': header, 'data': (start, end)})
+        except struct.error:
+            return None
+        if pos != len(data):
+            return None
+        return solutions
+
+    def __writeindex(self, indexname, stat):
+        slist = [self.indexmagic,
+                 struct.pack("<qqi", stat.st_size, _mtime(stat),
+                             len(self.solutions))]
+        for solution in self.solutions:
+            header = solution['header']
+            slist.append(struct.pack("<i%di"%len(header), len(header),
+                                     *header))
+            slist.append(struct.pack("<qq", *solution['data']))
+        # write to a temporary file first so that concurrent readers never
+        # see a partially written index
+        tmpname = "%s.%d"%(indexname, os.getpid())
+        try:
+            f = open(tmpname, "wb")
+            try:
+                f.write("".encode("ascii").join(slist))
+            finally:
+                f.close()
+            if os.path.exists(indexname):
+                os.remove(indexname)
+            os.rename(tmpname, indexname)
+        except (IOError, OSError):
+            # read-only directory, etc: just do without an index
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+
+    def __scan(self, inmemory):
+        inputfile = self.inputfile
+        # We now go through the file and read the solutions.
+        prev = None
         while len(inputfile.read(1)) > 0:
             line = inputfile.readline()
             if not line: raise PrematureEndofData
@@ -141,50 +256,188 @@ class fileS(object):
             return data
         start = data[0]
         end = data[1]
+        if self.mapped is not None:
+            # leave it on disk
+            return self.mapped[start:end]
         self.inputfile.seek(start)
+        solution['offsets'] = data
         solution['data'] = self.inputfile.read(end - start)
         return solution['data']
 
+    def load(self, i):
+        # keep solution i in memory, for instance because its file is
+        # about to be overwritten
+        solution = self.solutions[i]
+        data = solution['data']
+        if isinstance(data, tuple):
+            text = self.readstr(i)
+            solution['offsets'] = data
+            solution['data'] = text
+
+    def detach(self, i):
+        # solution i was parsed and no longer needs to be read from disk
+        solution = self.solutions[i]
+        data = solution['data']
+        if isinstance(data, tuple):
+            solution['offsets'] = data
+            solution['data'] = None
+
+    def unload(self, i):
+        # put solution i back on disk; returns False if its file was
+        # closed or it was never on disk
+        solution = self.solutions[i]
+        if self.closed:
+            return False
+        if not isinstance(solution['data'], tuple):
+            if 'offsets' not in solution:
+                return False
+            solution['data'] = solution['offsets']
+        return True
+
     def readfloats(self, i, total):
         if not Points.numpyimported:
             Points.importnumpy()       
         N = Points.N
+        ondisk = (self.mapped is not None and
+                  isinstance(self.solutions[i]['data'], tuple))
         data = self.readstr(i)
         if hasattr(N, "ndarray") and isinstance(data, N.ndarray):
             return data
-        fromstring = Points.fromstring
-        if fromstring:
-            fdata = []
-            if "D".encode("ascii") not in data:
-                fdata = fromstring(data, dtype=float, sep=' ')
-            if fdata == [] or len(fdata) != total:
-                fdata = N.array(map(parseB.AUTOatof,
-                                    data.split()), 'd')
-            else:
-                #make sure the last element is correct
-                #(fromstring may not do this correctly for a
-                #string like -2.05071-106)
-                fdata[-1] = parseB.AUTOatof(
-                    data[data.rfind(" ".encode("ascii"))+1:].strip())
-        else:
-            data = data.split()
-            try:
-                fdata = N.array(map(float, data), 'd')
-            except ValueError:
-                fdata = N.array(map(parseB.AUTOatof, data), 'd')
+        fdata = parseB.AUTOatofs(data, total)
         if total != len(fdata):
             raise PrematureEndofData
-        del self.solutions[i]['data']
-        self.solutions[i]['data'] = fdata
+        if not ondisk:
+            del self.solutions[i]['data']
+            self.solutions[i]['data'] = fdata
         return fdata
 
+    def hastext(self, i):
+        # whether solution i can still be copied as text; readfloats
+        # replaces the text of solutions in memory by the parsed floats
+        data = self.solutions[i]['data']
+        return isinstance(data, (tuple, bytes))
+
     def conditionalclose(self):
         # if everything is in memory, close the file
         for s in self.solutions:
             if isinstance(s['data'], tuple):
                 return
+        self.close()
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.closed = True
         self.inputfile.close()
 
+class binaryS(fileS):
+    # solutions in a numpy .npz container written by bifDiag: every solution
+    # is stored as one array of floats, in the order of an s-file, which is
+    # only loaded when the solution is accessed
+
+    def __init__(self, npzfile, keys, headers, name):
+        self.inputfile = npzfile
+        self.name = name
+        self.mapped = None
+        self.closed = False
+        self.solutions = [{'header': header, 'data': (key,)}
+                          for key, header in zip(keys, headers)]
+
+    def readstr(self, i):
+        solution = self.solutions[i]
+        data = solution['data']
+        if not isinstance(data, tuple):
+            return data
+        solution['offsets'] = data
+        solution['data'] = self.inputfile[data[0]]
+        return solution['data']
+
+    def hastext(self, i):
+        return False
+
+    def close(self):
+        self.closed = True
+        self.inputfile.close()
+
+def _mtime(stat):
+    # the modification time in nanoseconds; Python 2 only has the float
+    mtime = getattr(stat, "st_mtime_ns", None)
+    if mtime is None:
+        mtime = int(stat.st_mtime * 1000000000)
+    return mtime
+
+def _owned(directory):
+    # only write next to the files of others when they are our own
+    if not hasattr(os, "getuid"):
+        return True
+    try:
+        return os.stat(directory).st_uid == os.getuid()
+    except OSError:
+        return False
+
+def _solutionends(data):
+    # the offsets just after every complete solution in data: a header
+    # line followed by header[8] lines of data
+    newline = "\n".encode("ascii")
+    ends = []
+    end = 0
+    while True:
+        pos = data.find(newline, end)
+        if pos < 0:
+            break
+        try:
+            header = list(map(int, data[end:pos].split()))
+        except ValueError:
+            raise PrematureEndofData
+        if len(header) < 10:
+            raise PrematureEndofData
+        for i in range(header[8]):
+            pos = data.find(newline, pos + 1)
+            if pos < 0:
+                break
+        if pos < 0:
+            break
+        end = pos + 1
+        ends.append(end)
+    return ends
+
+class followS(object):
+    """Follow a fort.8 file that is still being written.
+
+    Every call of read() returns the solutions that were completed since
+    the previous call as a list of AUTOSolutions, reading the file from
+    the offset where the previous call stopped.
+    """
+    def __init__(self,filename):
+        self.name = filename
+        self.offset = 0
+
+    def read(self):
+        try:
+            inputfile = open(self.name,"rb")
+        except IOError:
+            # not created yet
+            return []
+        try:
+            if os.fstat(inputfile.fileno()).st_size < self.offset:
+                # the file was truncated: start again
+                self.offset = 0
+            inputfile.seek(self.offset)
+            data = inputfile.read()
+        finally:
+            inputfile.close()
+        ends = _solutionends(data)
+        if ends == []:
+            return []
+        end = ends[-1]
+        self.offset += end
+        stream = io.BytesIO(data[:end])
+        stream.name = self.name
+        solutions = parseS()
+        solutions.read(fileS(stream))
+        return list(solutions)
+
 # The parseS class parses an AUTO fort.8 file
 # THESE EXPECT THE FILE TO HAVE VERY SPECIFIC FORMAT!
 # it provides 4 methods:
@@ -200,10 +453,10 @@ class fileS(object):
 # in the fort.8 file.
 
 class parseS(list):
-    def __init__(self,filename=None):
+    def __init__(self,filename=None,usemmap=None,index=None):
         if isinstance(filename, str):
             list.__init__(self)
-            self.readFilename(filename)
+            self.readFilename(filename,usemmap,index)
         else:
             if filename is None:
                 list.__init__(self)
@@ -291,8 +544,8 @@ class parseS(list):
                 x.write(output)
         output.flush()
 
-    def readFilename(self,filename):
-        inputfile = fileS(filename)
+    def readFilename(self,filename,usemmap=None,index=None):
+        inputfile = fileS(filename,usemmap,index)
         self.read(inputfile)
         inputfile.conditionalclose()
         # else don't close but garbage collect
@@ -648,9 +901,12 @@ class AUTOSolution(UserDict,Points.Pointset):
         return self.__input is None and not self.__fullyParsed
 
     def __getstate__(self):
-        # For pickle: read everything
+        # For pickle: read everything, after which the file is not needed
         self.__readAll()
-        return Points.Pointset.__getstate__(self)
+        state = Points.Pointset.__getstate__(self)
+        if self.__fullyParsed:
+            state["_AUTOSolution__input"] = None
+        return state
 
     def __str__(self):
         self.__readAll()
@@ -885,10 +1141,14 @@ class AUTOSolution(UserDict,Points.Pointset):
             
     def read(self, inputfile=None, index=0):
         if self.__fullyParsed:
+            if inputfile is None and self.__input is not None:
+                # the parsed data no longer needs the file
+                self.__input.detach(self.__index)
+                self.__input.conditionalclose()
             return
         if inputfile is None:
             # read data into memory
-            self.__input.readstr(self.__index)
+            self.__input.load(self.__index)
             self.__input.conditionalclose()
             return
         if not isinstance(inputfile, fileS):
@@ -901,6 +1161,23 @@ class AUTOSolution(UserDict,Points.Pointset):
         self.read(inputfile)
         self.__readAll()
 
+    def unload(self):
+        """Drop the parsed data of a solution that was read from an s-file
+        that is still open, so that it is parsed from the file again when
+        it is next used; changes to the data are lost.
+        Returns False if the file was closed or read into memory."""
+        if self.__input is None or not self.__input.unload(self.__index):
+            return False
+        if self.__fullyParsed:
+            self.__fullyParsed = False
+            for attr in ["coordarray", "indepvararray", "PAR"]:
+                if attr in self.__dict__:
+                    del self.__dict__[attr]
+            for key in ["Active ICP", "rldot", "udotps"]:
+                if key in self.data:
+                    del self.data[key]
+        return True
+
     def __readHeader(self):
         header = self.__input.solutions[self.__index]['header']
         self.indepvarname = 't'
@@ -1019,19 +1296,8 @@ class AUTOSolution(UserDict,Points.Pointset):
             return getattr(self,attr)
         raise AttributeError(attr)
 
-    def write(self,output,mlab=False):
-        if self.__nodata():
-            return
-        try:
-            "".encode("ascii") + ""
-            def write_enc(s):
-                #write encoded
-                output.write(s)
-        except TypeError: #Python 3.0
-            def write_enc(s):
-                #write encoded
-                output.write(s.encode("ascii"))
-
+    def __header(self):
+        # the integers in the header of this solution in an s-file
         if self.__fullyParsed:
             ndim = len(self.coordarray)
             npar = len(self["Parameters"])
@@ -1047,23 +1313,52 @@ class AUTOSolution(UserDict,Points.Pointset):
             ntpl = self.__numSValues
             nfpr = self.__numChangingParameters
             nrowpr = self.__numLinesPerEntry
+        header = [self["BR"], self["PT"], self["TY number"], self["LAB"],
+                  nfpr, self["ISW"], ntpl, ndim+1, nrowpr, self["NTST"],
+                  self["NCOL"], npar]
+        if self["IPS"] is not None:
+            header.extend([self["NPARI"], self["NDIM"], self["IPS"],
+                           self["IPRIV"]])
+        return header
+
+    def _binary(self):
+        """Return the header integers of this solution and all its data
+        as one array of floats, in the order of an s-file."""
+        self.__readAll()
+        N = Points.N
+        header = self.__header()
+        ndim, ntpl = header[7]-1, header[6]
+        ups = N.concatenate(([self.indepvararray], self.coordarray))
+        data = [N.ravel(N.transpose(ups))]
+        if "Active ICP" in self.data:
+            udotps = N.zeros((ndim, ntpl))
+            c = self["udotps"].coordarray
+            udotps[:len(c)] = c
+            data.extend([N.array(self["Active ICP"], float),
+                         N.array(self["rldot"], float),
+                         N.ravel(N.transpose(udotps))])
+        data.append(N.array(self.PAR.toarray(), float))
+        return header, N.concatenate(data)
 
-        line = "%6d%6d%6d%6d%6d%6d%8d%6d%8d%5d%5d%5d" % (self["BR"],
-                                                         self["PT"],
-                                                         self["TY number"],
-                                                         self["LAB"],
-                                                         nfpr,
-                                                         self["ISW"],
-                                                         ntpl,
-                                                         ndim+1,
-                                                         nrowpr,
-                                                         self["NTST"],
-                                                         self["NCOL"],
-                                                         npar
-                                                         )
+    def write(self,output,mlab=False):
+        if self.__nodata():
+            return
+        try:
+            "".encode("ascii") + ""
+            def write_enc(s):
+                #write encoded
+                output.write(s)
+        except TypeError: #Python 3.0
+            def write_enc(s):
+                #write encoded
+                output.write(s.encode("ascii"))
+
+        if not self.__fullyParsed and not self.__input.hastext(self.__index):
+            self.__readAll()
+        header = self.__header()
+        line = "%6d%6d%6d%6d%6d%6d%8d%6d%8d%5d%5d%5d" % tuple(header[:12])
         if self["IPS"] is not None:
-            line += "%5d%5d%5d%5d" % (self["NPARI"],self["NDIM"],self["IPS"],
-                                      self["IPRIV"])
+            line += "%5d%5d%5d%5d" % tuple(header[12:])
         write_enc(line+os.linesep)
         # If the file isn't already parsed, we can just copy from the input
         # file into the output file
@@ -1072,15 +1367,16 @@ class AUTOSolution(UserDict,Points.Pointset):
         # Otherwise we do a normal write.  NOTE: if the solution isn't already
         # parsed it will get parsed here.
         else:
-            slist = []
-            for i in range(len(self.indepvararray)):
-                slist.append("    "+format19_10E3(self.indepvararray[i]))
-                for j in range(1,len(self.coordarray)+1):
-                    if j%7==0:
-                        slist.append(os.linesep+"    ")
-                    slist.append(format19_10E3(self.coordarray[j-1,i]))
-                slist.append(os.linesep)
-            write_enc("".join(slist))
+            N = Points.N
+            numpy = Points.fromstring is not None
+            ndim = len(self.coordarray)
+            if numpy:
+                ups = N.transpose(N.concatenate(([self.indepvararray],
+                                                 self.coordarray)))
+            else:
+                ups = list(zip(self.indepvararray.tolist(),
+                               *self.coordarray.tolist()))
+            write_enc(format19_10E3lines(ups))
             if "Active ICP" in self.data:
                 # Solution contains derivative information.
                 j = 0
@@ -1092,43 +1388,22 @@ class AUTOSolution(UserDict,Points.Pointset):
                 if j%20!=0:
                     write_enc(os.linesep)
 
-                line = "    "
-                i = 0
-                for vi in self["rldot"]:
-                    num = format19_10E3(vi)
-                    if i != 0 and i%7==0:
-                        line = line + os.linesep + "    "
-                    line = line + num
-                    i = i + 1
-                write_enc(line+os.linesep)
+                write_enc(format19_10E3lines([list(self["rldot"])]))
 
                 # write UDOTPS
-                slist = []
                 c = self["udotps"].coordarray
-                l = len(c)
-                for i in range(len(self.indepvararray)):
-                    slist.append("    ")
-                    for j in range(len(self.coordarray)):
-                        if j!=0 and j%7==0:
-                            slist.append(os.linesep+"    ")
-                        if j<l:
-                            slist.append(format19_10E3(c[j,i]))
-                        else:
-                            slist.append(format19_10E3(0))
-                    slist.append(os.linesep)
-                write_enc("".join(slist))
-
-            line = "    "
-            j = 0
-            for parameter in self.PAR.toarray():
-                num = format19_10E3(parameter)
-                line = line + num 
-                j = j + 1
-                if j%7==0:
-                    write_enc(line+os.linesep)
-                    line = "    "
-            if j%7!=0:
-                write_enc(line+os.linesep)
+                if numpy:
+                    udotps = N.zeros((ndim, len(self.indepvararray)))
+                    udotps[:len(c)] = c
+                    udotps = N.transpose(udotps)
+                else:
+                    udotps = [u + (ndim-len(c))*(0.0,)
+                              for u in zip(*c.tolist())]
+                write_enc(format19_10E3lines(udotps))
+
+            par = self.PAR.toarray()
+            if len(par) > 0:
+                write_enc(format19_10E3lines([list(par)]))
         if mlab and (self._mbr > 0 or self._mlab > 0) and not (
             self._mbr == self["BR"] and self._mlab == self["LAB"]):
             # header for empty solution so that AUTO can pickup the maximal
@@ -1173,8 +1448,128 @@ def test():
         raise AUTOExceptions.AUTORegressionError("File length incorrect")
     pointtest(foo.getIndex(0),foo.getIndex(3))
 
-    
-    
+    print("Testing pickling")
+    import pickle
+    foo = pickle.loads(pickle.dumps(parseS("test_data/fort.8")))
+    if len(foo) != 5:
+        raise AUTOExceptions.AUTORegressionError("File length incorrect")
+    pointtest(foo.getIndex(0),foo.getIndex(3))
+
+    print("Testing reading through the solution index")
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    try:
+        name = os.path.join(tmpdir, "s.test")
+        shutil.copy("test_data/fort.8", name)
+        foo = parseS(name)
+        if os.path.exists(name + fileS.indexsuffix):
+            raise AUTOExceptions.AUTORegressionError("Index written unasked")
+        foo = parseS(name, index=True)
+        headers = []
+        for i in range(2):
+            foo = parseS(name)
+            if not os.path.exists(name + fileS.indexsuffix):
+                raise AUTOExceptions.AUTORegressionError("No index written")
+            if len(foo) != 5:
+                raise AUTOExceptions.AUTORegressionError(
+                    "File length incorrect")
+            pointtest(foo.getIndex(0),foo.getIndex(3))
+            headers.append([s["Label"] for s in foo])
+            del foo
+        if headers[0] != headers[1]:
+            raise AUTOExceptions.AUTORegressionError("Index mismatch")
+        stat = os.stat(name)
+        if hasattr(stat, "st_mtime_ns"):
+            # a nanosecond change of the modification time makes it stale
+            index = open(name + fileS.indexsuffix,"rb").read()
+            os.utime(name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            foo = parseS(name, index=True)
+            if open(name + fileS.indexsuffix,"rb").read() == index:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Stale index not rewritten")
+            pointtest(foo.getIndex(0),foo.getIndex(3))
+            del foo
+
+        print("Testing reading through a memory map")
+        inputfile = fileS(name, usemmap=True)
+        if inputfile.mapped is None:
+            raise AUTOExceptions.AUTORegressionError("File not mapped")
+        foo = parseS()
+        foo.read(inputfile)
+        pointtest(foo.getIndex(0),foo.getIndex(3))
+        output = open(os.path.join(tmpdir, "s.copy"),"wb")
+        foo.write(output)
+        output.close()
+        for solution in inputfile.solutions:
+            if not isinstance(solution['data'], tuple):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Mapped solution kept in memory")
+        written = parseS(os.path.join(tmpdir, "s.copy"))
+        if len(written) != len(foo):
+            raise AUTOExceptions.AUTORegressionError("File length incorrect")
+        for i in range(len(foo)):
+            pointtest(written[i], foo[i])
+        inputfile.close()
+        del foo, written
+
+        print("Testing unloading solutions")
+        ref = parseS("test_data/fort.8")
+        if ref[0].unload():
+            raise AUTOExceptions.AUTORegressionError(
+                "Solution in memory unloaded")
+        for usemmap in [False, True]:
+            foo = parseS(name, usemmap=usemmap)
+            pointtest(foo[0], ref[0])
+            coordarray = foo[3].coordarray
+            foo[3].PAR[1] = 0.0
+            if not foo[3].unload():
+                raise AUTOExceptions.AUTORegressionError(
+                    "Solution not unloaded")
+            if (foo[3].PAR != ref[3].PAR or
+                foo[3].coordarray is coordarray):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Unloaded solution not read again")
+            pointtest(foo[3], ref[3])
+            foo.read()
+            if foo[3].unload():
+                raise AUTOExceptions.AUTORegressionError(
+                    "Solution unloaded from a closed file")
+            pointtest(foo[3], ref[3])
+            del foo
+
+        print("Testing writing a solution after parsing a copy")
+        foo = parseS("test_data/fort.8")
+        copy = foo[0].load(e="t")
+        pointtest(copy, ref[0])
+        output = open(os.path.join(tmpdir, "s.copy"),"wb")
+        foo[0].write(output)
+        output.close()
+        pointtest(parseS(os.path.join(tmpdir, "s.copy"))[0], ref[0])
+        del foo, copy
+
+        print("Testing following a growing file")
+        name = os.path.join(tmpdir, "fort.8")
+        data = open("test_data/fort.8","rb").read()
+        follow = followS(name)
+        solutions = follow.read()
+        output = open(name,"wb")
+        for i in range(0, len(data), 5000):
+            output.write(data[i:i+5000])
+            output.flush()
+            solutions.extend(follow.read())
+        output.close()
+        foo = parseS("test_data/fort.8")
+        if len(solutions) != len(foo):
+            raise AUTOExceptions.AUTORegressionError("File length incorrect")
+        pointtest(solutions[0],foo[0])
+        pointtest(solutions[3],foo[3])
+        if ([s["LAB"] for s in solutions] != [s["LAB"] for s in foo] or
+            solutions[3].PAR != foo[3].PAR):
+            raise AUTOExceptions.AUTORegressionError("Solution incorrect")
+    finally:
+        shutil.rmtree(tmpdir)
+
     print("parseS passed all tests")
 
 if __name__ == '__main__' :
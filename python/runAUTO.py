@@ -7,7 +7,12 @@ except ImportError: # Python 3
     from io import StringIO
 import re
 import glob
-import AUTOExceptions,parseC,parseS,gc
+import shutil
+import filecmp
+import hashlib
+import platform
+import time
+import AUTOExceptions,parseB,parseC,parseD,parseS,gc
 try:
     import subprocess
 except ImportError:
@@ -52,7 +57,196 @@ signals = {
     "SIGSYS": "Bad system call"
 }
 
+def _cachedir():
+    # the directory for cached executables and run results
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                        os.path.join(os.path.expanduser("~"), ".cache"),
+                        "auto-07p")
+
+def cleancache(directory=None, size=0):
+    """Remove the least recently used results from the cache of run()
+    results in directory (by default the one used with cache=True),
+    until it uses at most size bytes."""
+    if directory is None:
+        directory = os.path.join(_cachedir(), "runs")
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    entries = []
+    for name in names:
+        path = os.path.join(directory, name)
+        # skip results that are still being stored
+        if "." in name or not os.path.isdir(path):
+            continue
+        try:
+            used = os.stat(path).st_mtime
+            n = 0
+            for filename in os.listdir(path):
+                n = n + os.path.getsize(os.path.join(path, filename))
+        except OSError:
+            continue
+        entries.append((used, n, path))
+    _evict(entries, size)
+
+def cleanexecutables(size=0):
+    """Remove the least recently used executables from the cache of
+    compiled equations, until it uses at most size bytes."""
+    directory = _cachedir()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    entries = []
+    for name in names:
+        path = os.path.join(directory, name)
+        # skip executables that are still being stored
+        if not name.endswith(".exe") or not os.path.isfile(path):
+            continue
+        try:
+            entries.append((os.stat(path).st_mtime, os.path.getsize(path),
+                            path))
+        except OSError:
+            continue
+    _evict(entries, size)
+
+def _evict(entries, size):
+    # remove the least recently used of the (time, bytes, path) entries
+    # until the rest uses at most size bytes
+    total = 0
+    for used, n, path in entries:
+        total = total + n
+    entries.sort()
+    for used, n, path in entries:
+        if total <= size:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total = total - n
+
+def _fromcache(entry, paths):
+    # copy the cached output files to paths; returns False if there are none
+    if not os.path.isdir(entry):
+        return False
+    try:
+        for i, path in enumerate(paths):
+            shutil.copy(os.path.join(entry, "fort.%d"%(i+7)), path)
+        # mark as recently used
+        os.utime(entry, None)
+    except (IOError, OSError):
+        return False
+    return True
+
+def _tocache(entry, paths):
+    # store under a temporary name first so that concurrent runs never see
+    # partial results
+    tmpname = "%s.%d"%(entry, os.getpid())
+    try:
+        os.makedirs(tmpname)
+        for i, path in enumerate(paths):
+            shutil.copy(path, os.path.join(tmpname, "fort.%d"%(i+7)))
+        os.rename(tmpname, entry)
+    except (IOError, OSError):
+        shutil.rmtree(tmpname, True)
+
+def _readbytes(filename):
+    try:
+        f = open(filename, "rb")
+    except IOError:
+        return "".encode("ascii")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _datafile(dat):
+    # the name of the file that AUTO reads for the dat constant, or None
+    if dat:
+        for name in [dat, dat + ".dat"]:
+            if os.path.isfile(name):
+                return name
+    return None
+
+# the branch and point number at the start of a line of a d-file
+_pointline = re.compile("^ *(-?[0-9]+) +(-?[0-9]+)\\b".encode("ascii"), re.M)
+
+def _cutoutput(names, npoints=None):
+    # cut the b-, s- and d-files named in names of a stopped run after
+    # their first npoints points, and before the first labelled point
+    # whose solution is incomplete, so that they still fit together
+    fort7, fort8, fort9 = [_readbytes(name) for name in names]
+    solutions = parseS._solutionends(fort8)
+    cuts = [0, 0, 0]
+    rows = labels = 0
+    last = following = None
+    pos = 0
+    for line in fort7.splitlines(True):
+        pos = pos + len(line)
+        if not line.endswith("\n".encode("ascii")):
+            break
+        sp = line.split()
+        if sp == [] or sp[0] == "0".encode("ascii"):
+            # header lines belong to the rows that follow them
+            continue
+        lab = int(sp[3])
+        if rows == npoints or (lab != 0 and labels == len(solutions)):
+            following = int(sp[0]), abs(int(sp[1]))
+            break
+        rows = rows + 1
+        if lab != 0:
+            labels = labels + 1
+        last = int(sp[0]), abs(int(sp[1]))
+        cuts[0] = pos
+    if labels > 0:
+        cuts[1] = solutions[labels-1]
+    # the diagnostics of a point come before its line in fort.9: cut
+    # at the start of the block of the first point that was dropped
+    if last is not None:
+        if following is None:
+            following = last[0], last[1] + 1
+        cuts[2] = len(fort9)
+        for m in _pointline.finditer(fort9):
+            if (int(m.group(1)), abs(int(m.group(2)))) == following:
+                cuts[2] = m.start()
+                starts = [fort9.rfind(div.encode("ascii"), 0, m.start()) +
+                          len(div) for div in parseD.dividers
+                          if fort9.rfind(div.encode("ascii"), 0,
+                                         m.start()) != -1]
+                if starts != []:
+                    cuts[2] = max(starts)
+                break
+    for name, data, cut in zip(names, [fort7, fort8, fort9], cuts):
+        if len(data) > cut:
+            f = open(name, "r+b")
+            f.truncate(cut)
+            f.close()
+
+class _collect(list):
+    # collects what is written to it as bytes
+    def write(self, s):
+        if not isinstance(s, bytes):
+            s = s.encode("ascii")
+        self.append(s)
+    def flush(self):
+        pass
+
 class runAUTO:
+    # how often (in seconds) the output files are checked when following
+    # a run with a callback
+    pollinterval = 0.5
+    # the number of bytes in the cache of run results above which the
+    # least recently used results are removed
+    cachesize = 1 << 30
+    # the same for the cache of compiled equations, which is keyed on the
+    # equation file, the compiler settings, and the libraries and headers
+    # of AUTO; other files that the equations include are not tracked
+    executablecachesize = 1 << 28
+
     def __init__(self,**kw):
         # Set the signal handler
         if hasattr(signal,'SIGALRM') and demo_max_time > 0:
@@ -74,6 +268,10 @@ class runAUTO:
         self.options["solution"] = parseS.AUTOSolution()
         self.options["homcont"] = None
         self.options["selected_solution"] = None
+        # cache run results: True, or the name of the cache directory
+        self.options["cache"] = None
+        # set when the last run was stopped by a callback
+        self.stopped = False
 
         kw = self.config(**kw)
 
@@ -279,6 +477,33 @@ class runAUTO:
         f.close()
         return var
 
+    def __cachedexecutable(self,src,var):
+        # Returns the file name of the executable for src in the build
+        # cache, which is keyed on the contents of src, the compiler
+        # settings and the AUTO libraries and headers, or None if there
+        # is no cache. Files included from elsewhere are not tracked.
+        cachedir = _cachedir()
+        h = hashlib.sha1()
+        for key in ["CC","FC","CFLAGS","FFLAGS","OPT"]:
+            h.update(("%s=%s\n"%(key,var.get(key,""))).encode("utf-8"))
+        h.update(("%s %s\n"%(sys.platform,platform.machine())).encode("utf-8"))
+        libdir = os.path.join(self.options["auto_dir"],"lib")
+        incdir = os.path.join(self.options["auto_dir"],"include")
+        libs = (glob.glob(os.path.join(libdir,"*.o")) +
+                glob.glob(os.path.join(libdir,"*.a")) +
+                glob.glob(os.path.join(incdir,"*.h")))
+        try:
+            for filename in [src] + sorted(libs):
+                f = open(filename,"rb")
+                h.update(os.path.basename(filename).encode("utf-8"))
+                h.update(f.read())
+                f.close()
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+        except (IOError, OSError):
+            return None
+        return os.path.join(cachedir, h.hexdigest() + ".exe")
+
     def __make(self,equation,fcon=False):
         var = self.__getmakevars()
         # figure out equation file name
@@ -290,6 +515,22 @@ class runAUTO:
             raise AUTOExceptions.AUTORuntimeError(
                 "Neither the equation file %s.f90, nor %s.f, nor %s.c exists."%(
                 equation,equation,equation))
+        cached = None
+        if not fcon:
+            # skip the compiler if the same model was built before
+            cached = self.__cachedexecutable(src,var)
+            if cached is not None and os.path.exists(cached):
+                execfile = equation + ".exe"
+                if (not os.path.exists(execfile) or
+                    not filecmp.cmp(execfile,cached,False)):
+                    sys.stdout.write("Using cached %s\n"%execfile)
+                    shutil.copy(cached,execfile)
+                try:
+                    # mark as recently used
+                    os.utime(cached, None)
+                except OSError:
+                    pass
+                return True
         # compile
         if not os.path.exists(equation+'.o') or self.__newer([src],
                                                              equation+'.o'):
@@ -325,7 +566,21 @@ class runAUTO:
             sys.stdout.write(cmd+"\n")
             cmd = cmd.replace(libs, " ".join(deps[:-1]))
             self.runCommand(cmd)
-        return os.path.exists(equation+'.exe') and not self.__newer(deps,equation+'.exe')
+        ok = (os.path.exists(equation+'.exe') and
+              not self.__newer(deps,equation+'.exe'))
+        if ok and cached is not None:
+            # copy under a temporary name first so that concurrent builds
+            # never see a partial executable
+            tmpname = "%s.%d"%(cached,os.getpid())
+            try:
+                shutil.copy(equation+'.exe',tmpname)
+                if os.path.exists(cached):
+                    os.remove(cached)
+                os.rename(tmpname,cached)
+            except (IOError, OSError):
+                pass
+            cleanexecutables(self.executablecachesize)
+        return ok
 
     def load(self,**kw):
         """Load solution with the given AUTO constants.
@@ -337,12 +592,75 @@ class runAUTO:
         self.options["selected_solution"] = ret
         return ret
 
-    def run(self):
+    def __runcache(self,cache):
+        # the directory of the cache of run results, or None
+        if cache is None:
+            cache = self.options["cache"]
+        if not cache:
+            return None
+        if cache is True:
+            return os.path.join(_cachedir(), "runs")
+        return cache
+
+    def __cachekey(self,equation,solution):
+        # the results of a run depend on the executable, on what is
+        # written to its standard input and to fort.12, and on the
+        # data files it reads
+        filenames = [equation + ".exe"]
+        if solution.c.get("dat"):
+            filenames.append(_datafile(solution.c["dat"]))
+            if filenames[-1] is None:
+                # AUTO fails without it
+                return None
+        if os.path.exists("fort.3"):
+            filenames.append("fort.3")
+        h = hashlib.sha1()
+        for filename in filenames:
+            try:
+                f = open(filename, "rb")
+                h.update(f.read())
+                f.close()
+            except IOError:
+                return None
+            h.update("\n".encode("ascii"))
+        f = _collect()
+        self.__write_constants_solution(f, solution)
+        h.update("".encode("ascii").join(f))
+        homcont = solution.c.get("homcont")
+        if homcont is not None:
+            h.update(("\n%s"%homcont).encode("ascii"))
+        return h.hexdigest()
+
+    def run(self,callback=None,stop_when=None,cache=None):
         """Run AUTO.
 
         Run AUTO from the solution with the given AUTO constants.
         Returns a bifurcation diagram of the result.
+
+        If cache (or the cache option) is True or a directory name, the
+        output files of a run are stored in a cache, and a later run of
+        the same executable with the same constants, solution and data
+        file (see the dat constant) copies them from there instead of
+        running AUTO again. Runs with a callback are never cached, and
+        neither are runs whose data file is missing.
+
+        Compiled equations are always cached, by the contents of the
+        equation file, the compiler settings, and the libraries and
+        headers of AUTO. Files that the equations include from other
+        places are not tracked: after changing them, remove the cached
+        executables with clean(cache=True).
+
+        If callback is given, it is called as callback(points,solutions)
+        while AUTO runs, with the lists of BDPoints and AUTOSolutions
+        that were written to the output files since the previous call.
+        If it returns True, AUTO is stopped, keeping the output written
+        so far.
+        stop_when is a function, or a list of functions, that is called
+        with every new point of the branch; AUTO is stopped as soon as
+        one of them returns True.
         """
+        if stop_when is not None:
+            callback = self.__stopcallback(callback, stop_when)
         self.__setup()
         solution = self.options["selected_solution"]
         constants = solution.c
@@ -366,18 +684,36 @@ class runAUTO:
                 line = "Starting %s ...\n"%equation
                 sys.stdout.write(line)
                 self.__analyseLog(line)
-                for filename in [self.fort7_path,self.fort8_path,
-                                 self.fort9_path]:
+                paths = [self.fort7_path,self.fort8_path,self.fort9_path]
+                for filename in paths:
                     if os.path.exists(filename):
                         os.remove(filename)
-                command = os.path.join(".",equation + ".exe")
-                prefix = os.environ.get("AUTO_COMMAND_PREFIX")
-                if prefix is not None:
-                    command = " ".join((prefix, command))
-                self.runCommand(command, solution)
-                if os.path.exists("fort.3"):
-                    os.remove("fort.3")
-                line = "%s ... done\n"%equation
+                cachedir = self.__runcache(cache)
+                key = None
+                if cachedir is not None and callback is None:
+                    key = self.__cachekey(equation, solution)
+                if key is not None and _fromcache(os.path.join(cachedir, key),
+                                                  paths):
+                    self.stopped = False
+                    line = "%s ... done (cached)\n"%equation
+                else:
+                    command = os.path.join(".",equation + ".exe")
+                    prefix = os.environ.get("AUTO_COMMAND_PREFIX")
+                    if prefix is not None:
+                        command = " ".join((prefix, command))
+                    self.runCommand(command, solution, callback)
+                    if os.path.exists("fort.3"):
+                        os.remove("fort.3")
+                    if self.stopped:
+                        line = "%s ... stopped\n"%equation
+                    else:
+                        line = "%s ... done\n"%equation
+                        if key is not None and os.path.isfile(paths[0]) and (
+                            os.path.getsize(paths[0]) > 0 and
+                            os.path.isfile(paths[1]) and
+                            os.path.isfile(paths[2])):
+                            _tocache(os.path.join(cachedir, key), paths)
+                            cleancache(cachedir, self.cachesize)
                 sys.stdout.write(line)
             os.chdir(curdir)
         else:
@@ -387,6 +723,219 @@ class runAUTO:
         return bifDiag.bifDiag(self.fort7_path,self.fort8_path,
                                self.fort9_path,constants)
 
+    def __stopcallback(self,callback,stop_when):
+        if not isinstance(stop_when, (list, tuple)):
+            stop_when = [stop_when]
+        def stopcallback(points,solutions):
+            stop = callback is not None and callback(points,solutions)
+            for i, point in enumerate(points):
+                for predicate in stop_when:
+                    if predicate(point):
+                        # drop the points after this one
+                        stopcallback.npoints = i + 1
+                        return True
+            stopcallback.npoints = len(points)
+            return stop
+        return stopcallback
+
+    def runmany(self,solutions,workers=None):
+        """Run AUTO for a list of loaded solutions at once.
+
+        Every run gets its own scratch directory and at most workers
+        (by default the number of CPUs) runs of the compiled equations
+        happen at the same time. The data file named by the dat
+        constant is linked into the scratch directory; other files that
+        the equations read from the current directory are not.
+        Returns a list of bifurcation diagrams, in the same order as
+        the solutions.
+        """
+        import threading
+        if workers is None:
+            try:
+                import multiprocessing
+                workers = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                workers = 1
+        for solution in solutions:
+            if solution.c.get("sv"):
+                raise AUTOExceptions.AUTORuntimeError(
+                    "Saving (sv=...) is not possible when running "
+                    "several solutions at once.")
+        jobs = self.prepare(solutions)
+        results = [None] * len(jobs)
+        nextjob = [0]
+        lock = threading.Lock()
+        def work():
+            # threads only wait for the AUTO processes to finish
+            while True:
+                lock.acquire()
+                try:
+                    i = nextjob[0]
+                    if i >= len(jobs):
+                        return
+                    nextjob[0] = i + 1
+                    results[i] = (None, 1, "")
+                finally:
+                    lock.release()
+                command, data = jobs[i][:2]
+                try:
+                    scratch = self.makescratch(jobs[i])
+                    results[i] = (scratch, 1, "")
+                    p = subprocess.Popen(command, cwd=scratch,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT)
+                    out = p.communicate(data)[0]
+                    if not isinstance(out, str):
+                        out = out.decode("ascii", "replace")
+                    results[i] = (scratch, p.returncode, out)
+                except (OSError, IOError):
+                    results[i] = (results[i][0], 1,
+                                  str(sys.exc_info()[1])+"\n")
+        threads = [threading.Thread(target=work)
+                   for i in range(max(1, min(workers, len(jobs))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # collect the output in order
+        bds = []
+        try:
+            for i, (scratch, status, out) in enumerate(results):
+                sys.stdout.write(out)
+                sys.stdout.flush()
+                bds.append(self.collect(scratch, solutions[i].c, status,
+                                        "Error running AUTO (run %d)"%(i+1)))
+        finally:
+            for scratch, status, out in results:
+                if scratch is not None:
+                    shutil.rmtree(scratch, True)
+        return bds
+
+    def prepare(self,solutions):
+        """Check and compile the equations for a list of loaded solutions,
+        to run them outside the current directory.
+
+        Returns for every solution a tuple of the command (a list of
+        arguments), the data to write to its standard input, the
+        HomCont constants that go into fort.12, or None, and a list of
+        (path, name) pairs of the files to link into the scratch
+        directory as name; see makescratch.
+        """
+        if self.options["auto_dir"] is None:
+            if "AUTO_DIR" not in os.environ:
+                raise AUTOExceptions.AUTORuntimeError(
+                    "AUTO_DIR not set as option or as environment variable")
+            self.options["auto_dir"]=os.environ["AUTO_DIR"]
+
+        # check and compile everything first
+        commands = {}
+        curdir = os.getcwd()
+        os.chdir(self.options["dir"])
+        try:
+            for solution in solutions:
+                constants = solution.c
+                if constants["IRS"] and solution.coordnames == []:
+                    raise AUTOExceptions.AUTORuntimeError(
+                        "Restart label IRS=%s not found."%constants["IRS"])
+                if "e" not in constants:
+                    raise AUTOExceptions.AUTORuntimeError(
+                        "The equation file argument is missing.")
+                equation = constants["e"]
+                if equation in commands:
+                    continue
+                if not self.__make(equation):
+                    raise AUTOExceptions.AUTORuntimeError(
+                        "Error compiling %s"%equation)
+                command = [os.path.abspath(equation + ".exe")]
+                prefix = os.environ.get("AUTO_COMMAND_PREFIX")
+                if prefix is not None:
+                    command = prefix.split() + command
+                commands[equation] = command
+            datafiles = [self.__datafile(solution.c.get("dat"))
+                         for solution in solutions]
+        finally:
+            os.chdir(curdir)
+
+        # the input for each run, prepared here because reading solutions
+        # is not thread-safe
+        jobs = []
+        for solution, files in zip(solutions, datafiles):
+            f = _collect()
+            self.__write_constants_solution(f, solution)
+            jobs.append((commands[solution.c["e"]], "".encode("ascii").join(f),
+                         solution.c.get("homcont"), files))
+        return jobs
+
+    def __datafile(self,dat):
+        # the file that AUTO reads for the dat constant, relative to the
+        # current directory, as a list of (path, name) pairs for
+        # makescratch()
+        name = _datafile(dat)
+        if name is None or os.path.isabs(name):
+            # AUTO reports if it is missing
+            return []
+        name = os.path.normpath(name)
+        if name == os.pardir or name.startswith(os.pardir + os.sep):
+            raise AUTOExceptions.AUTORuntimeError(
+                "The data file %s is outside the current directory; "
+                "use an absolute path to run it in a scratch directory."%dat)
+        return [(os.path.abspath(name), name)]
+
+    def makescratch(self,job):
+        """Returns a new scratch directory for a run prepared with
+        prepare(), with the HomCont constants and the data file of the
+        run in it. The caller removes it after the run."""
+        import tempfile
+        command, data, homcont, files = job
+        scratch = tempfile.mkdtemp(prefix="auto")
+        try:
+            if homcont is not None:
+                homcont.writeFilename(os.path.join(scratch,"fort.12"))
+            for path, name in files:
+                target = os.path.join(scratch, name)
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                try:
+                    os.symlink(path, target)
+                except (AttributeError, NotImplementedError, OSError):
+                    # no symbolic links, as on Windows
+                    shutil.copy(path, target)
+        except:
+            shutil.rmtree(scratch, True)
+            raise
+        return scratch
+
+    def collect(self,scratch,constants,status=0,error="Error running AUTO"):
+        """Returns the bifurcation diagram that a run prepared with
+        prepare() wrote into the scratch directory, after it finished
+        with the given exit status.
+
+        If the constants contain sv, the output files are first moved
+        from the scratch directory to b.sv, s.sv and d.sv.
+        """
+        import bifDiag
+        v = constants.get("sv")
+        if v:
+            files = ["b."+v, "s."+v, "d."+v]
+        else:
+            files = ["fort.7", "fort.8", "fort.9"]
+        paths = [os.path.join(scratch, filename) for filename in files]
+        if (status != 0 or not os.path.isfile(paths[0]) or
+            os.path.getsize(paths[0]) == 0 or
+            not os.path.isfile(paths[1]) or
+            not os.path.isfile(paths[2])):
+            raise AUTOExceptions.AUTORuntimeError(error)
+        if v:
+            for i, filename in enumerate(files):
+                path = os.path.join(self.options["dir"], filename)
+                if os.path.exists(path):
+                    os.remove(path)
+                shutil.move(paths[i], path)
+                paths[i] = path
+        return bifDiag.bifDiag(paths[0], paths[1], paths[2], constants)
+
     def runMakefileWithSetup(self,equation=None):
         self.__setup()
         self.runMakefile(equation)
@@ -455,11 +1004,12 @@ class runAUTO:
         self.__setup()
         self.runCommand(command,self.options["selected_solution"])
         self.__outputCommand()
-    def runCommand(self,command=None,solution=None):
+    def runCommand(self,command=None,solution=None,callback=None):
         """     This is the most generic interface.  It just takes a string as a command
         and tries to run it. """
         global demo_killed,alarm_demo,demo_max_time
         gc.collect()
+        self.stopped = False
         if command is None:
             if not(self.options["command"] is None):
                 command = self.options["command"]
@@ -475,7 +1025,8 @@ class runAUTO:
         command = os.path.expandvars(command)
         if self.options["makefile"] is None and sys.stdout is sys.__stdout__:
             try:
-                status = self.__runCommand_noredir(command, solution)
+                status = self.__runCommand_noredir(command, solution,
+                                                   callback)
             except KeyboardInterrupt:
                 if hasattr(signal, 'SIGINT'):
                     status = -signal.SIGINT
@@ -487,7 +1038,7 @@ class runAUTO:
                 else:
                     status = 1
         else:
-            status = self.__runCommand_redir(command, solution)
+            status = self.__runCommand_redir(command, solution, callback)
         if hasattr(signal,"alarm"):
             signal.alarm(0)
         if hasattr(os,"times"):
@@ -510,14 +1061,73 @@ class runAUTO:
             raise AUTOExceptions.AUTORuntimeError("Error running AUTO")
 
     def __write_constants_solution(self, f, solution):
-        solution.c.write(f,new=True)
+        # the constants are written as str or as bytes, depending on
+        # whether they were read in the old format
+        c = _collect()
+        solution.c.write(c,new=True)
+        f.write("".encode("ascii").join(c))
         f.write("s='/'\n".encode("ascii"))
         solution.write(f,mlab=True)
 
-    def __runCommand_noredir(self,command,solution=None):
+    def __follow(self,callback):
+        # returns a function that passes what was added to the output
+        # files since its previous call to callback
+        v = self.options["constants"].get("sv")
+        if v:
+            files = ["b."+v, "s."+v, "d."+v]
+        else:
+            files = ["fort.7", "fort.8", "fort.9"]
+        fort7 = parseB.followB(files[0])
+        fort8 = parseS.followS(files[1])
+        def poll():
+            points = fort7.read()
+            solutions = fort8.read()
+            if points or solutions:
+                if callback(points, solutions):
+                    # the number of points to keep when stopping
+                    poll.npoints = poll.seen + getattr(callback, "npoints",
+                                                       len(points))
+                    return True
+                poll.seen = poll.seen + len(points)
+        poll.files = files
+        poll.seen = 0
+        return poll
+
+    def __stop(self,obj,poll):
+        # stop AUTO at the request of the callback and cut the output
+        # files after the last point the callback saw, keeping only
+        # labelled points with a complete solution
+        try:
+            obj.terminate()
+        except OSError:
+            # it already finished
+            pass
+        obj.wait()
+        _cutoutput(poll.files, poll.npoints)
+        self.stopped = True
+
+    def __wait(self,obj,callback=None):
+        if callback is None:
+            return obj.wait()
+        poll = self.__follow(callback)
+        status = obj.poll()
+        while status is None:
+            if poll():
+                self.__stop(obj, poll)
+                return 0
+            time.sleep(self.pollinterval)
+            status = obj.poll()
+        # the callback may still stop the finished run at its last points
+        if poll():
+            self.__stop(obj, poll)
+        return status
+
+    def __runCommand_noredir(self,command,solution=None,callback=None):
         sys.stdout.flush()
         args = os.path.expandvars(command).split()
         if solution is None:
+            if "subprocess" in sys.modules and callback is not None:
+                return self.__wait(subprocess.Popen(args), callback)
             if "subprocess" in sys.modules:
                 return subprocess.call(args)
             elif hasattr(os,"spawnlp"):
@@ -537,10 +1147,10 @@ class runAUTO:
             self.__write_constants_solution(stdin, solution)
         stdin.close()
         if "subprocess" in sys.modules:
-            status = obj.wait()
+            status = self.__wait(obj, callback)
         return status
 
-    def __runCommand_redir(self,command,solution=None):
+    def __runCommand_redir(self,command,solution=None,callback=None):
         global demo_killed
         tmp_out = []
         if "subprocess" in sys.modules or hasattr(popen2,"Popen3"):
@@ -560,9 +1170,48 @@ class runAUTO:
                              demo_object.fromchild, demo_object.childerr)
                 teststatus = -1
             if solution is not None:
-                self.__write_constants_solution(stdin, solution)
+                if hasattr(stdin, 'buffer'):
+                    self.__write_constants_solution(stdin.buffer, solution)
+                else:
+                    self.__write_constants_solution(stdin, solution)
             stdin.close()
             status = demo_object.poll()
+            if callback is not None and "subprocess" in sys.modules:
+                # read the output in a separate thread so that the output
+                # files are also followed while AUTO prints nothing
+                import threading
+                try:
+                    from queue import Queue, Empty
+                except ImportError: # Python 2
+                    from Queue import Queue, Empty
+                lines = Queue()
+                def pump():
+                    for line in iter(stdout.readline, ""):
+                        lines.put(line)
+                    lines.put(None)
+                reader = threading.Thread(target=pump)
+                reader.daemon = True
+                reader.start()
+                poll = self.__follow(callback)
+                while True:
+                    try:
+                        line = lines.get(timeout=self.pollinterval)
+                    except Empty:
+                        line = ""
+                    if line is None:
+                        break
+                    if line:
+                        sys.stdout.write(line)
+                        sys.stdout.flush()
+                        tmp_out.append(line)
+                    if not self.stopped and poll():
+                        self.__stop(demo_object, poll)
+                reader.join()
+                status = demo_object.wait()
+                if self.stopped:
+                    status = 0
+                else:
+                    poll()
             while status == teststatus:
                 try:
                     line = stdout.readline()
@@ -603,7 +1252,256 @@ class runAUTO:
             f.close()
             raise AUTOExceptions.AUTORuntimeError("Error running AUTO")
 
+def _testauto(directory):
+    # a fake AUTO installation in directory for the tests. Its compiler
+    # appends the name of every file it builds to directory/compiled.
+    # The equations it builds split their input into fort.2 (the
+    # constants) and fort.3 (the solution), write the solution back as
+    # fort.8 and the test fort.7 as fort.7, and print their directory,
+    # their constants and their data file. Returns the AUTO directory.
+    auto_dir = os.path.join(directory, "auto")
+    for d in ["cmds", "lib", "include"]:
+        os.makedirs(os.path.join(auto_dir, d))
+    compiler = os.path.join(auto_dir, "cmds", "fc")
+    program = os.path.join(auto_dir, "cmds", "auto")
+    f = open(os.path.join(auto_dir, "cmds", "cmds.make"), "w")
+    f.write("FC = sh %s\nCC = sh %s\nFFLAGS =\nCFLAGS =\nOPT = -O\nSRC =\n"%(
+            compiler, compiler))
+    f.close()
+    f = open(compiler, "w")
+    f.write('for arg; do\n'
+            '    if [ "$prev" = -o ]; then out=$arg; fi\n'
+            '    prev=$arg\n'
+            'done\n'
+            'echo $out >> %s\n'
+            'case $out in\n'
+            '*.exe) cp %s $out; chmod +x $out;;\n'
+            '*) touch $out;;\n'
+            'esac\n'%(os.path.join(directory, "compiled"), program))
+    f.close()
+    f = open(program, "w")
+    f.write("#!/bin/sh\n"
+            "cat > stdin\n"
+            "sed \"/^s='\\/'/,\\$d\" stdin > fort.2\n"
+            "sed \"1,/^s='\\/'/d\" stdin > fort.3\n"
+            "cp fort.3 fort.8\n"
+            "cp %s fort.7\n"
+            "touch fort.9\n"
+            "pwd\n"
+            "grep IRS fort.2\n"
+            "cat data.dat\n"%os.path.abspath(os.path.join("test_data",
+                                                          "fort.7")))
+    f.close()
+    return auto_dir
+
 def test():
+    import tempfile
+    print("Testing cutting the output of a stopped run")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        names = [os.path.join(tmpdir, c+".t") for c in "bsd"]
+        # a diagnostics block for every point of the branch in fort.7
+        blocks = []
+        for pt in range(1, 151):
+            blocks.append("  -4 %5d   0   Jacobian matrix:\n"
+                          "  BR    PT  TY  LAB    PAR(1)        L2-NORM\n"
+                          "  -4 %5d        0   1.00000E+00   2.00000E+00\n"
+                          "  -4 %5d         Eigenvalue  1:  -1.00000E+00"
+                          "   0.00000E+00\n" % (pt, pt, pt))
+        fort9 = ("="*47+"\n").join(blocks) + "="*47 + "\n"
+        fort8 = open("test_data/fort.8","rb").read()
+        ends = parseS._solutionends(fort8)
+        # stop after 100 points, and before the label without a solution
+        for npoints, nsolutions, rows, labels in [(100, 5, 100, [6,7,8]),
+                                                  (None, 2, 89, [6,7])]:
+            shutil.copy("test_data/fort.7", names[0])
+            f = open(names[1],"wb")
+            f.write(fort8[:ends[nsolutions-1]])
+            f.close()
+            f = open(names[2],"w")
+            f.write(fort9)
+            f.close()
+            _cutoutput(names, npoints)
+            b = parseB.parseB(names[0])
+            s = parseS.parseS(names[1])
+            d = parseD.parseD(names[2])
+            if (len(b.branches[0]) != rows or b.getLabels() != labels or
+                s.getLabels() != labels):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Labels do not match after cutting")
+            points = [diag["Point number"] for diag in d
+                      if diag["Point number"] != 0]
+            if points != list(range(1, rows+1)):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Diagnostics do not match after cutting")
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("Testing running several solutions at once")
+    tmpdir = tempfile.mkdtemp()
+    cache = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = os.path.join(tmpdir, "cache")
+    log = StringIO()
+    runner = runAUTO(auto_dir=_testauto(tmpdir), dir=tmpdir)
+    try:
+        runner.config(log=log)
+        f = open(os.path.join(tmpdir, "t.f"), "w")
+        f.write("      END\n")
+        f.close()
+        f = open(os.path.join(tmpdir, "data.dat"), "w")
+        f.write("1 2\n")
+        f.close()
+        fort8 = parseS.parseS("test_data/fort.8")
+        solutions = [fort8.load(IRS=i, e="t", dat="data") for i in [6,7,8]]
+        jobs = runner.prepare(solutions)
+        for job in jobs:
+            if job[3] != [(os.path.join(os.path.realpath(tmpdir), "data.dat"),
+                           "data.dat")]:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Data file not prepared")
+        scratch = runner.makescratch(jobs[0])
+        try:
+            if not os.path.isfile(os.path.join(scratch, "data.dat")):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Data file not in the scratch directory")
+            runner.collect(scratch, solutions[0].c)
+        except AUTOExceptions.AUTORuntimeError:
+            # there is no output
+            pass
+        else:
+            raise AUTOExceptions.AUTORegressionError(
+                "Missing output not reported")
+        shutil.rmtree(scratch)
+        for workers in [1, 2]:
+            log.truncate(0)
+            log.seek(0)
+            bds = runner.runmany(solutions, workers)
+            # every run prints its directory, its IRS and its data file
+            out = log.getvalue().splitlines()[-9:]
+            scratches = out[0::3]
+            if (out[1::3] != ["IRS =   %d"%i for i in [6,7,8]] or
+                out[2::3] != ["1 2"]*3 or len(set(scratches)) != 3):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Runs not separate or not in order")
+            for scratch in scratches:
+                if os.path.exists(scratch):
+                    raise AUTOExceptions.AUTORegressionError(
+                        "Scratch directory not removed")
+            for bd, solution in zip(bds, solutions):
+                if (list(bd()[0].coordarray[0]) !=
+                    list(solution.coordarray[0])):
+                    raise AUTOExceptions.AUTORegressionError(
+                        "Results not in order")
+        runner.config(log=None)
+
+        print("Testing caching run results")
+        runner.config(log=log)
+        runs = os.path.join(tmpdir, "runs")
+        def cachedrun(npr, cache=runs):
+            # run from label 6 with NPR=npr, which does not change the
+            # size of the output; returns whether the result was cached
+            log.truncate(0)
+            log.seek(0)
+            runner.load(solution=fort8, IRS=6, e="t", dat="data", NPR=npr)
+            bd = runner.run(cache=cache)
+            if list(bd()[0].coordarray[0]) != list(fort8(6).coordarray[0]):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Wrong result from the cache")
+            return "done (cached)" in log.getvalue()
+        def entries():
+            return sorted(os.listdir(runs))
+        if cachedrun(1) or not cachedrun(1):
+            raise AUTOExceptions.AUTORegressionError(
+                "Run result not cached")
+        first = entries()
+        # the data file is part of the key
+        f = open(os.path.join(tmpdir, "data.dat"), "w")
+        f.write("3 4\n")
+        f.close()
+        if cachedrun(1) or cachedrun(2):
+            raise AUTOExceptions.AUTORegressionError(
+                "Cached result of a different run used")
+        # keep room for two results, and make the first one the oldest
+        # but then use it again
+        size = 0
+        for name in os.listdir(os.path.join(runs, first[0])):
+            size = size + os.path.getsize(os.path.join(runs, first[0], name))
+        runner.cachesize = 2 * size
+        for i, name in enumerate(entries()):
+            os.utime(os.path.join(runs, name), (i + 1, i + 1))
+        cachedrun(1)
+        used = [name for name in entries() if
+                os.stat(os.path.join(runs, name)).st_mtime > 10]
+        if cachedrun(3) or len(entries()) != 2 or used[0] not in entries():
+            raise AUTOExceptions.AUTORegressionError(
+                "Least recently used results not removed")
+        del runner.cachesize
+        if not cachedrun(3) or cachedrun(2):
+            raise AUTOExceptions.AUTORegressionError(
+                "Wrong results removed")
+        # clean(cache=True) removes the default cache
+        cachedrun(1, True)
+        import AUTOCommands
+        curdir = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            AUTOCommands.clean(cache=True)
+        finally:
+            os.chdir(curdir)
+        runner.config(log=None)
+        if (os.listdir(os.path.join(_cachedir(), "runs")) != [] or
+            glob.glob(os.path.join(_cachedir(), "*.exe")) != []):
+            raise AUTOExceptions.AUTORegressionError("Cache not cleaned")
+
+        print("Testing caching compiled equations")
+        runner.config(log=log)
+        def make():
+            # builds t.exe from scratch; returns what was compiled
+            for name in ["t.o", "t.exe"]:
+                if os.path.exists(name):
+                    os.remove(name)
+            compiled = os.path.join(tmpdir, "compiled")
+            if os.path.exists(compiled):
+                os.remove(compiled)
+            if not runner._runAUTO__make("t") or not os.path.exists("t.exe"):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Equations not built")
+            if not os.path.exists(compiled):
+                return []
+            return open(compiled).read().split()
+        os.chdir(tmpdir)
+        try:
+            if make() != ["t.o", "t.exe"] or make() != []:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Cached executable not used")
+            # a changed AUTO header makes the executable stale
+            f = open(os.path.join(runner.options["auto_dir"], "include",
+                                  "auto.h"), "w")
+            f.write("#define NEW\n")
+            f.close()
+            if make() != ["t.o", "t.exe"]:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Stale cached executable used")
+            executables = glob.glob(os.path.join(_cachedir(), "*.exe"))
+            if len(executables) != 2:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Executable not cached")
+            # keep the most recently used one
+            os.utime(executables[0], (1, 1))
+            cleanexecutables(os.path.getsize(executables[1]))
+            if glob.glob(os.path.join(_cachedir(), "*.exe")) != executables[1:]:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Least recently used executable not removed")
+        finally:
+            os.chdir(curdir)
+    finally:
+        runner.config(log=None)
+        if cache is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = cache
+        shutil.rmtree(tmpdir)
+
     log = StringIO()
     stdout = sys.stdout
     class teeStringIO(object):
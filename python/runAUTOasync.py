@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+# Running AUTO from an asyncio event loop; this module needs Python 3.5
+# or newer, and is only imported by AUTOCommands.arun.
+import asyncio
+import os
+import shutil
+import sys
+
+class AUTOrun(object):
+    """One run of AUTO in an asyncio event loop.
+
+    The run starts as soon as it is awaited or iterated over.
+    Iterating with "async for" gives the lines that AUTO writes to
+    standard output, and awaiting the run gives the resulting
+    bifurcation diagram. Output that was not iterated over is written
+    to sys.stdout, as with run().
+
+    The run happens in its own scratch directory, so many runs can
+    happen at the same time from one event loop.
+    """
+    def __init__(self, runner, solution, job, finish=None):
+        self.runner = runner
+        self.solution = solution
+        self.job = job
+        self.finish = finish
+        self.process = None
+        self.scratch = None
+        self.__writer = None
+        self.__result = None
+
+    async def start(self):
+        """Start AUTO, if it has not been started yet."""
+        if self.process is not None:
+            return
+        self.scratch = self.runner.makescratch(self.job)
+        self.process = await asyncio.create_subprocess_exec(
+            *self.job[0], cwd=self.scratch, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        # write the constants and solution while the output is read
+        self.__writer = asyncio.ensure_future(self.__write())
+
+    async def __write(self):
+        stdin = self.process.stdin
+        try:
+            stdin.write(self.job[1])
+            await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # AUTO stopped before reading all of its input
+            pass
+        stdin.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.start()
+        line = await self.process.stdout.readline()
+        if not line:
+            raise StopAsyncIteration
+        return line.decode("ascii", "replace")
+
+    async def wait(self):
+        """Wait for AUTO to finish and return the bifurcation diagram."""
+        if self.__result is not None:
+            return self.__result
+        await self.start()
+        try:
+            async for line in self:
+                sys.stdout.write(line)
+            sys.stdout.flush()
+            await self.__writer
+            status = await self.process.wait()
+            self.__result = self.runner.collect(self.scratch, self.solution.c,
+                                                status)
+        finally:
+            if self.process.returncode is None:
+                # cancelled: do not leave AUTO running
+                self.process.kill()
+                await self.process.wait()
+            shutil.rmtree(self.scratch, True)
+        if self.finish is not None:
+            self.finish(self.__result)
+        return self.__result
+
+    def __await__(self):
+        return self.wait().__await__()
+
+def test():
+    import AUTOExceptions
+    import runAUTO
+    class job(object):
+        pass
+    # "AUTO" here is a shell script that echoes its input and writes
+    # trivial output files if it finds its data file
+    script = ("cat; test -f data.dat && "
+              "for f in 7 8 9; do echo '   0' > fort.$f; done")
+    class runner(object):
+        makescratch = runAUTO.runAUTO.makescratch
+        def collect(self, scratch, constants, status):
+            files = sorted(os.listdir(scratch))
+            return status, files
+    solution = job()
+    solution.c = {}
+    async def main():
+        runs = [AUTOrun(runner(), solution,
+                        (["sh", "-c", script], ("line %d\n"%i).encode("ascii"),
+                         None, [(os.path.abspath(__file__), "data.dat")]))
+                for i in range(5)]
+        lines = []
+        async for line in runs[0]:
+            lines.append(line)
+        results = await asyncio.gather(*runs)
+        return lines, results
+    loop = asyncio.new_event_loop()
+    try:
+        lines, results = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    if lines != ["line 0\n"]:
+        raise AUTOExceptions.AUTORegressionError("Output incorrect")
+    for status, files in results:
+        if status != 0 or files != ["data.dat", "fort.7", "fort.8", "fort.9"]:
+            raise AUTOExceptions.AUTORegressionError(
+                "Result incorrect")
+    print("runAUTOasync passed all tests")
+
+if __name__ == "__main__":
+    test()
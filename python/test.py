@@ -1,9 +1,12 @@
 #! /usr/bin/env python
+import sys
 import AUTOExceptions
 
 modules = ["parseB", "parseS", "parseBandS", "parseC", "parseH",
            "AUTOclui", "interactiveBindings", "AUTOCommands",
            "parseD", "bifDiag", "runDemo", "runAUTO"]
+if sys.version_info >= (3, 5):
+    modules.append("runAUTOasync")
 
 regressions = []
 for module in modules:
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 #global imports for the whole file
-import re,sys,getopt,os
+import re,sys,getopt,os,bisect
 try:
     import cStringIO
 except ImportError: # Python 3
@@ -10,6 +10,7 @@ try:
 except ImportError: # Python 3
     from urllib.request import pathname2url
 import parseB
+import Points
 
 #A few template strings which will be used later for reports, etc.
 
@@ -36,7 +37,7 @@ correct string:
 
 no_matching_float="""
 Trial string has a non float where the correct string has a float:
-demo:          %s
+%-15s%s
 correct_value: %s
 trial value:   %s
 
@@ -54,19 +55,166 @@ DEMO_MINOR_DATA_ERROR=1
 DEMO_MAJOR_DATA_ERROR=2
 DEMO_FAILED=4
 
+# A regular expression for finding floating point numbers
+float_regex=re.compile('[ -][0-9]\.[0-9]+[-+eE][-+0-9][0-9]+',re.S)
+# A regular expression for finding a header
+header_regex=re.compile('BR',re.S)
+
+def find_floats(s):
+    """Find all floating point numbers in s that need to be compared.
+
+    Returns the lists of start and end positions and texts of the
+    numbers, and the shape of each one, which is its position within
+    its line together with the number of floats on that line.
+    Comparison starts after the first header; a CPU time value is
+    skipped, along with everything up to the header that follows it."""
+    headers = [item.end() for item in header_regex.finditer(s)]
+    pos = 0
+    if len(headers) > 0:
+        pos = headers[0]
+    starts, ends, texts, shapes = [], [], [], []
+    line = s.count("\n", 0, pos)
+    linestart = len(starts)
+    lastpos = pos
+    for item in float_regex.finditer(s, pos):
+        start, end = item.span()
+        if start < pos:
+            continue
+        newlines = s.count("\n", lastpos, start)
+        lastpos = start
+        if newlines > 0:
+            line += newlines
+            linestart = len(starts)
+        if s[start-7:start-3] == "Time":
+            i = bisect.bisect_left(headers, end)
+            if i < len(headers):
+                pos = headers[i]
+            else:
+                pos = end
+            continue
+        starts.append(start)
+        ends.append(end)
+        texts.append(item.group())
+        shapes.append([line, len(starts) - 1 - linestart])
+    # shape: (index within line, number of floats on the line)
+    count = {}
+    for shape in shapes:
+        count[shape[0]] = count.get(shape[0], 0) + 1
+    shapes = [(shape[1], count[shape[0]]) for shape in shapes]
+    return starts, ends, texts, shapes
+
+def compare_floats(correct, trial, epsilon, abseps):
+    """Compare two sequences of floats of equal length in bulk.
+
+    Returns the indices where the values differ by more than abseps
+    in absolute terms and by more than epsilon in relative terms,
+    together with the differences and relative differences at those
+    indices."""
+    if not Points.numpyimported:
+        Points.importnumpy()
+    if Points.fromstring is not None:
+        N = Points.N
+        correct = N.asarray(correct, 'd')
+        trial = N.asarray(trial, 'd')
+        diff = abs(trial-correct)
+        with N.errstate(divide='ignore', invalid='ignore'):
+            ratio1 = N.where(trial == 0.0, abs(correct)+epsilon,
+                             abs(diff/trial))
+            ratio2 = N.where(correct == 0.0, abs(trial)+epsilon,
+                             abs(diff/correct))
+        ratio = N.maximum(ratio1, ratio2)
+        indices = N.nonzero((diff > abseps) & (ratio > epsilon))[0]
+        return list(indices), list(diff[indices]), list(ratio[indices])
+    indices, diffs, ratios = [], [], []
+    for i in range(len(correct)):
+        correct_data = correct[i]
+        trial_data = trial[i]
+        diff = abs(trial_data-correct_data)
+        if trial_data == 0.0:
+            ratio1 = abs(correct_data)+epsilon
+        else:
+            ratio1 = abs(diff/trial_data)
+        if correct_data == 0.0:
+            ratio2 = abs(trial_data)+epsilon
+        else:
+            ratio2 = abs(diff/correct_data)
+        ratio = max(ratio1, ratio2)
+        if diff > abseps and ratio > epsilon:
+            indices.append(i)
+            diffs.append(diff)
+            ratios.append(ratio)
+    return indices, diffs, ratios
+
+def markup(s, starts, ends, template):
+    # put the template around the given spans of s
+    lst = []
+    pos = 0
+    for start, end in zip(starts, ends):
+        lst.extend([s[pos:start], template%s[start:end]])
+        pos = end
+    lst.append(s[pos:])
+    return "".join(lst)
+
+def compare(name, correct_string, trial_string, epsilon, abseps,
+            kind="demo"):
+    """Compare the floating point numbers in correct_string and
+    trial_string, and return a tuple as check_demo does.
+
+    The numbers are aligned by their position in the lines with
+    numbers: if they do not line up DEMO_MAJOR_DATA_ERROR is returned
+    for the first one that does not, otherwise all numbers are
+    compared at once and DEMO_MINOR_DATA_ERROR is returned if any of
+    them are not within epsilon percentage of each other."""
+    correct = find_floats(correct_string)
+    trial = find_floats(trial_string)
+    n = len(correct[0])
+    if len(trial[0]) < n:
+        n = len(trial[0])
+    i = n
+    if correct[3][:n] != trial[3][:n]:
+        i = [c == t for c, t in zip(correct[3], trial[3])].index(False)
+    if i < len(correct[0]):
+        start, end = correct[0][i], correct[1][i]
+        correct_string = markup(correct_string, [start], [end],
+                                "<B><font color=Red>%s</font></B>")
+        trial_value = None
+        if i < len(trial[0]):
+            trial_value = trial[2][i]
+            trial_string = markup(trial_string, [trial[0][i]], [trial[1][i]],
+                                  "<B><font color=Red>%s</font></B>")
+        return (DEMO_MAJOR_DATA_ERROR,
+                no_matching_float%(kind+":",name,correct[2][i],trial_value,
+                                   trial_string,correct_string))
+    n = len(correct[0])
+    correct_data = parseB.AUTOatofs(" ".join(correct[2]), n)
+    trial_data = parseB.AUTOatofs(" ".join(trial[2][:n]), n)
+    indices, diffs, ratios = compare_floats(correct_data, trial_data,
+                                            epsilon, abseps)
+    if len(indices) == 0:
+        return (DEMO_OK,"")
+
+    # This is where the report get stored until it gets returned
+    report = cStringIO.StringIO()
+    for i in indices:
+        report.write("Files do not match at the %dth character for %s %s\n"%(
+            correct[0][i],kind,name))
+        report.write("Value of trial is %e\n"%trial_data[i])
+        report.write("Value of correct file is %e\n\n"%correct_data[i])
+    template = "<I><font color=Blue>%s</font></I>"
+    correct_string = markup(correct_string, [correct[0][i] for i in indices],
+                            [correct[1][i] for i in indices], template)
+    trial_string = markup(trial_string, [trial[0][i] for i in indices],
+                          [trial[1][i] for i in indices], template)
+    return (DEMO_MINOR_DATA_ERROR,report.getvalue()+
+            different_floats%(trial_string,correct_string),
+            float(max(ratios)),float(max(diffs)))
+
 def check_demo(demo,correct_filename,trial_filename,epsilon,abseps):
-    # A regular expression for finding floating point numbers
-    float_regex=re.compile('[ -][0-9]\.[0-9]+[-+eE][-+0-9][0-9]+',re.S)
     # A regular expression for finding each demo block
     demo_regex=re.compile("Demo %s is started.*Demo %s is done"%(demo,demo),re.S,)
-    # A regular expression for finding a header
-    header_regex=re.compile('BR',re.S)
     # A regular expression for finding each error block
     error_regex=re.compile("===%s start===.*===%s end==="%(demo,demo),re.S)
 
-    # This is where the report get stored until it gets returned
-    report = cStringIO.StringIO()
-
     # Search for all possible demos in each file
     correct_file=open(correct_filename,"r")
     correct_file=correct_file.read()
@@ -95,81 +243,73 @@ def check_demo(demo,correct_filename,trial_filename,epsilon,abseps):
     # Now that we have the corresponding blocks from each file we look at each
     # Floating point number is each and see if they are within epsilon
     # percentage of each other.
-    end=0
-    offset=1
-    correct_item=header_regex.search(correct_string,0)
-    trial_item=header_regex.search(trial_string,0)
-    maxdiff = 0
-    maxratio = 0
-    if correct_item is not None and trial_item is not None:
-        end=correct_item.end()
-        offset=trial_item.end()-end
-    while True:
-        start=end
-        correct_item=float_regex.search(correct_string,start)
-        if correct_item is None:
-            break
-        start=correct_item.start()
-        end=correct_item.end()
-        trial_item=float_regex.search(trial_string[start+offset-1:end+offset+1])
-        correct_data=parseB.AUTOatof(correct_item.group())
-        try:
-            trial_data=parseB.AUTOatof(trial_item.group())
-            if trial_item.start() > 0:
-                offset=trial_item.start()+offset-1
-        except (ValueError, AttributeError):
-            correct_string="%s<B><font color=Red>%s</font></B>%s"%(
-                correct_string[:start],correct_string[start:end],
-                correct_string[end:])
-            trial_string="%s<B><font color=Red>%s</font></B>%s"%(
-                trial_string[:start+offset],trial_string[start+offset:end+offset],
-                trial_string[end+offset:])
-            return (DEMO_MAJOR_DATA_ERROR,
-                    no_matching_float%(demo,correct_item.group(),trial_item,
-                                       trial_string,correct_string))
-
-        if correct_string[start-7:start-3] == "Time":
-            start=end
-            correct_item=header_regex.search(correct_string,start)
-            trial_item=header_regex.search(trial_string,start+offset)
-            if correct_item is not None and trial_item is not None:
-                start=correct_item.start()
-                end=correct_item.end()
-                offset=trial_item.end()-end
-        else:
-            diff = abs(trial_data-correct_data)
-            if trial_data == 0.0:
-                ratio1 = abs(correct_data)+epsilon
-            else:
-                ratio1 = abs(diff/trial_data)
+    return compare(demo,correct_string,trial_string,epsilon,abseps)
 
-            if correct_data == 0.0:
-                ratio2 = abs(trial_data)+epsilon
-            else:
-                ratio2 = abs(diff/correct_data)
-            ratio = max(ratio1, ratio2)
-
-            if diff > abseps and ratio > epsilon:
-                maxdiff = max(diff, maxdiff)
-                maxratio = max(ratio, maxratio)
-                report.write("Files do not match at the %dth character for demo %s\n"%(start,demo))
-                report.write("Value of trial is %e\n"%trial_data)
-                report.write("Value of correct file is %e\n\n"%correct_data)
-                correct_string="%s<I><font color=Blue>%s</font></I>%s"%(
-                    correct_string[:start],correct_string[start:end],
-                    correct_string[end:])
-                trial_string="%s<I><font color=Blue>%s</font></I>%s"%(
-                    trial_string[:start+offset],trial_string[start+offset:end+offset],
-                    trial_string[end+offset:])
-                start += 31
-                end += 31
-    report_string = report.getvalue()
-    if len(report_string)==0:
-        return (DEMO_OK,"")
-    else:
-        return (DEMO_MINOR_DATA_ERROR,report_string+
-                different_floats%(trial_string,correct_string),
-                maxratio,maxdiff)
+def check_file(correct_filename,trial_filename,epsilon=None,abseps=None):
+    """Compare the numbers in two AUTO output files, for instance two
+    b., s. or d. files, and return a tuple as check_demo does."""
+    if epsilon is None:
+        epsilon = 0.01
+    if abseps is None:
+        abseps = 1e-7
+    correct_file=open(correct_filename,"r")
+    correct_string=correct_file.read()
+    correct_file.close()
+    trial_file=open(trial_filename,"r")
+    trial_string=trial_file.read()
+    trial_file.close()
+    return compare(trial_filename,correct_string,trial_string,epsilon,abseps,
+                   kind="file")
+
+def test():
+    import shutil
+    import tempfile
+    import AUTOExceptions
+    head = "Demo t is started\n  BR    PT  TY  LAB    PAR(1)        L2-NORM\n"
+    tail = " Total Time    0.148E+00\nDemo t is done\n"
+    lines = ["   1     1  EP    1   1.00000E+00   2.00000E+00\n",
+             "   1     2        2  -1.10000E+00   2.10000E-08\n"]
+    # the verdicts of the earlier search for every number in turn: shifted
+    # columns and a different CPU time are fine, differences up to epsilon
+    # or abseps too, and a missing number is a major error
+    cases = [
+        (lines, tail.replace("0.148", "0.297"), DEMO_OK),
+        ([" "+lines[0], lines[1].replace("  -1.1", " -1.1")], tail, DEMO_OK),
+        ([lines[0].replace("1.00000E+00", "1.00900E+00"), lines[1]], tail,
+         DEMO_OK),
+        ([lines[0].replace("1.00000E+00", "1.01100E+00"), lines[1]], tail,
+         DEMO_MINOR_DATA_ERROR),
+        ([lines[0], lines[1].replace("2.10000E-08", "9.10000E-08")], tail,
+         DEMO_OK),
+        ([lines[0].replace("2.00000E+00", "        NaN"), lines[1]], tail,
+         DEMO_MAJOR_DATA_ERROR)]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        correct = os.path.join(tmpdir, "correct")
+        trial = os.path.join(tmpdir, "trial")
+        f = open(correct, "w")
+        f.write(head + "".join(lines) + tail)
+        f.close()
+        for trial_lines, trial_tail, verdict in cases:
+            f = open(trial, "w")
+            f.write(head + "".join(trial_lines) + trial_tail)
+            f.close()
+            report = check_demo("t", correct, trial, 0.01, 1e-7)
+            if report[0] != verdict:
+                raise AUTOExceptions.AUTORegressionError(
+                    "Wrong verdict %d instead of %d"%(report[0], verdict))
+            if verdict == DEMO_MINOR_DATA_ERROR and (
+                abs(report[2] - 0.011) > 1e-12 or
+                abs(report[3] - 0.011) > 1e-12):
+                raise AUTOExceptions.AUTORegressionError(
+                    "Wrong differences %s %s"%report[2:])
+        # check_file compares in the same way
+        if (check_file(correct, correct)[0] != DEMO_OK or
+            check_file(correct, trial)[0] != DEMO_MAJOR_DATA_ERROR):
+            raise AUTOExceptions.AUTORegressionError("Wrong file verdict")
+    finally:
+        shutil.rmtree(tmpdir)
+    print("parse_test passed all tests")
 
 #====================== HTMLGen style class and functions ========
 
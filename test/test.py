@@ -6,6 +6,8 @@ import getopt
 import os
 import sys, shutil
 import time
+import tempfile
+import subprocess
 import platform
 from interactiveBindings import AUTOInteractiveConsole
 import AUTOclui
@@ -38,16 +40,123 @@ class nostdin(object):
     def readline(self):
         return "\n"
 
-def test(demos, versions=None, log_file=None, parse=True):
-    sys.stdin = nostdin()
+def _groups(demos):
     if demos == "selec":
-        demos = DIR1
+        return DIR1
     if demos == "hom":
-        demos = DIR2
+        return DIR2
     if demos == "all97":
-        demos = DIR3
+        return DIR3
     if demos == "all":
-        demos = DIR4
+        return DIR4
+    if isinstance(demos, str):
+        return [demos]
+    return demos
+
+def _rundemo(d, version, runner, log, err):
+    print("Version "+version)
+    auto_dir=os.path.join(os.environ["AUTO_DIR"],"..",version)
+    demo_dir=os.path.join(auto_dir,"demos",d)
+    autofiles = []
+    if os.path.exists(os.path.join(demo_dir,"%s.auto"%d)):
+        autofiles = ["%s.auto"%d]
+    else:
+        autofiles = [dirname for dirname in os.listdir(demo_dir) if
+                     dirname[-5:]=='.auto']
+        autofiles.sort()
+    if len(autofiles) > 0:
+        oldcwd = os.getcwd()
+        tmpdir = os.path.join(oldcwd,'tmp')
+        try:
+            shutil.rmtree(tmpdir)
+        except OSError:
+            pass
+        try:
+            os.mkdir(tmpdir)
+        except OSError:
+            pass
+        os.chdir(tmpdir)
+        AUTOclui.copydemo(d)
+        log.write("Demo %s is started\n"%d)
+        for autofile in autofiles:
+            os.chdir(tmpdir)
+            runner.auto(autofile)
+        os.chdir(oldcwd)
+        log.write("Demo %s is done\n"%d)
+        return tmpdir
+    runDemo.runDemo(d, verbose="yes", log=log, err=err, auto_dir=auto_dir)
+
+def _append(filename, fromname):
+    # append the contents of one log file to another
+    try:
+        f = open(fromname,"rb")
+    except IOError:
+        return
+    out = open(filename,"ab")
+    shutil.copyfileobj(f, out)
+    out.close()
+    f.close()
+
+def _testparallel(demos, versions, log_file, jobs):
+    # Every demo runs in its own worker process (test.py is started on a
+    # single demo) inside its own scratch directory, so the os.chdir()s and
+    # environment changes done by runDemo do not interfere.  The logs of the
+    # workers are then concatenated in demo order, giving the same log
+    # files as a sequential run.
+    scratch = tempfile.mkdtemp(prefix="autotest", dir=os.getcwd())
+    env = os.environ.copy()
+    path = [os.path.join(os.environ["AUTO_DIR"],"python")]
+    if env.get("PYTHONPATH"):
+        path.append(env["PYTHONPATH"])
+    env["PYTHONPATH"] = os.pathsep.join(path)
+    vflags = {"2000": "-c", "97": "-f", "07p": "-p"}
+    devnull = open(os.devnull)
+    todo = list(enumerate(demos))
+    running = []
+    workdirs = []
+    while todo or running:
+        while todo and len(running) < jobs:
+            i, d = todo.pop(0)
+            workdir = os.path.join(scratch, str(i))
+            os.mkdir(workdir)
+            workdirs.append(workdir)
+            cmd = [sys.executable, os.path.abspath(__file__)]
+            cmd.extend([vflags[version] for version in versions])
+            if len(log_file)!=0:
+                cmd.extend(["-l", os.path.join(workdir,"log")])
+            cmd.append(d)
+            output = open(os.path.join(workdir,"output"),"w")
+            print("Started "+d)
+            running.append((d, output, subprocess.Popen(cmd, cwd=workdir,
+                env=env, stdin=devnull, stdout=output,
+                stderr=subprocess.STDOUT)))
+        time.sleep(0.1)
+        for job in running[:]:
+            d, output, p = job
+            if p.poll() is not None:
+                output.close()
+                running.remove(job)
+                print("Done "+d)
+    devnull.close()
+    for workdir in workdirs:
+        f = open(os.path.join(workdir,"output"))
+        sys.stdout.write(f.read())
+        f.close()
+        if len(log_file)!=0:
+            for version in versions:
+                name = os.path.join(workdir,"log")+version
+                _append(log_file+version, name)
+                _append(log_file+version+"errors", name+"errors")
+    shutil.rmtree(scratch, ignore_errors=True)
+
+def test(demos, versions=None, log_file=None, parse=True, jobs=1):
+    """Run the demos and compare the results with parse_test.
+
+    demos is a list of demo names, or one of "selec", "hom", "all97" or
+    "all".  If jobs > 1, up to that many demos run simultaneously,
+    each in a separate worker process."""
+    sys.stdin = nostdin()
+    demos = _groups(demos)
 
     if log_file is None:
         hostname = platform.node()
@@ -59,6 +168,17 @@ def test(demos, versions=None, log_file=None, parse=True):
         versions = ['07p']
 
     log_files = []
+    if jobs > 1:
+        for version in versions:
+            if len(log_file)!=0:
+                log_files.append(log_file+version)
+                open(log_file+version,"w").close()
+                open(log_file+version+"errors","w").close()
+        _testparallel(demos, versions, log_file, jobs)
+        if parse:
+            parse_test.parse(log_files, demos=demos)
+        return
+
     log = {}
     err = {}
     runner = {}
@@ -73,43 +193,13 @@ def test(demos, versions=None, log_file=None, parse=True):
         runner[version] = AUTOInteractiveConsole(AUTOclui.exportFunctions(
                 log[version],err[version]))
 
-    autofiles = []
+    tmpdir = None
     for d in demos:
         print("Doing "+d)
         for version in versions:
-            print("Version "+version)
-            auto_dir=os.path.join(os.environ["AUTO_DIR"],"..",version)
-            demo_dir=os.path.join(auto_dir,"demos",d)
-            autofiles = []
-            if os.path.exists(os.path.join(demo_dir,"%s.auto"%d)):
-                autofiles = ["%s.auto"%d]
-            else:
-                autofiles = [dirname for dirname in os.listdir(demo_dir) if
-                             dirname[-5:]=='.auto']
-                autofiles.sort()
-            if len(autofiles) > 0:
-                oldcwd = os.getcwd()
-                tmpdir = os.path.join(oldcwd,'tmp')
-                try:
-                    shutil.rmtree(tmpdir)
-                except OSError:
-                    pass
-                try:
-                    os.mkdir(tmpdir)
-                except OSError:
-                    pass
-                os.chdir(tmpdir)
-                AUTOclui.copydemo(d)
-                log[version].write("Demo %s is started\n"%d)
-                for autofile in autofiles:
-                    os.chdir(tmpdir)
-                    runner[version].auto(autofile)
-                os.chdir(oldcwd)
-                log[version].write("Demo %s is done\n"%d)
-            else:
-                runDemo.runDemo(d, verbose="yes", log=log[version],
-                                err=err[version], auto_dir=auto_dir)
-    if len(autofiles) > 0:
+            tmpdir = _rundemo(d, version, runner[version], log[version],
+                              err[version]) or tmpdir
+    if tmpdir is not None:
         try:
             shutil.rmtree(tmpdir)
         except OSError:
@@ -125,7 +215,7 @@ def test(demos, versions=None, log_file=None, parse=True):
         parse_test.parse(log_files, demos=demos)
 
 if __name__ == '__main__':
-    opts_list,args=getopt.getopt(sys.argv[1:],"cfpl:i:")
+    opts_list,args=getopt.getopt(sys.argv[1:],"cfpl:i:j:")
 
     #defaults
     versions = []
@@ -135,14 +225,15 @@ if __name__ == '__main__':
     for x in opts_list:
         opts[x[0]]=x[1]
 
-    if opts.has_key("-c"):
+    if "-c" in opts:
         versions.append("2000")
-    if opts.has_key("-f"):
+    if "-f" in opts:
         versions.append("97")
-    if opts.has_key("-p"):
+    if "-p" in opts:
         versions.append("07p")
-    if opts.has_key("-l"):
+    if "-l" in opts:
         log_file=opts["-l"]
 
-    demos = args[0]
-    test(args[0], versions, log_file, parse=False)
+    jobs = int(opts.get("-j", 1))
+
+    test(args[0], versions, log_file, parse=False, jobs=jobs)